@@ -0,0 +1,5 @@
+# Load the Celery app with Django so that tasks queued and results polled from
+# the web process use the broker and result backend configured in settings.
+from .celery import app as celery_app
+
+__all__ = ('celery_app',)
@@ -10,7 +10,15 @@ app.autodiscover_tasks()
 
 app.conf.beat_schedule = {
     'do-something-every-night': {
-        'task': 'main_app.tasks.some_night_task_XXXXXX',
+        'task': 'main_app.tasks.some_night_task',
         'schedule': crontab(hour=1, minute=0),  # day_of_week='tue'
     },
+    'flush-llm-usage-every-minute': {
+        'task': 'main_app.tasks.flush_llm_usage',
+        'schedule': crontab(),
+    },
+    'ingest-mailboxes-every-5-minutes': {
+        'task': 'main_app.tasks.ingest_mailboxes',
+        'schedule': crontab(minute='*/5'),
+    },
 }
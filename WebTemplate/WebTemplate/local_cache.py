@@ -0,0 +1,58 @@
+"""
+Process-local LRU cache shared by the application-level caches.
+
+Used as the first, I/O-free tier in front of Redis by ``swift.token_cache``
+and ``main_app.llm_cache``. Each process keeps its own copy, so entries must
+expire on their own (``ttl``) to pick up changes made by other workers.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Generic, Hashable, Optional, TypeVar
+
+
+K = TypeVar('K', bound=Hashable)
+V = TypeVar('V')
+
+
+class LocalLRUCache(Generic[K, V]):
+    """A small thread-safe LRU with per-entry expiry."""
+
+    def __init__(self, max_size: int, ttl: float) -> None:
+        self.max_size: int = max_size
+        self.ttl: float = ttl
+        self._data: OrderedDict[K, tuple[float, V]] = OrderedDict()
+        self._lock: threading.Lock = threading.Lock()
+
+    def get(self, key: K) -> Optional[V]:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: K, value: V) -> None:
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def delete(self, key: K) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
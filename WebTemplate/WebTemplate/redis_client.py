@@ -0,0 +1,39 @@
+"""
+Shared Redis client for application-level caches and counters.
+
+Celery and Channels manage their own Redis connections. Everything else that
+needs Redis (counters, caches, locks) goes through ``get_redis()`` so the
+whole process shares one connection pool configured by ``settings.REDIS_URL``.
+"""
+
+import threading
+from typing import Optional
+
+import redis
+from django.conf import settings
+
+
+_client: Optional[redis.Redis] = None
+_client_lock: threading.Lock = threading.Lock()
+
+
+def get_redis() -> redis.Redis:
+    """
+    Return the process-wide Redis client, creating it on first use.
+
+    redis-py connection pools detect forks and reconnect in the child, so the
+    client is safe to create before gunicorn or Celery fork their workers.
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = redis.Redis.from_url(settings.REDIS_URL, socket_timeout=getattr(settings, 'REDIS_SOCKET_TIMEOUT', 1.0))
+    return _client
+
+
+def set_redis(client: Optional[redis.Redis]) -> None:
+    """Replace the shared client, e.g. with a fakeredis instance in tests."""
+    global _client
+    with _client_lock:
+        _client = client
@@ -1,5 +1,5 @@
 from pathlib import Path
-import os, sys
+import json, os, sys
 from firebase_admin import initialize_app, credentials
 
 BASE_DIR_docs = Path(__file__).resolve(strict=True).parent.parent
@@ -49,7 +49,7 @@ CHANNEL_LAYERS = {
     "default": {
         "BACKEND": "channels_redis.core.RedisChannelLayer",
         "CONFIG": {
-            "hosts": [("127.0.0.1", 6379)],
+            "hosts": [os.environ.get("CHANNEL_LAYERS_REDIS_URL", "redis://127.0.0.1:6379/0")],
         },
     },
 }
@@ -79,6 +79,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'users.context_processors.unread_notifications',
             ],
         },
     },
@@ -133,6 +134,22 @@ USE_TZ = True
 
 CELERY_BROKER_URL = os.environ.get("CELERY_BROKER_URL")
 CELERY_RESULT_BACKEND = os.environ.get("CELERY_RESULT_BACKEND")
+CELERY_RESULT_EXPIRES = int(os.environ.get("CELERY_RESULT_EXPIRES", 60 * 60))
+
+# Application Redis (counters, caches, locks) - see WebTemplate.redis_client
+REDIS_URL = os.environ.get("REDIS_URL", CELERY_BROKER_URL or "redis://127.0.0.1:6379/0")
+REDIS_SOCKET_TIMEOUT = float(os.environ.get("REDIS_SOCKET_TIMEOUT", 1.0))
+
+# Web notification fan-out (main_app.fanout)
+NOTIFICATION_FANOUT_CHUNK_SIZE = int(os.environ.get('NOTIFICATION_FANOUT_CHUNK_SIZE', 500))
+NOTIFICATION_FANOUT_SUBTASK_THRESHOLD = int(os.environ.get('NOTIFICATION_FANOUT_SUBTASK_THRESHOLD', 5000))
+# Seconds during which repeated events per (user, item, type) are merged (main_app.coalescing); 0 disables
+NOTIFICATION_COALESCE_WINDOW_SECONDS = int(os.environ.get('NOTIFICATION_COALESCE_WINDOW_SECONDS', 0))
+# Nightly is_new reset (main_app.tasks.some_night_task)
+NOTIFICATION_RESET_MAX_AGE_HOURS = float(os.environ.get('NOTIFICATION_RESET_MAX_AGE_HOURS', 24))
+NOTIFICATION_RESET_CHUNK_SIZE = int(os.environ.get('NOTIFICATION_RESET_CHUNK_SIZE', 5000))
+# Unread notification badge counters in Redis (users.unread_counter)
+UNREAD_COUNTER_TTL = int(os.environ.get('UNREAD_COUNTER_TTL', 24 * 60 * 60))
 
 STATIC_URL = '/static/'
 STATIC_ROOT = os.path.join(BASE_DIR, 'static/')
@@ -146,6 +163,35 @@ EMAIL_USE_TLS = True
 EMAIL_HOST_USER = os.environ.get('EMAIL_HOST_USER')
 EMAIL_HOST_PASSWORD = os.environ.get('EMAIL_HOST_PASSWORD')
 DEFAULT_FROM_EMAIL = os.environ.get('DEFAULT_FROM_EMAIL')
+EMAIL_TIMEOUT = 30
+# Pooled SMTP transport for notification emails (users.smtp_pool)
+EMAIL_POOL_MAX_CONNECTIONS = int(os.environ.get('EMAIL_POOL_MAX_CONNECTIONS', 2))
+EMAIL_POOL_MAX_MESSAGES_PER_CONNECTION = int(os.environ.get('EMAIL_POOL_MAX_MESSAGES_PER_CONNECTION', 100))
+# Incoming mail (main_app.mail_sync); messages are fetched by UID in batches
+MAIL_IMAP_HOST = os.environ.get('MAIL_IMAP_HOST', 'mail.hosting.reg.ru')
+MAIL_IMAP_PORT = int(os.environ.get('MAIL_IMAP_PORT', 993))
+MAIL_IMAP_SSL = os.environ.get('MAIL_IMAP_SSL', 'True').lower() == 'true'
+MAIL_IMAP_USER = os.environ.get('MAIL_IMAP_USER', 'simpleboard@fintechdocs.ru')
+MAIL_IMAP_PASSWORD = os.environ.get('MAIL_IMAP_PASSWORD')
+MAIL_IMAP_TIMEOUT = float(os.environ.get('MAIL_IMAP_TIMEOUT', 60))
+MAIL_SYNC_BATCH_SIZE = int(os.environ.get('MAIL_SYNC_BATCH_SIZE', 50))
+# Attachments of incoming mail become Documents of this BusinessLogicModel (main_app.mail_attachments)
+MAIL_DOCUMENTS_ITEM_ID = int(os.environ['MAIL_DOCUMENTS_ITEM_ID']) if os.environ.get('MAIL_DOCUMENTS_ITEM_ID') else None
+MAIL_ATTACHMENT_EXTENSIONS = [
+    extension.strip().lower()
+    for extension in os.environ.get('MAIL_ATTACHMENT_EXTENSIONS', '.xlsx,.xls,.docx,.pdf,.csv,.txt').split(',')
+    if extension.strip()
+]
+MAIL_ATTACHMENT_CHUNK_BYTES = int(os.environ.get('MAIL_ATTACHMENT_CHUNK_BYTES', 1024 * 1024))
+# Mailboxes read by the ingest_mailboxes task (main_app.mail_ingest): a JSON list of accounts, e.g.
+# [{"user": "docs@example.ru", "password": "...", "mailboxes": ["INBOX", "Reports"], "item_id": 1}];
+# host, port, ssl, max_connections and item_id default to the MAIL_* values above.
+# Without it, the MAIL_IMAP_USER account and its MAIL_IMAP_MAILBOXES are read.
+MAIL_ACCOUNTS = json.loads(os.environ.get('MAIL_ACCOUNTS', '[]'))
+MAIL_IMAP_MAILBOXES = [name.strip() for name in os.environ.get('MAIL_IMAP_MAILBOXES', 'INBOX').split(',') if name.strip()]
+# Authenticated connections per account, pooled per worker process and capped across workers
+MAIL_IMAP_MAX_CONNECTIONS = int(os.environ.get('MAIL_IMAP_MAX_CONNECTIONS', 2))
+MAIL_INGEST_LOCK_TTL = int(os.environ.get('MAIL_INGEST_LOCK_TTL', 15 * 60))
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 NEIGHBORING_DIR = os.path.join(BASE_DIR, 'certificates')
@@ -159,6 +205,66 @@ YOOKASSA_SECRET_KEY = os.environ.get('YOOKASSA_SECRET_KEY', '')
 YOOKASSA_TEST_MODE = os.environ.get('YOOKASSA_TEST_MODE', 'True').lower() == 'true'
 
 
+# LLM client (main_app.llm_helper); the API key is read from DEEPSEEK_API_KEY
+LLM_MODEL = os.environ.get('LLM_MODEL', 'deepseek-chat')
+LLM_API_BASE = os.environ.get('LLM_API_BASE', 'https://api.deepseek.com/v1')
+LLM_MAX_TOKENS = int(os.environ.get('LLM_MAX_TOKENS', 2048))
+LLM_TIMEOUT = float(os.environ.get('LLM_TIMEOUT', 120))
+LLM_HTTP_MAX_CONNECTIONS = int(os.environ.get('LLM_HTTP_MAX_CONNECTIONS', 20))
+LLM_HTTP_MAX_KEEPALIVE = int(os.environ.get('LLM_HTTP_MAX_KEEPALIVE', 10))
+
+# Background LLM jobs (main_app.llm_jobs); results can be polled as long as Celery keeps them
+LLM_JOB_RESULT_TTL = CELERY_RESULT_EXPIRES
+LLM_JOB_CANCEL_CHECK_SECONDS = float(os.environ.get('LLM_JOB_CANCEL_CHECK_SECONDS', 1.0))
+
+# Cluster-wide upstream limits (main_app.llm_governor)
+LLM_GOVERNOR_ENABLED = os.environ.get('LLM_GOVERNOR_ENABLED', 'True').lower() == 'true'
+LLM_MAX_CONCURRENCY = int(os.environ.get('LLM_MAX_CONCURRENCY', 8))
+LLM_RATE_LIMIT_PER_SECOND = float(os.environ.get('LLM_RATE_LIMIT_PER_SECOND', 5))
+LLM_RATE_LIMIT_BURST = float(os.environ.get('LLM_RATE_LIMIT_BURST', 10))
+LLM_QUEUE_MAX_WAITING = int(os.environ.get('LLM_QUEUE_MAX_WAITING', 50))
+LLM_QUEUE_TIMEOUT = float(os.environ.get('LLM_QUEUE_TIMEOUT', 10))
+
+# Single-flight coalescing of identical deterministic calls (main_app.llm_singleflight);
+# the cross-worker lock lasts LLM_TIMEOUT plus a margin
+LLM_SINGLE_FLIGHT_WAIT = float(os.environ.get('LLM_SINGLE_FLIGHT_WAIT', 60))
+
+# Batch endpoint (main_app.views.llm_batch_view)
+LLM_BATCH_MAX_ITEMS = int(os.environ.get('LLM_BATCH_MAX_ITEMS', 100))
+LLM_BATCH_MAX_CONCURRENCY = int(os.environ.get('LLM_BATCH_MAX_CONCURRENCY', 8))
+LLM_BATCH_ITEM_TIMEOUT = float(os.environ.get('LLM_BATCH_ITEM_TIMEOUT', 60))
+
+# Conversation sessions (main_app.llm_conversations); sizes are estimated tokens
+LLM_CONVERSATION_CONTEXT_TOKENS = int(os.environ.get('LLM_CONVERSATION_CONTEXT_TOKENS', 4000))
+LLM_CONVERSATION_MAX_TURN_TOKENS = int(os.environ.get('LLM_CONVERSATION_MAX_TURN_TOKENS', 2000))
+LLM_CONVERSATION_SUMMARIZE = os.environ.get('LLM_CONVERSATION_SUMMARIZE', 'True').lower() == 'true'
+LLM_CONVERSATION_COMPACT_TOKENS = int(os.environ.get('LLM_CONVERSATION_COMPACT_TOKENS', 3000))
+LLM_CONVERSATION_KEEP_RECENT = int(os.environ.get('LLM_CONVERSATION_KEEP_RECENT', 6))
+LLM_CONVERSATION_SUMMARY_MAX_TOKENS = int(os.environ.get('LLM_CONVERSATION_SUMMARY_MAX_TOKENS', 512))
+
+# Retrieval over uploaded Documents (main_app.llm_retrieval)
+LLM_RETRIEVAL_CHUNK_WORDS = int(os.environ.get('LLM_RETRIEVAL_CHUNK_WORDS', 200))
+LLM_RETRIEVAL_CHUNK_OVERLAP = int(os.environ.get('LLM_RETRIEVAL_CHUNK_OVERLAP', 40))
+LLM_RETRIEVAL_TOP_K = int(os.environ.get('LLM_RETRIEVAL_TOP_K', 4))
+LLM_RETRIEVAL_MAX_K = int(os.environ.get('LLM_RETRIEVAL_MAX_K', 20))
+
+# Usage accounting (main_app.llm_usage); flush_llm_usage writes buffered records every minute
+LLM_USAGE_FLUSH_BATCH = int(os.environ.get('LLM_USAGE_FLUSH_BATCH', 500))
+LLM_USAGE_BUFFER_MAX = int(os.environ.get('LLM_USAGE_BUFFER_MAX', 100000))
+
+# Response cache for temperature=0 calls (main_app.llm_cache)
+LLM_CACHE_ENABLED = os.environ.get('LLM_CACHE_ENABLED', 'True').lower() == 'true'
+LLM_CACHE_LOCAL_SIZE = int(os.environ.get('LLM_CACHE_LOCAL_SIZE', 1024))
+LLM_CACHE_LOCAL_TTL = int(os.environ.get('LLM_CACHE_LOCAL_TTL', 300))
+LLM_CACHE_TTL = int(os.environ.get('LLM_CACHE_TTL', 24 * 60 * 60))
+
+
+# Device token cache (swift.token_cache)
+DEVICE_TOKEN_LOCAL_CACHE_SIZE = int(os.environ.get('DEVICE_TOKEN_LOCAL_CACHE_SIZE', 10000))
+DEVICE_TOKEN_LOCAL_TTL = int(os.environ.get('DEVICE_TOKEN_LOCAL_TTL', 60))
+DEVICE_TOKEN_CACHE_TTL = int(os.environ.get('DEVICE_TOKEN_CACHE_TTL', 3600))
+
+
 # FCM_DJANGO_SETTINGS = {
 #     "FCM_SERVER_KEY": os.environ.get('FCM_SERVER_KEY')
 # }
@@ -0,0 +1,151 @@
+"""
+Bulk fan-out engine for web notifications.
+
+This module turns "notify these users about this item" into as few INSERT
+statements as possible. Recipient ids are deduplicated, split into chunks of
+``NOTIFICATION_FANOUT_CHUNK_SIZE`` and each chunk is written with a single
+``bulk_create`` call. The Celery layer in ``main_app.tasks`` decides whether
+the chunks are written inline or dispatched as parallel subtasks.
+
+Typical usage example:
+
+    recipients = dedupe_recipients([3, 5, 3, 8])
+    for chunk in chunk_recipients(recipients, chunk_size=500):
+        timing = write_notification_chunk(item_id=42, notification_type=NotificationTypes.type_1, user_ids=chunk)
+        print(timing['rows_per_second'])
+"""
+
+import time
+from typing import Iterable, Iterator, Optional, TypedDict
+
+from django.conf import settings
+from django.db import transaction
+from users.models import NotificationTypes, WebNotifications
+from .coalescing import get_coalesce_window, merge_recent_notifications
+from .metrics import NOTIFICATION_EVENTS
+from users.realtime import publish_notifications
+from users.unread_counter import increment_unread
+
+
+class ChunkTiming(TypedDict, total=False):
+    """
+    Timing report for a single fan-out chunk.
+
+    Attributes:
+        chunk: Zero-based index of the chunk within the fan-out.
+        rows: Number of WebNotifications rows written by this chunk.
+        seconds: Wall-clock time spent in ``bulk_create`` for this chunk.
+        rows_per_second: Write throughput of the chunk.
+        merged: Recipients whose recent unread notification absorbed the
+            event instead of receiving a new row (fan-out only).
+    """
+
+    chunk: int
+    rows: int
+    seconds: float
+    rows_per_second: float
+    merged: int
+
+
+class FanoutReport(TypedDict):
+    """
+    Summary of one ``celery_notification`` run.
+
+    Attributes:
+        recipients: Number of unique recipients after deduplication.
+        chunks: Timings of the chunks written inline by this task.
+        subtasks: Number of chunks dispatched to parallel Celery subtasks.
+            Their timings are the return values of those subtasks.
+    """
+
+    recipients: int
+    chunks: list[ChunkTiming]
+    subtasks: int
+
+
+def get_chunk_size() -> int:
+    """Return the configured number of recipients written per chunk."""
+    return max(1, int(getattr(settings, 'NOTIFICATION_FANOUT_CHUNK_SIZE', 500)))
+
+
+def get_subtask_threshold() -> int:
+    """Return the audience size above which chunks are sent to parallel subtasks."""
+    return int(getattr(settings, 'NOTIFICATION_FANOUT_SUBTASK_THRESHOLD', 5000))
+
+
+def is_known_notification_type(notification_type: str) -> bool:
+    """Check that ``notification_type`` is one of the NotificationTypes values."""
+    return notification_type in NotificationTypes.values
+
+
+def dedupe_recipients(user_ids: Iterable[Optional[int]]) -> list[int]:
+    """
+    Remove duplicate and empty recipient ids while keeping the original order.
+
+    Args:
+        user_ids: Recipient ids as passed by the caller. May contain
+            duplicates, ``None`` or numeric strings coming from JSON payloads.
+
+    Returns:
+        list[int]: Unique recipient ids in first-seen order.
+    """
+    return list(dict.fromkeys(int(user_id) for user_id in user_ids if user_id is not None))
+
+
+def chunk_recipients(user_ids: list[int], chunk_size: Optional[int] = None) -> Iterator[list[int]]:
+    """
+    Split recipient ids into consecutive chunks.
+
+    Args:
+        user_ids: Deduplicated recipient ids.
+        chunk_size: Maximum ids per chunk. Defaults to ``get_chunk_size()``.
+
+    Yields:
+        list[int]: Slices of ``user_ids`` no longer than ``chunk_size``.
+    """
+    size: int = chunk_size or get_chunk_size()
+    for start in range(0, len(user_ids), size):
+        yield user_ids[start:start + size]
+
+
+def write_notification_chunk(item_id: int, notification_type: str, user_ids: list[int], chunk: int = 0) -> ChunkTiming:
+    """
+    Write one chunk of WebNotifications rows with a single ``bulk_create``.
+
+    Recipients who already have an unread notification of the same item and
+    type inside the coalescing window get that notification's ``event_count``
+    bumped instead of a new row; both happen in one transaction that holds
+    the lock of the (item, type) pair (see merge_recent_notifications). Once
+    the rows are written the new recipients' unread counters are incremented
+    and a real-time event is published to their WebSocket groups.
+
+    Args:
+        item_id: The ID of the item that triggered the notification.
+        notification_type: One of the NotificationTypes values.
+        user_ids: Recipient ids for this chunk.
+        chunk: Index of the chunk, used only for reporting.
+
+    Returns:
+        ChunkTiming: Rows written, events merged and the time it took.
+    """
+    with transaction.atomic():
+        merged: set[int] = merge_recent_notifications(item_id, notification_type, user_ids, get_coalesce_window())
+        new_user_ids: list[int] = [user_id for user_id in user_ids if user_id not in merged]
+        rows: list[WebNotifications] = [
+            WebNotifications(item_id=item_id, user_id=user_id, notification_type=notification_type)
+            for user_id in new_user_ids
+        ]
+        started: float = time.perf_counter()
+        WebNotifications.objects.bulk_create(rows, batch_size=len(rows) or None)
+        seconds: float = time.perf_counter() - started
+    increment_unread(new_user_ids)
+    publish_notifications(new_user_ids, item_id, notification_type)
+    NOTIFICATION_EVENTS.labels(channel='web', outcome='delivered').inc(len(rows))
+    NOTIFICATION_EVENTS.labels(channel='web', outcome='merged').inc(len(merged))
+    return {
+        'chunk': chunk,
+        'rows': len(rows),
+        'seconds': seconds,
+        'rows_per_second': len(rows) / seconds if seconds > 0 else float(len(rows)),
+        'merged': len(merged),
+    }
@@ -0,0 +1,391 @@
+"""
+Local IMAP4rev1 stand-in for the mail ingestion code.
+
+Implements the subset of RFC 3501 that ``imaplib`` needs to log in, select a
+mailbox and read it by UID (``UID SEARCH`` and ``UID FETCH``), over plain
+TCP, so the ingestion path can be tested without a mail server. FETCH
+supports ``UID``, ``RFC822``, ``INTERNALDATE``, ``BODYSTRUCTURE`` and
+``BODY.PEEK[section]`` with an optional ``<offset.length>`` range, and
+NOOP answers health checks. Mailboxes live in memory; the
+server counts the commands it answers and the messages and bytes it sends,
+which makes the cost of a sync directly observable. ``message/rfc822``
+parts are not supported.
+
+Typical usage example:
+
+    with StubIMAPServer() as stub:
+        stub.add_message("INBOX", raw_bytes)
+        with override_settings(MAIL_IMAP_HOST=stub.host, MAIL_IMAP_PORT=stub.port, MAIL_IMAP_SSL=False):
+            fetch_email_data()
+        print(stub.commands['UID FETCH'], stub.fetched_messages)
+"""
+
+import email
+import re
+import socket
+import socketserver
+import threading
+from collections import Counter
+from datetime import datetime, timezone
+from email.message import Message
+from email.utils import collapse_rfc2231_value
+from typing import Any, Optional
+
+
+_TOKEN_RE = re.compile(rb'"((?:[^"\\]|\\.)*)"|(\S+)')
+_FETCH_ITEM_RE = re.compile(r'[A-Z0-9.]+(?:\[[^\]]*\])?(?:<\d+\.\d+>)?', re.IGNORECASE)
+_BODY_SECTION_RE = re.compile(r'BODY(?:\.PEEK)?\[([\d.]*)\](?:<(\d+)\.(\d+)>)?')
+
+
+def _string(value: str) -> bytes:
+    """Encode a string as an IMAP quoted string, or as a literal if it is not plain ASCII."""
+    data: bytes = value.encode()
+    if data.isascii() and b"\r" not in data and b"\n" not in data:
+        return b'"' + data.replace(b"\\", b"\\\\").replace(b'"', b'\\"') + b'"'
+    return f"{{{len(data)}}}\r\n".encode() + data
+
+
+def _parameters(part: Message, header: str = 'content-type') -> bytes:
+    params = part.get_params(header=header) or []
+    pairs: list[bytes] = [
+        _string(key.upper()) + b" " + _string(collapse_rfc2231_value(value))
+        for key, value in params[1:]
+    ]
+    return b"(" + b" ".join(pairs) + b")" if pairs else b"NIL"
+
+
+def _disposition(part: Message) -> bytes:
+    disposition: Optional[str] = part.get_content_disposition()
+    if disposition is None:
+        return b"NIL"
+    return b"(" + _string(disposition.upper()) + b" " + _parameters(part, 'content-disposition') + b")"
+
+
+def _body_structure(part: Message, section: str, sections: dict[str, bytes]) -> bytes:
+    """Build the BODYSTRUCTURE of a part, storing the encoded body of every leaf by section."""
+    maintype: str = part.get_content_maintype()
+    if maintype == 'multipart':
+        children: bytes = b"".join(
+            _body_structure(child, f"{section}.{number}" if section else str(number), sections)
+            for number, child in enumerate(part.get_payload(), 1)
+        )
+        return (b"(" + children + b" " + _string(part.get_content_subtype().upper()) + b" "
+                + _parameters(part) + b" " + _disposition(part) + b" NIL NIL)")
+    if maintype == 'message':
+        raise ValueError("message/* parts are not supported")
+    body: bytes = part.get_payload().encode('ascii', 'surrogateescape')
+    sections[section or "1"] = body
+    fields: list[bytes] = [
+        _string(maintype.upper()), _string(part.get_content_subtype().upper()), _parameters(part), b"NIL", b"NIL",
+        _string((part.get('Content-Transfer-Encoding') or '7bit').upper()), str(len(body)).encode(),
+    ]
+    if maintype == 'text':
+        fields.append(str(body.count(b"\n")).encode())
+    fields += [b"NIL", _disposition(part), b"NIL", b"NIL"]
+    return b"(" + b" ".join(fields) + b")"
+
+
+class _StoredMessage:
+    def __init__(self, uid: int, raw: bytes, received: datetime) -> None:
+        self.uid: int = uid
+        self.raw: bytes = raw
+        self.received: datetime = received
+        # Encoded body of every leaf part, by section number ("1", "2.1", ...)
+        self.sections: dict[str, bytes] = {}
+        self.body_structure: bytes = _body_structure(email.message_from_bytes(raw), "", self.sections)
+
+
+class _Mailbox:
+    def __init__(self, uidvalidity: int) -> None:
+        self.uidvalidity: int = uidvalidity
+        self.next_uid: int = 1
+        # In ascending UID order
+        self.messages: list[_StoredMessage] = []
+
+
+def _parse_sequence_set(sequence_set: str, highest: int) -> set[int]:
+    """Expand an IMAP sequence set such as ``1,4:6,9:*`` against the highest UID."""
+    numbers: set[int] = set()
+    for part in sequence_set.split(","):
+        low, _, high = part.partition(":")
+        first: int = highest if low == "*" else int(low)
+        last: int = first if not high else highest if high == "*" else int(high)
+        numbers.update(range(min(first, last), max(first, last) + 1))
+    return numbers
+
+
+def _tokens(line: bytes) -> list[str]:
+    """Split a command line into atoms and (unescaped) quoted strings."""
+    tokens: list[str] = []
+    for match in _TOKEN_RE.finditer(line):
+        if match.group(1) is not None:
+            tokens.append(re.sub(rb'\\(.)', rb'\1', match.group(1)).decode())
+        else:
+            tokens.append(match.group(2).decode())
+    return tokens
+
+
+class _IMAPHandler(socketserver.StreamRequestHandler):
+    server: "_StubIMAPTCPServer"
+
+    def setup(self) -> None:
+        super().setup()
+        # Responses are written line by line; don't let Nagle delay the tagged completion
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.mailbox: Optional[_Mailbox] = None
+        self.authenticated: bool = False
+        with self.server.lock:
+            self.server.connections += 1
+
+    def handle(self) -> None:
+        self._send(b"* OK IMAP4rev1 stub ready")
+        while True:
+            line: bytes = self.rfile.readline()
+            if not line:
+                return
+            tokens: list[str] = _tokens(line.rstrip(b"\r\n"))
+            if len(tokens) < 2:
+                self._send(b"* BAD empty command")
+                continue
+            tag, command, args = tokens[0], tokens[1].upper(), tokens[2:]
+            if command == "UID" and args:
+                command, args = f"UID {args[0].upper()}", args[1:]
+            with self.server.lock:
+                self.server.commands[command] += 1
+            if not self._dispatch(tag, command, args):
+                return
+
+    def _dispatch(self, tag: str, command: str, args: list[str]) -> bool:
+        if command == "LOGOUT":
+            self._send(b"* BYE logging out")
+            self._ok(tag, command)
+            return False
+        if command == "CAPABILITY":
+            self._send(b"* CAPABILITY IMAP4rev1 AUTH=PLAIN")
+        elif command == "NOOP":
+            pass
+        elif command == "LOGIN":
+            if (args[0], args[1]) != (self.server.user, self.server.password):
+                self._send(f"{tag} NO [AUTHENTICATIONFAILED] invalid credentials".encode())
+                return True
+            self.authenticated = True
+            with self.server.lock:
+                self.server.logins += 1
+        elif not self.authenticated:
+            self._send(f"{tag} BAD not authenticated".encode())
+            return True
+        elif command in ("SELECT", "EXAMINE"):
+            return self._select(tag, command, args[0])
+        elif command == "CLOSE":
+            self.mailbox = None
+        elif self.mailbox is None:
+            self._send(f"{tag} BAD no mailbox selected".encode())
+            return True
+        elif command == "UID SEARCH":
+            self._uid_search(args)
+        elif command == "UID FETCH":
+            self._uid_fetch(args[0], " ".join(args[1:]))
+        else:
+            self._send(f"{tag} BAD unsupported command {command}".encode())
+            return True
+        self._ok(tag, command)
+        return True
+
+    def _select(self, tag: str, command: str, name: str) -> bool:
+        with self.server.lock:
+            mailbox: Optional[_Mailbox] = self.server.mailboxes.get(name)
+        if mailbox is None:
+            self._send(f"{tag} NO [NONEXISTENT] no such mailbox".encode())
+            return True
+        self.mailbox = mailbox
+        self._send(f"* {len(mailbox.messages)} EXISTS".encode())
+        self._send(b"* 0 RECENT")
+        self._send(f"* OK [UIDVALIDITY {mailbox.uidvalidity}] UIDs valid".encode())
+        self._send(f"* OK [UIDNEXT {mailbox.next_uid}] predicted next UID".encode())
+        access: str = "READ-ONLY" if command == "EXAMINE" else "READ-WRITE"
+        self._send(f"{tag} OK [{access}] {command} completed".encode())
+        return True
+
+    def _uid_search(self, args: list[str]) -> None:
+        messages: list[_StoredMessage] = list(self.mailbox.messages)
+        highest: int = messages[-1].uid if messages else 0
+        uids: list[int] = [message.uid for message in messages]
+        if len(args) >= 2 and args[0].upper() == "UID":
+            wanted: set[int] = _parse_sequence_set(args[1], highest)
+            uids = [uid for uid in uids if uid in wanted]
+        self._send(" ".join(["* SEARCH", *map(str, uids)]).encode())
+
+    def _uid_fetch(self, sequence_set: str, items: str) -> None:
+        messages: list[_StoredMessage] = list(self.mailbox.messages)
+        highest: int = messages[-1].uid if messages else 0
+        wanted: set[int] = _parse_sequence_set(sequence_set, highest)
+        names: list[str] = [item.upper() for item in _FETCH_ITEM_RE.findall(items)]
+        for number, message in enumerate(messages, 1):
+            if message.uid not in wanted:
+                continue
+            parts: list[bytes] = [f"UID {message.uid}".encode()]
+            for name in names:
+                if name == "UID":
+                    continue
+                if name == "BODYSTRUCTURE":
+                    parts.append(b"BODYSTRUCTURE " + message.body_structure)
+                    continue
+                if name == "INTERNALDATE":
+                    parts.append(b"INTERNALDATE " + _string(message.received.strftime("%d-%b-%Y %H:%M:%S %z")))
+                    continue
+                response_name, data = self._fetch_item(name, message)
+                parts.append(f"{response_name} {{{len(data)}}}\r\n".encode() + data)
+                with self.server.lock:
+                    self.server.fetched_bytes += len(data)
+            with self.server.lock:
+                self.server.fetched_messages += 1
+            self._send(f"* {number} FETCH (".encode() + b" ".join(parts) + b")")
+
+    def _fetch_item(self, name: str, message: _StoredMessage) -> tuple[str, bytes]:
+        if name in ("RFC822.HEADER", "BODY[HEADER]", "BODY.PEEK[HEADER]"):
+            return name.replace(".PEEK", ""), message.raw.split(b"\r\n\r\n", 1)[0] + b"\r\n\r\n"
+        if name == "RFC822":
+            return name, message.raw
+        match = _BODY_SECTION_RE.fullmatch(name)
+        if match is None:
+            raise ValueError(f"Unsupported FETCH item {name}")
+        section, origin, length = match.groups()
+        data: bytes = message.sections.get(section, b"") if section else message.raw
+        if origin is None:
+            return f"BODY[{section}]", data
+        return f"BODY[{section}]<{origin}>", data[int(origin):int(origin) + int(length)]
+
+    def _ok(self, tag: str, command: str) -> None:
+        self._send(f"{tag} OK {command} completed".encode())
+
+    def _send(self, data: bytes) -> None:
+        self.wfile.write(data + b"\r\n")
+        self.wfile.flush()
+
+
+class _StubIMAPTCPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address: tuple[str, int], user: str, password: str) -> None:
+        super().__init__(address, _IMAPHandler)
+        self.user: str = user
+        self.password: str = password
+        self.mailboxes: dict[str, _Mailbox] = {}
+        self.uidvalidity: int = 1000
+        self.connections: int = 0
+        self.logins: int = 0
+        self.fetched_messages: int = 0
+        self.fetched_bytes: int = 0
+        self.commands: Counter = Counter()
+        self.lock: threading.Lock = threading.Lock()
+
+
+class StubIMAPServer:
+    """
+    IMAP server holding in-memory mailboxes, running in a background thread.
+
+    Args:
+        host: Interface to bind.
+        port: Port to bind; 0 picks a free one.
+        user: Accepted login.
+        password: Accepted password.
+        mailboxes: Names of the mailboxes to create; more are created by
+            add_message.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, user: str = "user", password: str = "password",
+                 mailboxes: tuple[str, ...] = ("INBOX",)) -> None:
+        self._server: _StubIMAPTCPServer = _StubIMAPTCPServer((host, port), user, password)
+        self._thread: Optional[threading.Thread] = None
+        for name in mailboxes:
+            self._mailbox(name)
+
+    @property
+    def host(self) -> str:
+        return self._server.server_address[0]
+
+    @property
+    def port(self) -> int:
+        return self._server.server_address[1]
+
+    @property
+    def connections(self) -> int:
+        """Number of TCP connections accepted so far."""
+        return self._server.connections
+
+    @property
+    def logins(self) -> int:
+        """Number of successful LOGIN commands."""
+        return self._server.logins
+
+    @property
+    def commands(self) -> Counter:
+        """Commands answered so far, e.g. ``commands['UID FETCH']``."""
+        return self._server.commands
+
+    @property
+    def fetched_messages(self) -> int:
+        """Number of messages returned by UID FETCH, counting every response."""
+        return self._server.fetched_messages
+
+    @property
+    def fetched_bytes(self) -> int:
+        """Size of the message data (literals) returned by UID FETCH."""
+        return self._server.fetched_bytes
+
+    def _mailbox(self, name: str) -> _Mailbox:
+        with self._server.lock:
+            if name not in self._server.mailboxes:
+                self._server.uidvalidity += 1
+                self._server.mailboxes[name] = _Mailbox(self._server.uidvalidity)
+            return self._server.mailboxes[name]
+
+    def add_message(self, mailbox: str, raw: bytes, received: Optional[datetime] = None) -> int:
+        """
+        Append a message (RFC 5322 bytes) to a mailbox and return its UID.
+
+        ``received`` is its INTERNALDATE, the time it arrived; defaults to now.
+        """
+        box: _Mailbox = self._mailbox(mailbox)
+        message_raw: bytes = raw.replace(b"\r\n", b"\n").replace(b"\n", b"\r\n")
+        with self._server.lock:
+            uid: int = box.next_uid
+            box.next_uid += 1
+            box.messages.append(_StoredMessage(uid, message_raw, received or datetime.now(timezone.utc)))
+        return uid
+
+    def expunge(self, mailbox: str, uid: int) -> None:
+        """Remove a message; its UID is never reused."""
+        box: _Mailbox = self._mailbox(mailbox)
+        with self._server.lock:
+            box.messages = [message for message in box.messages if message.uid != uid]
+
+    def renumber(self, mailbox: str) -> int:
+        """
+        Assign a new UIDVALIDITY and new UIDs from 1, as a server does when a
+        mailbox is recreated, and return the new UIDVALIDITY.
+        """
+        box: _Mailbox = self._mailbox(mailbox)
+        with self._server.lock:
+            self._server.uidvalidity += 1
+            box.uidvalidity = self._server.uidvalidity
+            for uid, message in enumerate(box.messages, 1):
+                message.uid = uid
+            box.next_uid = len(box.messages) + 1
+            return box.uidvalidity
+
+    def start(self) -> "StubIMAPServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> "StubIMAPServer":
+        return self.start()
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.stop()
@@ -0,0 +1,98 @@
+"""
+Two-tier cache of deterministic LLM responses.
+
+Calls with ``temperature == 0`` return the same completion for the same input,
+so ``get_llm_response`` looks them up here before going to the upstream API:
+
+    1. A process-local LRU (``LLM_CACHE_LOCAL_SIZE`` entries, expiring after
+       ``LLM_CACHE_LOCAL_TTL`` seconds), answered without any I/O.
+    2. Redis (``llm_response:<sha256>``, ``LLM_CACHE_TTL`` seconds), shared by
+       all workers.
+
+The key is a SHA-256 of (model, system_message, prompt, temperature,
+max_tokens), so prompts never appear in Redis key names. Only successful
+responses are stored. Redis errors are logged and treated as misses, and
+every lookup is counted in the ``llm_cache_requests_total`` metric.
+"""
+
+import hashlib
+import json
+import logging
+from typing import Optional
+
+from django.conf import settings
+from redis.exceptions import RedisError
+
+from WebTemplate.local_cache import LocalLRUCache
+from WebTemplate.redis_client import get_redis
+from .metrics import LLM_CACHE_REQUESTS
+
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX: str = "llm_response:"
+
+local_cache: LocalLRUCache[str, str] = LocalLRUCache(
+    max_size=getattr(settings, 'LLM_CACHE_LOCAL_SIZE', 1024),
+    ttl=getattr(settings, 'LLM_CACHE_LOCAL_TTL', 300),
+)
+
+
+def is_cacheable(temperature: float) -> bool:
+    """Only deterministic (temperature 0) calls are cached, and only when the cache is enabled."""
+    return getattr(settings, 'LLM_CACHE_ENABLED', True) and float(temperature) == 0.0
+
+
+def cache_key(model: str, system_message: Optional[str], prompt: str, temperature: float, max_tokens: int) -> str:
+    """
+    Build the cache key of one LLM call.
+
+    Args:
+        model: Model name.
+        system_message: Optional system prompt.
+        prompt: User prompt.
+        temperature: Sampling temperature.
+        max_tokens: Completion token limit.
+
+    Returns:
+        str: ``llm_response:`` followed by the hex SHA-256 of the inputs.
+    """
+    payload: str = json.dumps([model, system_message or "", prompt, float(temperature), int(max_tokens)],
+                              ensure_ascii=False, separators=(',', ':'))
+    return KEY_PREFIX + hashlib.sha256(payload.encode()).hexdigest()
+
+
+def get_cached_response(key: str) -> Optional[str]:
+    """
+    Return the cached completion for ``key``, checking the local tier first.
+
+    A Redis hit is copied into the local tier so the next lookup in this
+    process needs no I/O.
+    """
+    value: Optional[str] = local_cache.get(key)
+    if value is not None:
+        LLM_CACHE_REQUESTS.labels(tier='local', outcome='hit').inc()
+        return value
+    LLM_CACHE_REQUESTS.labels(tier='local', outcome='miss').inc()
+
+    try:
+        raw: Optional[bytes] = get_redis().get(key)
+    except RedisError as e:
+        logger.warning("LLM cache read failed: %s", e)
+        raw = None
+    if raw is None:
+        LLM_CACHE_REQUESTS.labels(tier='redis', outcome='miss').inc()
+        return None
+    LLM_CACHE_REQUESTS.labels(tier='redis', outcome='hit').inc()
+    value = raw.decode()
+    local_cache.set(key, value)
+    return value
+
+
+def set_cached_response(key: str, value: str) -> None:
+    """Store a completion in both tiers."""
+    local_cache.set(key, value)
+    try:
+        get_redis().set(key, value, ex=getattr(settings, 'LLM_CACHE_TTL', 24 * 60 * 60))
+    except RedisError as e:
+        logger.warning("LLM cache write failed: %s", e)
@@ -0,0 +1,245 @@
+"""
+Server-side conversation sessions for the LLM endpoints.
+
+A ``Conversation`` stores the history of a chat, so a client sends only the
+new user turn and the request size stays constant. The context sent upstream
+for every turn is bounded as well:
+
+    - the system message, merged with the running summary of older turns;
+    - the most recent messages that fit in ``LLM_CONVERSATION_CONTEXT_TOKENS``
+      together with the new turn, newest first; older ones are left out.
+
+When ``conversation.summarize`` is set and the messages not yet summarized
+exceed ``LLM_CONVERSATION_COMPACT_TOKENS``, the ``compact_conversation`` task
+folds all but the last ``LLM_CONVERSATION_KEEP_RECENT`` of them into the
+summary, so older turns keep informing the model at a fixed cost.
+
+Token counts are estimated from the text length (about four characters per
+token), which needs no tokenizer download and is close enough for budgeting.
+
+Typical usage example:
+
+    conversation = create_conversation(user, system_message="You are a tutor.")
+    result = send_turn(conversation, "What is recursion?")
+    result = send_turn(conversation, "Give me an example.")
+"""
+
+import logging
+import math
+from typing import NotRequired, Optional, TypedDict
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Sum
+from kombu.exceptions import OperationalError
+from langchain.schema import AIMessage, BaseMessage, HumanMessage, SystemMessage
+from redis.exceptions import RedisError
+
+from WebTemplate.redis_client import get_redis
+from .llm_helper import LLMResponse, get_chat_response
+from .models import Conversation, ConversationMessage
+
+
+logger = logging.getLogger(__name__)
+
+COMPACT_LOCK_PREFIX: str = "llm_conversation_compact:"
+
+_SUMMARY_INSTRUCTION: str = (
+    "You maintain a running summary of a conversation between a user and an assistant. "
+    "Merge the existing summary and the new messages into one concise summary that keeps "
+    "facts, decisions, names and open questions. Answer with the summary only."
+)
+
+
+class TurnResult(TypedDict):
+    """
+    Result of one conversation turn.
+
+    Attributes:
+        success: Whether the model answered.
+        response: The answer, or None on failure.
+        error: The error message, or None on success.
+        context_tokens: Estimated tokens sent upstream for this turn.
+        retry_after: Only present when the upstream capacity is exhausted.
+    """
+
+    success: bool
+    response: Optional[str]
+    error: Optional[str]
+    context_tokens: int
+    retry_after: NotRequired[int]
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimate the token count of ``text`` (about four characters per token)."""
+    return max(1, math.ceil(len(text) / 4)) if text else 0
+
+
+def _setting(name: str, default: int) -> int:
+    return int(getattr(settings, name, default))
+
+
+def create_conversation(user=None, system_message: str = "", summarize: Optional[bool] = None) -> Conversation:
+    """
+    Start a conversation.
+
+    Args:
+        user: Owner of the conversation; None for an anonymous one, which is
+            reachable by anyone who knows its id.
+        system_message: Instruction sent with every turn.
+        summarize: Whether older turns are compacted into a summary. Defaults
+            to settings.LLM_CONVERSATION_SUMMARIZE.
+
+    Returns:
+        Conversation: The new conversation.
+    """
+    if summarize is None:
+        summarize = getattr(settings, 'LLM_CONVERSATION_SUMMARIZE', True)
+    return Conversation.objects.create(
+        user=user if user is not None and user.is_authenticated else None,
+        system_message=system_message or "",
+        summarize=summarize,
+    )
+
+
+def build_context(conversation: Conversation, prompt: str) -> tuple[list[BaseMessage], int]:
+    """
+    Build the bounded message list for the next turn.
+
+    Args:
+        conversation: The conversation.
+        prompt: The new user turn.
+
+    Returns:
+        tuple[list[BaseMessage], int]: The messages to send, oldest first,
+        and their estimated token count.
+    """
+    system_parts: list[str] = [conversation.system_message] if conversation.system_message else []
+    if conversation.summary:
+        system_parts.append(f"Summary of the earlier conversation:\n{conversation.summary}")
+    system_text: str = "\n\n".join(system_parts)
+    used: int = estimate_tokens(system_text) + estimate_tokens(prompt)
+    budget: int = _setting('LLM_CONVERSATION_CONTEXT_TOKENS', 4000) - used
+
+    recent: list[ConversationMessage] = []
+    pending = conversation.messages.filter(summarized=False).order_by('-id').only('role', 'content', 'tokens')
+    for message in pending.iterator(chunk_size=50):
+        if message.tokens > budget:
+            break
+        budget -= message.tokens
+        used += message.tokens
+        recent.append(message)
+    recent.reverse()
+    # Never start the window in the middle of a turn
+    while recent and recent[0].role == ConversationMessage.Roles.ASSISTANT:
+        used -= recent.pop(0).tokens
+
+    messages: list[BaseMessage] = [SystemMessage(content=system_text)] if system_text else []
+    for message in recent:
+        message_class = HumanMessage if message.role == ConversationMessage.Roles.USER else AIMessage
+        messages.append(message_class(content=message.content))
+    messages.append(HumanMessage(content=prompt))
+    return messages, used
+
+
+def pending_tokens(conversation: Conversation) -> int:
+    """Return the estimated tokens of the messages not folded into the summary yet."""
+    return conversation.messages.filter(summarized=False).aggregate(total=Sum('tokens'))['total'] or 0
+
+
+def send_turn(conversation: Conversation, prompt: str, temperature: float = 0.0) -> TurnResult:
+    """
+    Answer a new user turn in the context of the conversation.
+
+    The turn and the answer are stored together, only if the model answered,
+    so a failed turn can simply be sent again. Compaction is scheduled in the
+    background once the history outgrows LLM_CONVERSATION_COMPACT_TOKENS.
+
+    Args:
+        conversation: The conversation.
+        prompt: The new user turn.
+        temperature: Sampling temperature.
+
+    Returns:
+        TurnResult: The answer and the estimated size of the context sent.
+    """
+    messages, context_tokens = build_context(conversation, prompt)
+    response: LLMResponse = get_chat_response(messages, temperature=temperature)
+    result: TurnResult = {**response, 'context_tokens': context_tokens}
+    if not response['success']:
+        return result
+
+    with transaction.atomic():
+        ConversationMessage.objects.bulk_create([
+            ConversationMessage(conversation=conversation, role=ConversationMessage.Roles.USER, content=prompt,
+                                tokens=estimate_tokens(prompt)),
+            ConversationMessage(conversation=conversation, role=ConversationMessage.Roles.ASSISTANT,
+                                content=response['response'], tokens=estimate_tokens(response['response'])),
+        ])
+        conversation.save(update_fields=['updated_at'])
+
+    if conversation.summarize and pending_tokens(conversation) > _setting('LLM_CONVERSATION_COMPACT_TOKENS', 3000):
+        from .tasks import compact_conversation
+        try:
+            compact_conversation.delay(str(conversation.pk))
+        except OperationalError as e:
+            # The context stays bounded by trimming until the next turn schedules it again
+            logger.warning("Could not schedule compaction of conversation %s: %s", conversation.pk, e)
+    return result
+
+
+def compact(conversation_id: str) -> bool:
+    """
+    Fold all but the most recent messages of a conversation into its summary.
+
+    Only one worker compacts a conversation at a time (a Redis lock); others
+    return at once. The summary is generated by the model from the previous
+    summary and the folded messages, limited to
+    LLM_CONVERSATION_SUMMARY_MAX_TOKENS.
+
+    Args:
+        conversation_id: The conversation's id.
+
+    Returns:
+        bool: True if messages were folded into the summary.
+    """
+    conversation: Optional[Conversation] = Conversation.objects.filter(pk=conversation_id).first()
+    if conversation is None or not conversation.summarize:
+        return False
+
+    lock_key: str = f"{COMPACT_LOCK_PREFIX}{conversation_id}"
+    try:
+        if not get_redis().set(lock_key, 1, nx=True, ex=int(getattr(settings, 'LLM_TIMEOUT', 120)) + 30):
+            return False
+    except RedisError as e:
+        logger.warning("Compaction lock unavailable, compacting anyway: %s", e)
+        lock_key = ""
+    try:
+        pending: list[ConversationMessage] = list(conversation.messages.filter(summarized=False).order_by('id'))
+        folded: list[ConversationMessage] = pending[:max(0, len(pending) - _setting('LLM_CONVERSATION_KEEP_RECENT', 6))]
+        if not folded:
+            return False
+
+        transcript: str = "\n".join(f"{message.role.capitalize()}: {message.content}" for message in folded)
+        response: LLMResponse = get_chat_response(
+            [SystemMessage(content=_SUMMARY_INSTRUCTION),
+             HumanMessage(content=f"Existing summary:\n{conversation.summary or '(none)'}\n\nNew messages:\n{transcript}")],
+            max_tokens=_setting('LLM_CONVERSATION_SUMMARY_MAX_TOKENS', 512),
+        )
+        if not response['success']:
+            logger.warning("Compaction of conversation %s failed: %s", conversation_id, response['error'])
+            return False
+
+        with transaction.atomic():
+            conversation.summary = response['response']
+            conversation.summary_tokens = estimate_tokens(response['response'])
+            conversation.save(update_fields=['summary', 'summary_tokens', 'updated_at'])
+            ConversationMessage.objects.filter(pk__in=[message.pk for message in folded]).update(summarized=True)
+        logger.info("Conversation %s: %s messages folded into the summary", conversation_id, len(folded))
+        return True
+    finally:
+        if lock_key:
+            try:
+                get_redis().delete(lock_key)
+            except RedisError as e:
+                logger.warning("Compaction lock release failed: %s", e)
@@ -0,0 +1,274 @@
+"""
+Cluster-wide governor for upstream LLM calls.
+
+Every upstream call runs inside ``upstream_slot()`` (or ``aupstream_slot()``
+in coroutines), which admits it only when both limits allow it:
+
+    - at most ``LLM_MAX_CONCURRENCY`` calls in flight across all workers,
+      tracked as leases in the Redis sorted set ``llm_gov:active`` (a lease
+      expires on its own if a worker dies mid-call);
+    - a token bucket in ``llm_gov:bucket`` refilled at
+      ``LLM_RATE_LIMIT_PER_SECOND`` up to ``LLM_RATE_LIMIT_BURST`` tokens.
+
+Callers that are not admitted at once wait in ``llm_gov:waiting`` and are
+admitted in arrival order. The queue holds at most ``LLM_QUEUE_MAX_WAITING``
+callers for at most ``LLM_QUEUE_TIMEOUT`` seconds; beyond that ``LLMOverloaded``
+is raised with a Retry-After hint, which the views turn into a 503.
+
+A 429 from the provider empties the bucket, so every worker slows down to
+the refill rate instead of retrying into the limit. Redis errors disable the
+governor for that call (fail open) rather than failing the request.
+"""
+
+import asyncio
+import logging
+import math
+import time
+import uuid
+from contextlib import asynccontextmanager, contextmanager
+from typing import AsyncIterator, Iterator, Optional
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from openai import RateLimitError
+from redis.exceptions import RedisError
+
+from WebTemplate.redis_client import get_redis
+from .metrics import LLM_GOVERNOR_DECISIONS, LLM_QUEUE_WAIT_SECONDS
+
+
+logger = logging.getLogger(__name__)
+
+ACTIVE_KEY: str = "llm_gov:active"
+WAITING_KEY: str = "llm_gov:waiting"
+BUCKET_KEY: str = "llm_gov:bucket"
+
+# Returns {admitted, hint}: admitted is 1 (slot taken), 0 (wait; hint is the
+# seconds until the next bucket token, or 0 when waiting for a free slot) or
+# -1 (queue full; hint is the number of waiting callers).
+_ACQUIRE: str = """
+local active, waiting, bucket = KEYS[1], KEYS[2], KEYS[3]
+local token = ARGV[1]
+local max_active = tonumber(ARGV[2])
+local rate = tonumber(ARGV[3])
+local burst = tonumber(ARGV[4])
+local lease = tonumber(ARGV[5])
+local queue_timeout = tonumber(ARGV[6])
+local max_waiting = tonumber(ARGV[7])
+local enqueue = ARGV[8] == '1'
+
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+
+redis.call('ZREMRANGEBYSCORE', active, '-inf', now)
+redis.call('ZREMRANGEBYSCORE', waiting, '-inf', now - queue_timeout)
+
+local function wait(hint)
+    if enqueue then
+        local queued = redis.call('ZCARD', waiting)
+        if queued >= max_waiting then
+            return {-1, tostring(queued)}
+        end
+        redis.call('ZADD', waiting, 'NX', now, token)
+        redis.call('EXPIRE', waiting, math.ceil(queue_timeout) + 1)
+    end
+    return {0, tostring(hint)}
+end
+
+-- Callers already waiting are served first, in arrival order
+local rank = redis.call('ZRANK', waiting, token)
+if not rank then
+    rank = redis.call('ZCARD', waiting)
+end
+if max_active - redis.call('ZCARD', active) <= rank then
+    return wait(0)
+end
+
+if rate > 0 then
+    local tokens = tonumber(redis.call('HGET', bucket, 'tokens') or burst)
+    local updated = tonumber(redis.call('HGET', bucket, 'ts') or now)
+    tokens = math.min(burst, tokens + math.max(0, now - updated) * rate)
+    redis.call('HSET', bucket, 'tokens', tostring(tokens), 'ts', tostring(now))
+    redis.call('EXPIRE', bucket, math.ceil(burst / rate) + 1)
+    if tokens < 1 then
+        return wait((1 - tokens) / rate)
+    end
+    redis.call('HSET', bucket, 'tokens', tostring(tokens - 1))
+end
+
+redis.call('ZADD', active, now + lease, token)
+redis.call('EXPIRE', active, math.ceil(lease) + 1)
+redis.call('ZREM', waiting, token)
+return {1, '0'}
+"""
+
+
+class LLMOverloaded(Exception):
+    """
+    Raised when an upstream call cannot be admitted in time.
+
+    Attributes:
+        retry_after: Seconds the client should wait before retrying.
+    """
+
+    def __init__(self, message: str, retry_after: int) -> None:
+        super().__init__(message)
+        self.retry_after: int = retry_after
+
+
+def is_enabled() -> bool:
+    return getattr(settings, 'LLM_GOVERNOR_ENABLED', True)
+
+
+def _rate() -> float:
+    return float(getattr(settings, 'LLM_RATE_LIMIT_PER_SECOND', 5.0))
+
+
+def _queue_timeout() -> float:
+    return float(getattr(settings, 'LLM_QUEUE_TIMEOUT', 10.0))
+
+
+def _try_acquire(token: str, enqueue: bool) -> tuple[int, float]:
+    lease: float = float(getattr(settings, 'LLM_TIMEOUT', 120.0)) + 10
+    admitted, hint = get_redis().eval(
+        _ACQUIRE, 3, ACTIVE_KEY, WAITING_KEY, BUCKET_KEY,
+        token,
+        int(getattr(settings, 'LLM_MAX_CONCURRENCY', 8)),
+        _rate(),
+        float(getattr(settings, 'LLM_RATE_LIMIT_BURST', 10)),
+        lease,
+        _queue_timeout(),
+        int(getattr(settings, 'LLM_QUEUE_MAX_WAITING', 50)),
+        '1' if enqueue else '0',
+    )
+    return int(admitted), float(hint)
+
+
+def _release(token: str) -> None:
+    try:
+        pipe = get_redis().pipeline(transaction=False)
+        pipe.zrem(ACTIVE_KEY, token)
+        pipe.zrem(WAITING_KEY, token)
+        pipe.execute()
+    except RedisError as e:
+        logger.warning("LLM governor release failed: %s", e)
+
+
+async def _arelease(token: str) -> None:
+    """Release ``token`` from a worker thread; shielded so a cancelled caller still frees its slot."""
+    await asyncio.shield(sync_to_async(_release, thread_sensitive=False)(token))
+
+
+def _drain_bucket() -> None:
+    """Empty the token bucket after a provider 429 so every worker backs off."""
+    try:
+        get_redis().hset(BUCKET_KEY, 'tokens', 0)
+    except RedisError as e:
+        logger.warning("LLM governor backoff failed: %s", e)
+
+
+def _queue_full(waiting: float) -> LLMOverloaded:
+    LLM_GOVERNOR_DECISIONS.labels(outcome='rejected_full').inc()
+    rate: float = _rate()
+    retry_after: int = max(1, math.ceil(waiting / rate if rate > 0 else _queue_timeout()))
+    return LLMOverloaded("LLM capacity exceeded, queue is full", retry_after)
+
+
+def _timed_out() -> LLMOverloaded:
+    LLM_GOVERNOR_DECISIONS.labels(outcome='rejected_timeout').inc()
+    return LLMOverloaded("LLM capacity exceeded, timed out waiting in queue", max(1, math.ceil(_queue_timeout())))
+
+
+def _poll_delay(hint: float) -> float:
+    return min(max(hint, 0.01), 0.05)
+
+
+def _wait_for_slot() -> str:
+    """Queue until a slot is granted and return its token; see upstream_slot."""
+    token: str = uuid.uuid4().hex
+    started: float = time.monotonic()
+    admitted, hint = _try_acquire(token, enqueue=True)
+    if admitted < 0:
+        raise _queue_full(hint)
+    queued: bool = not admitted
+    try:
+        while not admitted:
+            if time.monotonic() - started >= _queue_timeout():
+                raise _timed_out()
+            time.sleep(_poll_delay(hint))
+            admitted, hint = _try_acquire(token, enqueue=False)
+    except BaseException:
+        # Leave the queue so the callers behind us move up
+        _release(token)
+        raise
+    LLM_GOVERNOR_DECISIONS.labels(outcome='queued' if queued else 'admitted').inc()
+    LLM_QUEUE_WAIT_SECONDS.observe(time.monotonic() - started)
+    return token
+
+
+async def _await_slot() -> str:
+    """Async counterpart of _wait_for_slot; Redis calls run in a worker thread."""
+    try_acquire = sync_to_async(_try_acquire, thread_sensitive=False)
+    token: str = uuid.uuid4().hex
+    started: float = time.monotonic()
+    admitted, hint = await try_acquire(token, enqueue=True)
+    if admitted < 0:
+        raise _queue_full(hint)
+    queued: bool = not admitted
+    try:
+        while not admitted:
+            if time.monotonic() - started >= _queue_timeout():
+                raise _timed_out()
+            await asyncio.sleep(_poll_delay(hint))
+            admitted, hint = await try_acquire(token, enqueue=False)
+    except BaseException:
+        # Also runs when the caller is cancelled while waiting (e.g. a batch item timeout)
+        await _arelease(token)
+        raise
+    LLM_GOVERNOR_DECISIONS.labels(outcome='queued' if queued else 'admitted').inc()
+    LLM_QUEUE_WAIT_SECONDS.observe(time.monotonic() - started)
+    return token
+
+
+@contextmanager
+def upstream_slot() -> Iterator[None]:
+    """
+    Hold one governed upstream slot for the duration of the block.
+
+    Raises:
+        LLMOverloaded: If the queue is full or the caller waited longer than
+            LLM_QUEUE_TIMEOUT without being admitted.
+    """
+    token: Optional[str] = None
+    if is_enabled():
+        try:
+            token = _wait_for_slot()
+        except RedisError as e:
+            logger.warning("LLM governor unavailable, calling upstream ungoverned: %s", e)
+    try:
+        yield
+    except RateLimitError:
+        _drain_bucket()
+        raise
+    finally:
+        if token is not None:
+            _release(token)
+
+
+@asynccontextmanager
+async def aupstream_slot() -> AsyncIterator[None]:
+    """Async counterpart of upstream_slot; waiting in the queue never blocks the event loop."""
+    token: Optional[str] = None
+    if is_enabled():
+        try:
+            token = await _await_slot()
+        except RedisError as e:
+            logger.warning("LLM governor unavailable, calling upstream ungoverned: %s", e)
+    try:
+        yield
+    except RateLimitError:
+        await sync_to_async(_drain_bucket, thread_sensitive=False)()
+        raise
+    finally:
+        if token is not None:
+            await _arelease(token)
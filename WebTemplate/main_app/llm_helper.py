@@ -6,6 +6,15 @@ APIs, specifically configured to use the DeepSeek API through the LangChain fram
 It abstracts the complexity of setting up and invoking LLM calls, providing a simple
 interface for the rest of the application.
 
+Clients are created lazily and kept in a per-process registry keyed by
+(model, temperature, max_tokens). All of them share one keep-alive HTTP
+connection pool, so repeated calls skip TCP/TLS setup to the upstream API.
+Deterministic (temperature 0) responses are served from ``llm_cache`` when
+the same input was answered before, and identical deterministic calls that
+are in flight at the same time share one upstream call (``llm_singleflight``).
+Latency, time to first token and token usage of every upstream call are
+recorded by ``llm_usage``.
+
 Typical usage example:
 
     response = get_llm_response(
@@ -19,17 +28,188 @@ Typical usage example:
         print(f"Error: {response['error']}")
 """
 
-from typing import Optional, TypedDict
+from typing import AsyncIterator, Iterator, NotRequired, Optional, TypedDict
 from langchain_openai import ChatOpenAI
 from langchain.schema import HumanMessage, SystemMessage, BaseMessage
 from django.conf import settings
-import logging, os
+from asgiref.sync import sync_to_async
+import asyncio
+import httpx
+import logging, os, threading, weakref
 from dotenv import load_dotenv
+from .llm_cache import cache_key, get_cached_response, is_cacheable, set_cached_response
+from .llm_governor import LLMOverloaded, aupstream_slot, upstream_slot
+from .llm_singleflight import asingle_flight, single_flight
+from .llm_usage import atrack_llm_call, track_llm_call
+from .metrics import LLM_CACHE_REQUESTS
 
 
 # Load environment variables from .env file to access API keys and configuration
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+# (model, temperature, max_tokens) -> client; see get_llm_client
+ClientKey = tuple[str, float, int]
+_clients: dict[ClientKey, ChatOpenAI] = {}
+_http_client: Optional[httpx.Client] = None
+_registry_pid: Optional[int] = None
+_registry_lock: threading.Lock = threading.Lock()
+
+
+class _AsyncRegistry:
+    """The ainvoke clients of one event loop and the connection pool they share."""
+
+    def __init__(self) -> None:
+        self.http_client: httpx.AsyncClient = _build_http_client(httpx.AsyncClient)
+        self.clients: dict[ClientKey, ChatOpenAI] = {}
+        self.closer: Optional[asyncio.Task] = None
+
+
+# Clients for ainvoke, per event loop: async connections belong to the loop that
+# opened them. An entry goes away with its loop, see get_async_llm_client.
+_async_registries: weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, _AsyncRegistry] = weakref.WeakKeyDictionary()
+
+
+def _llm_setting(name: str, default):
+    return getattr(settings, name, default)
+
+
+def _build_http_client(client_class: type = httpx.Client):
+    """Create the keep-alive connection pool shared by every LLM client of the process."""
+    return client_class(
+        limits=httpx.Limits(
+            max_connections=_llm_setting('LLM_HTTP_MAX_CONNECTIONS', 20),
+            max_keepalive_connections=_llm_setting('LLM_HTTP_MAX_KEEPALIVE', 10),
+            keepalive_expiry=_llm_setting('LLM_HTTP_KEEPALIVE_EXPIRY', 60.0),
+        ),
+        timeout=httpx.Timeout(_llm_setting('LLM_TIMEOUT', 120.0), connect=10.0),
+    )
+
+
+def _client_key(model: Optional[str], temperature: float, max_tokens: Optional[int]) -> ClientKey:
+    return (
+        model or _llm_setting('LLM_MODEL', 'deepseek-chat'),
+        float(temperature),
+        int(max_tokens or _llm_setting('LLM_MAX_TOKENS', 2048)),
+    )
+
+
+def _build_chat_client(key: ClientKey, async_http_client: Optional[httpx.AsyncClient] = None) -> ChatOpenAI:
+    logger.debug("Created LLM client for %s", key)
+    return ChatOpenAI(
+        model=key[0],
+        openai_api_key=os.getenv('DEEPSEEK_API_KEY'),
+        openai_api_base=_llm_setting('LLM_API_BASE', "https://api.deepseek.com/v1"),
+        temperature=key[1],
+        max_tokens=key[2],
+        # Ask for token usage at the end of streamed completions too (see llm_usage)
+        stream_usage=True,
+        http_client=_http_client,
+        http_async_client=async_http_client,
+    )
+
+
+def _check_process() -> None:
+    """Start from an empty registry in a new (forked) process. Call with _registry_lock held."""
+    global _http_client, _registry_pid
+    if _registry_pid != os.getpid():
+        _clients.clear()
+        _async_registries.clear()
+        _http_client = _build_http_client()
+        _registry_pid = os.getpid()
+
+
+async def _close_at_loop_shutdown(http_client: httpx.AsyncClient) -> None:
+    # Runs until the loop cancels its remaining tasks on shutdown (asyncio.run,
+    # asgiref's async_to_sync and ASGI servers all do), then closes the pool on
+    # its own loop and forgets the loop's registry
+    loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+    try:
+        await loop.create_future()
+    finally:
+        with _registry_lock:
+            _async_registries.pop(loop, None)
+        await http_client.aclose()
+
+
+def get_llm_client(model: Optional[str] = None, temperature: float = 0.0, max_tokens: Optional[int] = None) -> ChatOpenAI:
+    """
+    Return the shared ChatOpenAI client for a (model, temperature, max_tokens) combination.
+
+    Clients are created on first use and reused for the life of the process.
+    The registry is guarded by a lock, so concurrent threads never build the
+    same client twice, and it is rebuilt after a fork, so gunicorn and Celery
+    workers never share sockets inherited from their parent.
+
+    Args:
+        model: Model name. Defaults to settings.LLM_MODEL.
+        temperature: Sampling temperature.
+        max_tokens: Completion token limit. Defaults to settings.LLM_MAX_TOKENS.
+
+    Returns:
+        ChatOpenAI: A client bound to the process-wide HTTP connection pool.
+    """
+    key: ClientKey = _client_key(model, temperature, max_tokens)
+    client: Optional[ChatOpenAI] = _clients.get(key) if _registry_pid == os.getpid() else None
+    if client is not None:
+        return client
+    with _registry_lock:
+        _check_process()
+        client = _clients.get(key)
+        if client is None:
+            client = _clients[key] = _build_chat_client(key)
+        return client
+
+
+def get_async_llm_client(model: Optional[str] = None, temperature: float = 0.0, max_tokens: Optional[int] = None) -> ChatOpenAI:
+    """
+    Return the shared client for ``ainvoke``/``astream`` calls on the running event loop.
+
+    Works like get_llm_client, but the clients share an ``httpx.AsyncClient``
+    pool owned by the current event loop. Under an ASGI server that is one
+    loop per worker process, so the pool lives as long as the worker. Every
+    loop that uses the clients gets its own pool, which is closed when the
+    loop shuts down, so short-lived loops (``async_to_sync``, tests) do not
+    leak connections.
+
+    Args:
+        model: Model name. Defaults to settings.LLM_MODEL.
+        temperature: Sampling temperature.
+        max_tokens: Completion token limit. Defaults to settings.LLM_MAX_TOKENS.
+
+    Returns:
+        ChatOpenAI: A client bound to the event loop's async connection pool.
+
+    Raises:
+        RuntimeError: If called outside of a running event loop.
+    """
+    loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+    key: ClientKey = _client_key(model, temperature, max_tokens)
+    with _registry_lock:
+        _check_process()
+        registry: Optional[_AsyncRegistry] = _async_registries.get(loop)
+        if registry is None:
+            registry = _async_registries[loop] = _AsyncRegistry()
+            # Kept on the registry: the loop only holds weak references to its tasks
+            registry.closer = loop.create_task(_close_at_loop_shutdown(registry.http_client))
+        client: Optional[ChatOpenAI] = registry.clients.get(key)
+        if client is None:
+            client = registry.clients[key] = _build_chat_client(key, registry.http_client)
+        return client
+
+
+def reset_llm_clients() -> None:
+    """Drop every cached client and close the shared HTTP pool (used in tests and benchmarks)."""
+    global _http_client, _registry_pid
+    with _registry_lock:
+        _clients.clear()
+        # Their async pools are still closed when their loops shut down
+        _async_registries.clear()
+        if _http_client is not None:
+            _http_client.close()
+        _http_client, _registry_pid = None, None
+
 
 class LLMResponse(TypedDict):
     """
@@ -45,24 +225,56 @@ class LLMResponse(TypedDict):
             the call failed.
         error: A string describing the error that occurred, or None if the call
             was successful.
+        retry_after: Only present when the call was refused because the
+            upstream capacity is exhausted (see llm_governor); the number of
+            seconds after which a retry is likely to be admitted.
     """
 
     success: bool
     response: Optional[str]
     error: Optional[str]
+    retry_after: NotRequired[int]
+
+
+def build_messages(prompt: str, system_message: Optional[str] = None) -> list[BaseMessage]:
+    """
+    Build the message list for a single-turn conversation.
+
+    Args:
+        prompt: The user's input text.
+        system_message: Optional system-level instruction, placed first.
+
+    Returns:
+        list[BaseMessage]: The SystemMessage (if any) followed by the HumanMessage.
+    """
+    messages: list[BaseMessage] = []
+
+    # Add system message first if provided (sets assistant behavior/context)
+    if system_message:
+        messages.append(SystemMessage(content=system_message))
+
+    # Add the user's prompt as a HumanMessage
+    messages.append(HumanMessage(content=prompt))
+    return messages
 
 
 def get_llm_response(
     prompt: str,
     system_message: Optional[str] = None,
-    temperature: float = 0.0
+    temperature: float = 0.0,
+    max_tokens: Optional[int] = None,
+    use_cache: bool = True
 ) -> LLMResponse:
     """
     Send a prompt to the DeepSeek LLM and retrieve a response.
 
-    This function creates a ChatOpenAI client configured for the DeepSeek API,
-    constructs the appropriate message sequence, and returns the model's response
-    in a standardized format.
+    This function takes the shared ChatOpenAI client for the requested
+    settings from the process-wide registry, constructs the appropriate
+    message sequence, and returns the model's response in a standardized format.
+    Deterministic calls (temperature 0) are answered from the response cache
+    when possible and successful answers are stored there. Concurrent
+    identical deterministic calls, in this process or in other workers,
+    wait for a single upstream call and share its answer.
 
     Args:
         prompt: The user's input text to send to the LLM. This is the main
@@ -74,6 +286,10 @@ def get_llm_response(
             of 0.0 produces deterministic responses, while higher values
             (up to 1.0 or 2.0 depending on the model) increase creativity
             and variability. Defaults to 0.0 for consistent outputs.
+        max_tokens: Maximum number of completion tokens. Defaults to
+            settings.LLM_MAX_TOKENS (2048).
+        use_cache: Set to False to skip the response cache for this call,
+            e.g. to force a fresh completion. Defaults to True.
 
     Returns:
         LLMResponse: A typed dictionary containing:
@@ -99,30 +315,287 @@ def get_llm_response(
         set, either directly in the environment or in a .env file.
     """
     try:
-        # Initialize the ChatOpenAI client with DeepSeek API configuration
-        llm: ChatOpenAI = ChatOpenAI(
-            model="deepseek-chat",
-            openai_api_key=os.getenv('DEEPSEEK_API_KEY'),
-            openai_api_base="https://api.deepseek.com/v1",
-            temperature=temperature,
-            max_tokens=2048
-        )
+        # Reuse the process-wide client (and its keep-alive connection pool)
+        llm: ChatOpenAI = get_llm_client(temperature=temperature, max_tokens=max_tokens)
 
-        # Build the message list for the conversation
-        messages: list[BaseMessage] = []
+        # Deterministic calls may already have been answered
+        key: Optional[str] = None
+        if use_cache and is_cacheable(temperature):
+            key = cache_key(llm.model_name, system_message, prompt, temperature, llm.max_tokens)
+            cached: Optional[str] = get_cached_response(key)
+            if cached is not None:
+                return {'success': True, 'response': cached, 'error': None}
+        else:
+            LLM_CACHE_REQUESTS.labels(tier='local', outcome='bypass').inc()
 
-        # Add system message first if provided (sets assistant behavior/context)
-        if system_message:
-            messages.append(SystemMessage(content=system_message))
+        def generate() -> LLMResponse:
+            # Invoke the LLM and get the response, within the cluster-wide upstream limits
+            with upstream_slot(), track_llm_call(llm.model_name, 'invoke') as call:
+                response = llm.invoke(build_messages(prompt, system_message))
+                call.add_usage(response.usage_metadata)
+            if key is not None:
+                set_cached_response(key, response.content)
+            return {'success': True, 'response': response.content, 'error': None}
+
+        # Identical deterministic calls in flight share one upstream call
+        return single_flight(key, generate) if key is not None else generate()
+    except LLMOverloaded as e:
+        return {'success': False, 'response': None, 'error': str(e), 'retry_after': e.retry_after}
+    except Exception as e:
+        # Catch any exceptions (API errors, network issues, etc.) and return
+        # them in a standardized error format
+        return {'success': False, 'response': None, 'error': str(e)}
 
-        # Add the user's prompt as a HumanMessage
-        messages.append(HumanMessage(content=prompt))
 
-        # Invoke the LLM and get the response
-        response = llm.invoke(messages)
+async def aget_llm_response(
+    prompt: str,
+    system_message: Optional[str] = None,
+    temperature: float = 0.0,
+    max_tokens: Optional[int] = None,
+    use_cache: bool = True
+) -> LLMResponse:
+    """
+    Async counterpart of get_llm_response for ASGI views and other coroutines.
 
+    Awaits ``ainvoke`` on the event loop's shared client, so many completions
+    can be in flight on one thread. Cache lookups run in a worker thread to
+    keep Redis I/O off the event loop. Arguments and return value are the
+    same as get_llm_response.
+    """
+    try:
+        llm: ChatOpenAI = get_async_llm_client(temperature=temperature, max_tokens=max_tokens)
+
+        key: Optional[str] = None
+        if use_cache and is_cacheable(temperature):
+            key = cache_key(llm.model_name, system_message, prompt, temperature, llm.max_tokens)
+            cached: Optional[str] = await sync_to_async(get_cached_response, thread_sensitive=False)(key)
+            if cached is not None:
+                return {'success': True, 'response': cached, 'error': None}
+        else:
+            LLM_CACHE_REQUESTS.labels(tier='local', outcome='bypass').inc()
+
+        async def generate() -> LLMResponse:
+            async with aupstream_slot(), atrack_llm_call(llm.model_name, 'ainvoke') as call:
+                response = await llm.ainvoke(build_messages(prompt, system_message))
+                call.add_usage(response.usage_metadata)
+            if key is not None:
+                await sync_to_async(set_cached_response, thread_sensitive=False)(key, response.content)
+            return {'success': True, 'response': response.content, 'error': None}
+
+        return await asingle_flight(key, generate) if key is not None else await generate()
+    except LLMOverloaded as e:
+        return {'success': False, 'response': None, 'error': str(e), 'retry_after': e.retry_after}
+    except Exception as e:
+        return {'success': False, 'response': None, 'error': str(e)}
+
+
+def get_chat_response(
+    messages: list[BaseMessage],
+    temperature: float = 0.0,
+    max_tokens: Optional[int] = None
+) -> LLMResponse:
+    """
+    Send a prepared message list (e.g. the context of a conversation) to the LLM.
+
+    Unlike get_llm_response the input is not a single prompt, so the call is
+    never served from or stored in the response cache. It is governed and
+    measured like every other upstream call.
+
+    Args:
+        messages: The messages to send, oldest first.
+        temperature: Sampling temperature. Defaults to 0.0.
+        max_tokens: Maximum number of completion tokens. Defaults to
+            settings.LLM_MAX_TOKENS (2048).
+
+    Returns:
+        LLMResponse: Same as get_llm_response; errors are returned, not raised.
+    """
+    try:
+        llm: ChatOpenAI = get_llm_client(temperature=temperature, max_tokens=max_tokens)
+        LLM_CACHE_REQUESTS.labels(tier='local', outcome='bypass').inc()
+        with upstream_slot(), track_llm_call(llm.model_name, 'invoke') as call:
+            response = llm.invoke(messages)
+            call.add_usage(response.usage_metadata)
         return {'success': True, 'response': response.content, 'error': None}
+    except LLMOverloaded as e:
+        return {'success': False, 'response': None, 'error': str(e), 'retry_after': e.retry_after}
     except Exception as e:
-        # Catch any exceptions (API errors, network issues, etc.) and return
-        # them in a standardized error format
         return {'success': False, 'response': None, 'error': str(e)}
+
+
+class BatchItem(TypedDict, total=False):
+    """
+    One prompt of a batch.
+
+    Attributes:
+        prompt: The user's input text.
+        system_message: Optional system-level instruction for this prompt.
+    """
+
+    prompt: str
+    system_message: Optional[str]
+
+
+async def abatch_llm_responses(
+    items: list[BatchItem],
+    temperature: float = 0.0,
+    max_tokens: Optional[int] = None,
+    use_cache: bool = True,
+    concurrency: Optional[int] = None,
+    timeout: Optional[float] = None
+) -> list[LLMResponse]:
+    """
+    Answer many prompts concurrently, at most ``concurrency`` at a time.
+
+    Every item runs through aget_llm_response, so the batch shares the event
+    loop's client and the response cache. The wall time is close to that of
+    the slowest call (for batches up to ``concurrency`` items) instead of the
+    sum of all calls.
+
+    Args:
+        items: The prompts, each with an optional system message.
+        temperature: Sampling temperature for every item.
+        max_tokens: Completion token limit for every item.
+        use_cache: Set to False to skip the response cache.
+        concurrency: Maximum calls in flight. Defaults to
+            settings.LLM_BATCH_MAX_CONCURRENCY.
+        timeout: Seconds each item may take before it is cancelled. Defaults
+            to settings.LLM_BATCH_ITEM_TIMEOUT.
+
+    Returns:
+        list[LLMResponse]: One result per item, in the order of ``items``.
+        A failed or timed-out item has success False and its error set; it
+        never fails the rest of the batch.
+    """
+    semaphore: asyncio.Semaphore = asyncio.Semaphore(max(1, concurrency or _llm_setting('LLM_BATCH_MAX_CONCURRENCY', 8)))
+    item_timeout: float = timeout or _llm_setting('LLM_BATCH_ITEM_TIMEOUT', 60.0)
+
+    async def run(item: BatchItem) -> LLMResponse:
+        async with semaphore:
+            try:
+                return await asyncio.wait_for(
+                    aget_llm_response(item['prompt'], item.get('system_message'), temperature, max_tokens, use_cache),
+                    timeout=item_timeout,
+                )
+            except asyncio.TimeoutError:
+                return {'success': False, 'response': None, 'error': f'Timed out after {item_timeout:g}s'}
+
+    return list(await asyncio.gather(*(run(item) for item in items)))
+
+
+def stream_llm_response(
+    prompt: str,
+    system_message: Optional[str] = None,
+    temperature: float = 0.0,
+    max_tokens: Optional[int] = None,
+    use_cache: bool = True
+) -> Iterator[str]:
+    """
+    Yield the completion of a prompt piece by piece as the model produces it.
+
+    Uses the LangChain streaming interface of the shared client, so the first
+    tokens reach the caller long before the whole completion is done. A cached
+    deterministic answer is yielded as a single piece, and a stream that runs
+    to the end with some content is stored in the cache like a regular
+    response.
+
+    Closing the generator early (e.g. because the HTTP client went away)
+    closes the upstream stream as well, so no more tokens are generated or
+    paid for.
+
+    Args:
+        prompt: The user's input text to send to the LLM.
+        system_message: Optional system-level instruction.
+        temperature: Sampling temperature. Defaults to 0.0.
+        max_tokens: Maximum number of completion tokens. Defaults to
+            settings.LLM_MAX_TOKENS (2048).
+        use_cache: Set to False to skip the response cache for this call.
+
+    Yields:
+        str: Non-empty pieces of the completion, in order.
+
+    Raises:
+        LLMOverloaded: If the upstream capacity is exhausted.
+        Exception: Errors of the upstream API are raised to the caller, which
+            is responsible for reporting them (unlike get_llm_response).
+    """
+    llm: ChatOpenAI = get_llm_client(temperature=temperature, max_tokens=max_tokens)
+
+    key: Optional[str] = None
+    if use_cache and is_cacheable(temperature):
+        key = cache_key(llm.model_name, system_message, prompt, temperature, llm.max_tokens)
+        cached: Optional[str] = get_cached_response(key)
+        if cached is not None:
+            yield cached
+            return
+    else:
+        LLM_CACHE_REQUESTS.labels(tier='local', outcome='bypass').inc()
+
+    pieces: list[str] = []
+    with upstream_slot(), track_llm_call(llm.model_name, 'stream') as call:
+        chunks = llm.stream(build_messages(prompt, system_message))
+        try:
+            for chunk in chunks:
+                call.add_usage(chunk.usage_metadata)
+                if chunk.content:
+                    call.first_token()
+                    pieces.append(chunk.content)
+                    yield chunk.content
+        except GeneratorExit:
+            logger.info("LLM stream closed by the consumer after %s chunks", len(pieces))
+            raise
+        finally:
+            chunks.close()
+
+    # An empty completion (e.g. filtered) is not an answer worth serving again
+    if key is not None and pieces:
+        set_cached_response(key, "".join(pieces))
+
+
+async def astream_llm_response(
+    prompt: str,
+    system_message: Optional[str] = None,
+    temperature: float = 0.0,
+    max_tokens: Optional[int] = None,
+    use_cache: bool = True
+) -> AsyncIterator[str]:
+    """
+    Async counterpart of stream_llm_response for ASGI views.
+
+    Streams with ``astream`` on the event loop's shared client and waits for
+    the upstream governor without blocking the loop. Cache and governor Redis
+    calls run in a worker thread. Closing or cancelling the generator (e.g.
+    when the ASGI server reports a client disconnect) closes the upstream
+    stream and releases the governor slot right away. Arguments, pieces and
+    errors are the same as stream_llm_response.
+    """
+    llm: ChatOpenAI = get_async_llm_client(temperature=temperature, max_tokens=max_tokens)
+
+    key: Optional[str] = None
+    if use_cache and is_cacheable(temperature):
+        key = cache_key(llm.model_name, system_message, prompt, temperature, llm.max_tokens)
+        cached: Optional[str] = await sync_to_async(get_cached_response, thread_sensitive=False)(key)
+        if cached is not None:
+            yield cached
+            return
+    else:
+        LLM_CACHE_REQUESTS.labels(tier='local', outcome='bypass').inc()
+
+    pieces: list[str] = []
+    async with aupstream_slot(), atrack_llm_call(llm.model_name, 'astream') as call:
+        chunks = llm.astream(build_messages(prompt, system_message))
+        try:
+            async for chunk in chunks:
+                call.add_usage(chunk.usage_metadata)
+                if chunk.content:
+                    call.first_token()
+                    pieces.append(chunk.content)
+                    yield chunk.content
+        except (GeneratorExit, asyncio.CancelledError):
+            logger.info("LLM stream closed by the consumer after %s chunks", len(pieces))
+            raise
+        finally:
+            await chunks.aclose()
+
+    if key is not None and pieces:
+        await sync_to_async(set_cached_response, thread_sensitive=False)(key, "".join(pieces))
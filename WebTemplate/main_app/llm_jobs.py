@@ -0,0 +1,182 @@
+"""
+Background LLM jobs with result polling.
+
+A job is a ``run_llm_job`` Celery task whose task id is the job id. The web
+tier enqueues it and returns at once. Clients then poll
+``get_llm_job`` (via the job status endpoint), which reads the task state and
+result from the Celery result backend.
+
+Next to the Celery result, every job has a small Redis hash
+``llm_job:<job_id>`` that lives for ``LLM_JOB_RESULT_TTL`` seconds:
+
+    - it tells a finished or queued job apart from an unknown or expired id,
+      which the result backend alone reports as PENDING forever;
+    - its ``cancelled`` field is the cancellation flag checked by the task
+      before it starts and while it streams the completion.
+
+Typical usage example:
+
+    job_id = submit_llm_job({'prompt': "Summarize ...", 'temperature': 0.0})
+    job = get_llm_job(job_id)
+    if job and job['status'] == 'done':
+        print(job['result']['response'])
+"""
+
+import logging
+import time
+import uuid
+from typing import Optional, TypedDict
+
+from celery.result import AsyncResult
+from django.conf import settings
+from kombu.exceptions import OperationalError
+
+from WebTemplate.redis_client import get_redis
+from .llm_helper import LLMResponse
+
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX: str = "llm_job:"
+
+# Celery task state -> job status reported to clients
+_STATUS_BY_STATE: dict[str, str] = {
+    'PENDING': 'queued',
+    'RECEIVED': 'queued',
+    'RETRY': 'queued',
+    'STARTED': 'running',
+    'SUCCESS': 'done',
+    'FAILURE': 'failed',
+    'REVOKED': 'cancelled',
+}
+FINISHED_STATUSES: frozenset[str] = frozenset({'done', 'failed', 'cancelled'})
+
+
+class LLMJobParams(TypedDict, total=False):
+    """
+    Arguments of one job, passed on to the LLM helpers.
+
+    Attributes:
+        prompt: The user's input text.
+        system_message: Optional system-level instruction.
+        temperature: Sampling temperature.
+        max_tokens: Completion token limit.
+        use_cache: Whether the response cache may be used.
+    """
+
+    prompt: str
+    system_message: Optional[str]
+    temperature: float
+    max_tokens: Optional[int]
+    use_cache: bool
+
+
+class LLMJobStatus(TypedDict):
+    """
+    Polling view of a job.
+
+    Attributes:
+        job_id: The job (and Celery task) id.
+        status: One of queued, running, done, failed or cancelled.
+        result: The LLMResponse once the job is done or failed, otherwise None.
+    """
+
+    job_id: str
+    status: str
+    result: Optional[LLMResponse]
+
+
+def job_key(job_id: str) -> str:
+    """Return the Redis key of a job's metadata hash."""
+    return f"{KEY_PREFIX}{job_id}"
+
+
+def get_result_ttl() -> int:
+    """Return how long, in seconds, a job and its result can be polled."""
+    return int(getattr(settings, 'LLM_JOB_RESULT_TTL', 60 * 60))
+
+
+def submit_llm_job(params: LLMJobParams) -> str:
+    """
+    Enqueue an LLM job and return its id without waiting for the model.
+
+    Args:
+        params: The prompt and generation settings.
+
+    Returns:
+        str: The job id to poll.
+    """
+    from .tasks import run_llm_job
+
+    job_id: str = uuid.uuid4().hex
+    pipe = get_redis().pipeline()
+    pipe.hset(job_key(job_id), mapping={'created': time.time(), 'cancelled': 0})
+    pipe.expire(job_key(job_id), get_result_ttl())
+    pipe.execute()
+    run_llm_job.apply_async((job_id, dict(params)), task_id=job_id)
+    return job_id
+
+
+def job_exists(job_id: str) -> bool:
+    """Check that ``job_id`` was submitted and has not expired yet."""
+    return bool(get_redis().exists(job_key(job_id)))
+
+
+def is_cancelled(job_id: str) -> bool:
+    """Check the cancellation flag of a job."""
+    return get_redis().hget(job_key(job_id), 'cancelled') == b'1'
+
+
+def get_llm_job(job_id: str) -> Optional[LLMJobStatus]:
+    """
+    Return the current status of a job, with its result once it finished.
+
+    Args:
+        job_id: The id returned by submit_llm_job.
+
+    Returns:
+        Optional[LLMJobStatus]: None if the id is unknown or its TTL expired.
+    """
+    if not job_exists(job_id):
+        return None
+    if is_cancelled(job_id):
+        return {'job_id': job_id, 'status': 'cancelled', 'result': None}
+
+    task_result: AsyncResult = AsyncResult(job_id)
+    status: str = _STATUS_BY_STATE.get(task_result.state, 'queued')
+    result: Optional[LLMResponse] = None
+    if status == 'done':
+        result = task_result.result
+        if not result or not result.get('success'):
+            status = 'failed'
+    elif status == 'failed':
+        result = {'success': False, 'response': None, 'error': str(task_result.result)}
+    return {'job_id': job_id, 'status': status, 'result': result}
+
+
+def cancel_llm_job(job_id: str) -> Optional[LLMJobStatus]:
+    """
+    Cancel a queued or running job.
+
+    A queued job is revoked, so a worker drops it on arrival. A running job
+    sees the cancellation flag between streamed chunks and stops generating.
+    Finished jobs are left as they are.
+
+    Args:
+        job_id: The id returned by submit_llm_job.
+
+    Returns:
+        Optional[LLMJobStatus]: The job's status after the call, or None if
+        the id is unknown or expired.
+    """
+    job: Optional[LLMJobStatus] = get_llm_job(job_id)
+    if job is None or job['status'] in FINISHED_STATUSES:
+        return job
+    get_redis().hset(job_key(job_id), 'cancelled', 1)
+    try:
+        AsyncResult(job_id).revoke()
+    except OperationalError as e:
+        # The flag alone is enough: the task checks it before it starts
+        logger.warning("Could not broadcast revoke of LLM job %s: %s", job_id, e)
+    logger.info("LLM job %s cancelled while %s", job_id, job['status'])
+    return {'job_id': job_id, 'status': 'cancelled', 'result': None}
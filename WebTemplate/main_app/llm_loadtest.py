@@ -0,0 +1,231 @@
+"""
+Closed-loop load generator for the LLM endpoints.
+
+``run_load`` keeps ``concurrency`` requests in flight until ``requests`` have
+completed and summarizes them: throughput, latency percentiles and, for
+streamed answers, time to the first event. The request itself is a
+``send`` callable, so the same measurement drives a running server over HTTP
+(``http_sender``) or the Django stack in-process (``client_sender``).
+
+Typical usage example:
+
+    with httpx.Client() as client:
+        report = run_load(http_sender(client, "http://127.0.0.1:8000/api/llm/", body), concurrency=8, requests=200)
+    print(report['rps'], report['p99_ms'])
+"""
+
+import asyncio
+import json
+import math
+import threading
+import time
+import weakref
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional, TypedDict
+
+import httpx
+from django.test import AsyncClient
+
+
+class RequestResult(TypedDict):
+    """
+    Outcome of one request.
+
+    Attributes:
+        status: HTTP status code, or 0 if the request failed without one.
+        seconds: Time until the whole answer was read.
+        first_event_seconds: Time until the first Server-Sent Event of a
+            streamed answer, otherwise None.
+        ok: Whether the answer was a success, see _answer_ok.
+    """
+
+    status: int
+    seconds: float
+    first_event_seconds: Optional[float]
+    ok: bool
+
+
+class LoadReport(TypedDict):
+    """
+    Summary of one concurrency level.
+
+    Attributes:
+        concurrency: Requests kept in flight.
+        requests: Requests completed.
+        ok: Successful requests.
+        statuses: Count of requests per HTTP status.
+        seconds: Wall time of the run.
+        rps: Completed requests per second.
+        p50_ms: Median latency.
+        p95_ms: 95th percentile latency.
+        p99_ms: 99th percentile latency.
+        first_event_p50_ms: Median time to first event of streamed answers,
+            or None if no answer was streamed.
+    """
+
+    concurrency: int
+    requests: int
+    ok: int
+    statuses: dict[int, int]
+    seconds: float
+    rps: float
+    p50_ms: float
+    p95_ms: float
+    p99_ms: float
+    first_event_p50_ms: Optional[float]
+
+
+Sender = Callable[[], RequestResult]
+
+
+def percentile(values: list[float], q: float) -> float:
+    """
+    Return the ``q``-th percentile (0-100) of ``values`` by the nearest-rank method.
+
+    Nearest rank always returns an observed value, so a p99 over 100 requests
+    is the slowest but one request rather than an interpolation.
+    """
+    if not values:
+        return 0.0
+    ordered: list[float] = sorted(values)
+    rank: int = max(1, math.ceil(q / 100 * len(ordered)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+def _answer_ok(status: int, content: bytes, stream: bool) -> bool:
+    """
+    Whether an answer of the endpoint is a success.
+
+    llm_response_view reports a failed completion inside a 200 answer
+    (``{"success": true, "response": {"success": false, ...}}``), and a
+    stream that fails midway ends with an ``event: error``.
+    """
+    if not 200 <= status < 300:
+        return False
+    if stream:
+        return b"event: error" not in content
+    try:
+        data = json.loads(content)
+    except ValueError:
+        return False
+    inner = data.get('response') if isinstance(data, dict) else None
+    return not (isinstance(inner, dict) and inner.get('success') is False)
+
+
+def http_sender(client: httpx.Client, url: str, body: dict, stream: bool = False) -> Sender:
+    """
+    Build a sender that POSTs ``body`` as JSON to a running server.
+
+    Args:
+        client: Shared client; its connection limits must allow the tested
+            concurrency.
+        url: Full URL of the endpoint.
+        body: JSON request body.
+        stream: Read the answer as Server-Sent Events and time the first one.
+    """
+    def send() -> RequestResult:
+        started: float = time.perf_counter()
+        first_event: Optional[float] = None
+        try:
+            with client.stream("POST", url, json=body) as response:
+                received: list[bytes] = []
+                for piece in response.iter_bytes():
+                    if first_event is None and stream and piece.strip():
+                        first_event = time.perf_counter() - started
+                    received.append(piece)
+        except httpx.HTTPError:
+            return {'status': 0, 'seconds': time.perf_counter() - started, 'first_event_seconds': None, 'ok': False}
+        ok: bool = _answer_ok(response.status_code, b"".join(received), stream)
+        return {'status': response.status_code, 'seconds': time.perf_counter() - started,
+                'first_event_seconds': first_event, 'ok': ok}
+
+    return send
+
+
+def client_sender(path: str, body: dict, stream: bool = False) -> Sender:
+    """
+    Build a sender that goes through the Django stack (URL routing,
+    middleware and the view) in-process with the async test client.
+
+    Requests are served by one event loop running in a background thread, the
+    way one ASGI worker serves them: async views stream their answers and
+    share the loop's LLM client. The loop stops when the sender is garbage
+    collected.
+
+    Args:
+        path: URL path of the endpoint, e.g. ``/api/llm/``.
+        body: JSON request body.
+        stream: Read the answer as Server-Sent Events and time the first one.
+    """
+    client: AsyncClient = AsyncClient()
+
+    async def asend() -> RequestResult:
+        started: float = time.perf_counter()
+        first_event: Optional[float] = None
+        response = await client.post(path, body, content_type='application/json')
+        if response.streaming:
+            received: list[bytes] = []
+            async for piece in response.streaming_content:
+                if first_event is None:
+                    first_event = time.perf_counter() - started
+                received.append(piece)
+            response.close()
+            content: bytes = b"".join(received)
+        else:
+            content = response.content
+        ok: bool = _answer_ok(response.status_code, content, stream)
+        return {'status': response.status_code, 'seconds': time.perf_counter() - started,
+                'first_event_seconds': first_event, 'ok': ok}
+
+    runner: asyncio.Runner = asyncio.Runner(loop_factory=asyncio.new_event_loop)
+    loop: asyncio.AbstractEventLoop = runner.get_loop()
+    stopped: asyncio.Event = asyncio.Event()
+
+    def serve() -> None:
+        # Closing the runner cancels the loop's tasks, which closes the async LLM client
+        with runner:
+            runner.run(stopped.wait())
+
+    threading.Thread(target=serve, daemon=True).start()
+
+    def send() -> RequestResult:
+        return asyncio.run_coroutine_threadsafe(asend(), loop).result()
+
+    weakref.finalize(send, loop.call_soon_threadsafe, stopped.set)
+    return send
+
+
+def run_load(send: Sender, concurrency: int, requests: int) -> LoadReport:
+    """
+    Send ``requests`` requests with ``concurrency`` of them in flight at any time.
+
+    Args:
+        send: Makes one request; called from ``concurrency`` threads.
+        concurrency: Requests kept in flight.
+        requests: Total requests to complete.
+
+    Returns:
+        LoadReport: Throughput and latency percentiles of the run.
+    """
+    started: float = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results: list[RequestResult] = list(pool.map(lambda _: send(), range(requests)))
+    seconds: float = time.perf_counter() - started
+
+    latencies: list[float] = [result['seconds'] * 1000 for result in results]
+    first_events: list[float] = [
+        result['first_event_seconds'] * 1000 for result in results if result['first_event_seconds'] is not None
+    ]
+    return {
+        'concurrency': concurrency,
+        'requests': len(results),
+        'ok': sum(1 for result in results if result['ok']),
+        'statuses': dict(Counter(result['status'] for result in results)),
+        'seconds': seconds,
+        'rps': len(results) / seconds if seconds > 0 else 0.0,
+        'p50_ms': percentile(latencies, 50),
+        'p95_ms': percentile(latencies, 95),
+        'p99_ms': percentile(latencies, 99),
+        'first_event_p50_ms': percentile(first_events, 50) if first_events else None,
+    }
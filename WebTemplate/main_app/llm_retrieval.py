@@ -0,0 +1,310 @@
+"""
+Retrieval over uploaded ``Documents`` for grounded LLM answers.
+
+Ingestion (the ``ingest_document`` Celery task, scheduled when a document is
+saved) extracts the text of the file, splits it into overlapping chunks of
+``LLM_RETRIEVAL_CHUNK_WORDS`` words and writes an inverted index to the
+database:
+
+    - ``DocumentChunk``: the text of every chunk and its length in terms;
+    - ``DocumentTerm``: one posting (term, chunk, frequency) per distinct
+      term of a chunk;
+    - ``DocumentIndexState``: the SHA-256 of the indexed file, so saving an
+      unchanged document does not index it again.
+
+Deleting a document removes its chunks and postings by cascade, so the index
+is always updated incrementally and never rebuilt as a whole.
+
+``search`` ranks chunks with Okapi BM25 computed from the postings of the
+query terms only, and ``answer_question`` sends just the top-k chunks to the
+model, which keeps prompts small whatever the size of the corpus.
+
+Supported files: plain text formats, .docx (read with the standard library),
+.xlsx (openpyxl) and .pdf (pypdf, if installed).
+"""
+
+import hashlib
+import heapq
+import io
+import logging
+import math
+import os
+import re
+import zipfile
+from collections import Counter
+from typing import Iterable, NotRequired, Optional, TypedDict
+from xml.etree import ElementTree
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Avg, Count
+from langchain.schema import HumanMessage, SystemMessage
+
+from .llm_helper import LLMResponse, get_chat_response
+from .models import DocumentChunk, DocumentIndexState, Documents, DocumentTerm
+
+try:
+    from pypdf import PdfReader
+except ImportError:  # optional; PDFs are skipped without it
+    PdfReader = None
+
+
+logger = logging.getLogger(__name__)
+
+# Okapi BM25 parameters
+BM25_K1: float = 1.5
+BM25_B: float = 0.75
+MAX_TERM_LENGTH: int = 64
+
+TEXT_EXTENSIONS: frozenset[str] = frozenset({'.txt', '.md', '.csv', '.json', '.xml', '.html', '.htm', '.log'})
+
+_TERM_RE = re.compile(r"\w+", re.UNICODE)
+_WORD_NAMESPACE: str = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+
+_ANSWER_INSTRUCTION: str = (
+    "Answer the question using only the document excerpts below. If they do not contain "
+    "the answer, say so. Refer to excerpts by their number, e.g. [1]."
+)
+
+
+class UnsupportedDocument(Exception):
+    """Raised when no text can be extracted from a file type."""
+
+
+class RetrievedChunk(TypedDict):
+    """
+    One search hit.
+
+    Attributes:
+        document_id: The Documents row the chunk belongs to.
+        chunk_id: The DocumentChunk id.
+        position: Index of the chunk within its document.
+        text: The chunk text.
+        score: BM25 score; higher is more relevant.
+    """
+
+    document_id: int
+    chunk_id: int
+    position: int
+    text: str
+    score: float
+
+
+class GroundedAnswer(TypedDict):
+    """
+    LLMResponse of answer_question, with the chunks it was grounded on.
+
+    Attributes:
+        success: Whether the model answered.
+        response: The answer, or None on failure.
+        error: The error message, or None on success.
+        sources: The chunks sent to the model, best first.
+        retry_after: Only present when the upstream capacity is exhausted.
+    """
+
+    success: bool
+    response: Optional[str]
+    error: Optional[str]
+    sources: list[RetrievedChunk]
+    retry_after: NotRequired[int]
+
+
+def tokenize(text: str) -> list[str]:
+    """Split text into lowercase index terms (Unicode words of two or more characters)."""
+    return [term for term in _TERM_RE.findall(text.lower()) if 1 < len(term) <= MAX_TERM_LENGTH]
+
+
+def chunk_text(text: str, size: Optional[int] = None, overlap: Optional[int] = None) -> list[str]:
+    """
+    Split text into chunks of ``size`` words, each repeating the last
+    ``overlap`` words of the previous one so no passage is cut in half.
+    """
+    size = size or getattr(settings, 'LLM_RETRIEVAL_CHUNK_WORDS', 200)
+    overlap = min(overlap if overlap is not None else getattr(settings, 'LLM_RETRIEVAL_CHUNK_OVERLAP', 40), size - 1)
+    words: list[str] = text.split()
+    chunks: list[str] = []
+    for start in range(0, len(words), size - overlap):
+        chunks.append(" ".join(words[start:start + size]))
+        if start + size >= len(words):
+            break
+    return chunks
+
+
+def _docx_text(data: bytes) -> str:
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        root = ElementTree.fromstring(archive.read("word/document.xml"))
+    paragraphs: list[str] = [
+        "".join(node.text or "" for node in paragraph.iter(f"{_WORD_NAMESPACE}t"))
+        for paragraph in root.iter(f"{_WORD_NAMESPACE}p")
+    ]
+    return "\n".join(paragraph for paragraph in paragraphs if paragraph)
+
+
+def _xlsx_text(data: bytes) -> str:
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(io.BytesIO(data), read_only=True, data_only=True)
+    rows: list[str] = []
+    for sheet in workbook.worksheets:
+        for row in sheet.iter_rows(values_only=True):
+            cells: list[str] = [str(value) for value in row if value is not None]
+            if cells:
+                rows.append(" ".join(cells))
+    return "\n".join(rows)
+
+
+def extract_text(name: str, data: bytes) -> str:
+    """
+    Return the text of a file.
+
+    Args:
+        name: File name; its extension selects the extractor.
+        data: File content.
+
+    Raises:
+        UnsupportedDocument: If the type is not supported or its extractor
+            is not installed.
+    """
+    extension: str = os.path.splitext(name)[1].lower()
+    if extension in TEXT_EXTENSIONS:
+        return data.decode('utf-8', errors='replace')
+    if extension == '.docx':
+        return _docx_text(data)
+    if extension == '.xlsx':
+        return _xlsx_text(data)
+    if extension == '.pdf':
+        if PdfReader is None:
+            raise UnsupportedDocument("pypdf is not installed")
+        return "\n".join(page.extract_text() or "" for page in PdfReader(io.BytesIO(data)).pages)
+    raise UnsupportedDocument(f"Unsupported document type {extension or name!r}")
+
+
+def index_document(document: Documents) -> int:
+    """
+    Index (or re-index) one document, replacing its previous chunks.
+
+    A document whose file did not change since it was last indexed is left
+    alone. Unsupported files are recorded with an error and no chunks.
+
+    Args:
+        document: The document to index.
+
+    Returns:
+        int: The number of chunks written; 0 if nothing changed.
+    """
+    if not document.document:
+        return 0
+    with document.document.open('rb') as file:
+        data: bytes = file.read()
+    sha256: str = hashlib.sha256(data).hexdigest()
+    state: Optional[DocumentIndexState] = DocumentIndexState.objects.filter(document=document).first()
+    if state is not None and state.sha256 == sha256:
+        return 0
+
+    try:
+        chunks: list[str] = chunk_text(extract_text(document.document.name, data))
+        error: str = ""
+    except UnsupportedDocument as e:
+        chunks, error = [], str(e)
+        logger.info("Document %s not indexed: %s", document.pk, e)
+
+    with transaction.atomic():
+        DocumentChunk.objects.filter(document=document).delete()
+        rows: list[DocumentChunk] = DocumentChunk.objects.bulk_create([
+            DocumentChunk(document=document, position=position, text=text, length=len(tokenize(text)))
+            for position, text in enumerate(chunks)
+        ])
+        DocumentTerm.objects.bulk_create([
+            DocumentTerm(term=term, chunk=row, frequency=frequency)
+            for row in rows
+            for term, frequency in Counter(tokenize(row.text)).items()
+        ], batch_size=1000)
+        DocumentIndexState.objects.update_or_create(
+            document=document, defaults={'sha256': sha256, 'chunks': len(rows), 'error': error},
+        )
+    return len(rows)
+
+
+def search(query: str, item_ids: Optional[Iterable[int]], k: Optional[int] = None) -> list[RetrievedChunk]:
+    """
+    Return the ``k`` chunks most relevant to ``query`` by BM25.
+
+    Only the postings of the query terms are read, so the cost depends on how
+    common those terms are, not on the size of the corpus. Chunk counts and
+    term frequencies are taken over the searched documents only, so scores
+    reveal nothing about the others.
+
+    Args:
+        query: Free-text question.
+        item_ids: BusinessLogicModel ids (or a values queryset of them) whose
+            documents are searched; None searches every document and is
+            meant for callers that may read all of them.
+        k: Number of chunks. Defaults to settings.LLM_RETRIEVAL_TOP_K.
+
+    Returns:
+        list[RetrievedChunk]: Best first; chunks matching no term are omitted.
+    """
+    k = k or getattr(settings, 'LLM_RETRIEVAL_TOP_K', 4)
+    terms: set[str] = set(tokenize(query))
+    if not terms:
+        return []
+
+    chunks = DocumentChunk.objects.all()
+    postings = DocumentTerm.objects.filter(term__in=terms)
+    if item_ids is not None:
+        chunks = chunks.filter(document__client_inn_id__in=item_ids)
+        postings = postings.filter(chunk__document__client_inn_id__in=item_ids)
+    corpus = chunks.aggregate(count=Count('id'), average_length=Avg('length'))
+    chunk_count: int = corpus['count']
+    average_length: float = corpus['average_length'] or 1.0
+    document_frequency: dict[str, int] = dict(
+        postings.values('term').annotate(df=Count('id')).values_list('term', 'df')
+    )
+
+    scores: Counter = Counter()
+    for term, chunk_id, frequency, length in postings.values_list('term', 'chunk_id', 'frequency', 'chunk__length'):
+        df: int = document_frequency[term]
+        idf: float = math.log(1 + (chunk_count - df + 0.5) / (df + 0.5))
+        norm: float = frequency + BM25_K1 * (1 - BM25_B + BM25_B * length / average_length)
+        scores[chunk_id] += idf * frequency * (BM25_K1 + 1) / norm
+
+    best: list[tuple[int, float]] = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+    best_chunks: dict[int, DocumentChunk] = DocumentChunk.objects.in_bulk([chunk_id for chunk_id, _ in best])
+    return [
+        {
+            'document_id': best_chunks[chunk_id].document_id,
+            'chunk_id': chunk_id,
+            'position': best_chunks[chunk_id].position,
+            'text': best_chunks[chunk_id].text,
+            'score': round(score, 4),
+        }
+        for chunk_id, score in best
+    ]
+
+
+def answer_question(question: str, item_ids: Optional[Iterable[int]], k: Optional[int] = None,
+                    temperature: float = 0.0) -> GroundedAnswer:
+    """
+    Answer a question from the top-k chunks of the indexed documents.
+
+    Args:
+        question: The user's question.
+        item_ids: BusinessLogicModel ids whose documents may be used, see search.
+        k: Number of chunks sent to the model.
+        temperature: Sampling temperature.
+
+    Returns:
+        GroundedAnswer: The answer and the chunks it was based on. Without
+        any matching chunk the model is not called and success is False.
+    """
+    sources: list[RetrievedChunk] = search(question, item_ids, k)
+    if not sources:
+        return {'success': False, 'response': None, 'error': 'No matching documents', 'sources': []}
+    excerpts: str = "\n\n".join(
+        f"[{number}] (document {source['document_id']})\n{source['text']}" for number, source in enumerate(sources, 1)
+    )
+    response: LLMResponse = get_chat_response(
+        [SystemMessage(content=f"{_ANSWER_INSTRUCTION}\n\n{excerpts}"), HumanMessage(content=question)],
+        temperature=temperature,
+    )
+    return {**response, 'sources': sources}
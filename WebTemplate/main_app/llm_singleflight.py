@@ -0,0 +1,265 @@
+"""
+Single-flight coalescing of identical in-flight LLM calls.
+
+When many requests ask the same deterministic question at once, only one of
+them (the leader) calls the upstream API; the others wait and share its
+answer:
+
+    - Within a process, followers wait on the leader's flight (a
+      ``threading.Event`` for threads, a shared future for coroutines) and
+      receive its result, or its exception.
+    - Across workers, the leader holds a Redis lock ``llm_inflight:<cache
+      key>`` while it generates; it outlives ``LLM_TIMEOUT`` so it cannot
+      expire under a leader that is still waiting for upstream. Followers in
+      other processes poll the response cache (where the leader stores the
+      answer) until it appears. If the lock is gone without an answer (the
+      leader failed), the first follower to take the lock over becomes the
+      new leader and the others keep waiting for it.
+
+Flights are keyed by the response cache key, so only calls the cache would
+serve are coalesced. If Redis is unavailable, or a follower waits longer
+than ``LLM_SINGLE_FLIGHT_WAIT`` seconds, it makes the call itself instead of
+failing.
+"""
+
+import asyncio
+import logging
+import threading
+import time
+import uuid
+from typing import Awaitable, Callable, Optional
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from redis.exceptions import RedisError
+
+from WebTemplate.redis_client import get_redis
+from .metrics import LLM_SINGLE_FLIGHT
+
+
+logger = logging.getLogger(__name__)
+
+LOCK_PREFIX: str = "llm_inflight:"
+
+# Delete the lock only if this worker still owns it
+_RELEASE_LOCK: str = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+class _Flight:
+    """One in-process upstream call and the threads waiting for it."""
+
+    def __init__(self) -> None:
+        self.done: threading.Event = threading.Event()
+        self.result: Optional[dict] = None
+        self.error: Optional[BaseException] = None
+
+
+_flights: dict[str, _Flight] = {}
+_flights_lock: threading.Lock = threading.Lock()
+_async_flights: dict[tuple[asyncio.AbstractEventLoop, str], asyncio.Future] = {}
+
+
+def _lock_ttl() -> float:
+    # Outlive the leader's upstream call, like the governor's slot lease
+    return float(getattr(settings, 'LLM_TIMEOUT', 120.0)) + 10
+
+
+def _wait_timeout() -> float:
+    return float(getattr(settings, 'LLM_SINGLE_FLIGHT_WAIT', 60))
+
+
+def _poll_interval() -> float:
+    return float(getattr(settings, 'LLM_SINGLE_FLIGHT_POLL_INTERVAL', 0.1))
+
+
+def _cached(key: str) -> Optional[dict]:
+    raw: Optional[bytes] = get_redis().get(key)
+    return None if raw is None else {'success': True, 'response': raw.decode(), 'error': None}
+
+
+def _acquire(key: str) -> Optional[str]:
+    """Take the cross-worker lock of ``key``; return the owner token, or None if another worker holds it."""
+    token: str = uuid.uuid4().hex
+    acquired = get_redis().set(LOCK_PREFIX + key, token, nx=True, px=int(_lock_ttl() * 1000))
+    return token if acquired else None
+
+
+def _release(key: str, token: str) -> None:
+    try:
+        get_redis().eval(_RELEASE_LOCK, 1, LOCK_PREFIX + key, token)
+    except RedisError as e:
+        logger.warning("Single-flight lock release failed: %s", e)
+
+
+def _poll_other_worker(key: str) -> tuple[bool, Optional[dict]]:
+    """
+    One follower check: (keep waiting, result).
+
+    Stop waiting with a result once the leader stored it in the cache, and
+    without one once the lock is gone (the leader failed); the caller then
+    tries to take the lock over.
+    """
+    result: Optional[dict] = _cached(key)
+    if result is not None:
+        return False, result
+    return bool(get_redis().exists(LOCK_PREFIX + key)), None
+
+
+def _lead_across_workers(key: str, call: Callable[[], dict]) -> dict:
+    deadline: float = time.monotonic() + _wait_timeout()
+    while True:
+        try:
+            token: Optional[str] = _acquire(key)
+        except RedisError as e:
+            logger.warning("Single-flight lock unavailable, calling upstream: %s", e)
+            return call()
+        if token is not None:
+            try:
+                # A leader that finished just before we locked has already cached the answer
+                cached: Optional[dict] = _cached(key)
+                if cached is not None:
+                    return cached
+                LLM_SINGLE_FLIGHT.labels(role='leader').inc()
+                return call()
+            finally:
+                _release(key, token)
+
+        waiting: bool = True
+        try:
+            while waiting and time.monotonic() < deadline:
+                time.sleep(_poll_interval())
+                waiting, result = _poll_other_worker(key)
+                if result is not None:
+                    LLM_SINGLE_FLIGHT.labels(role='worker_follower').inc()
+                    return result
+        except RedisError as e:
+            logger.warning("Single-flight wait failed, calling upstream: %s", e)
+            break
+        if waiting:
+            break
+        # The leader gave up without an answer: race the other followers for its lock
+
+    LLM_SINGLE_FLIGHT.labels(role='fallback').inc()
+    return call()
+
+
+def single_flight(key: str, call: Callable[[], dict]) -> dict:
+    """
+    Run ``call`` once for all concurrent callers with the same ``key``.
+
+    Args:
+        key: The response cache key of the request.
+        call: Makes the upstream call and stores a successful answer in the
+            response cache under ``key``.
+
+    Returns:
+        dict: The result of ``call``, possibly made by another thread or worker.
+
+    Raises:
+        Exception: Whatever ``call`` raised, in the leader and in every
+            thread of the process that waited for it.
+    """
+    with _flights_lock:
+        flight: Optional[_Flight] = _flights.get(key)
+        leader: bool = flight is None
+        if leader:
+            flight = _flights[key] = _Flight()
+
+    if not leader:
+        if not flight.done.wait(_wait_timeout()):
+            LLM_SINGLE_FLIGHT.labels(role='fallback').inc()
+            return call()
+        LLM_SINGLE_FLIGHT.labels(role='process_follower').inc()
+        if flight.error is not None:
+            raise flight.error
+        return flight.result
+
+    try:
+        flight.result = _lead_across_workers(key, call)
+        return flight.result
+    except BaseException as e:
+        flight.error = e
+        raise
+    finally:
+        with _flights_lock:
+            _flights.pop(key, None)
+        flight.done.set()
+
+
+async def _alead_across_workers(key: str, call: Callable[[], Awaitable[dict]]) -> dict:
+    deadline: float = time.monotonic() + _wait_timeout()
+    while True:
+        try:
+            token: Optional[str] = await sync_to_async(_acquire, thread_sensitive=False)(key)
+        except RedisError as e:
+            logger.warning("Single-flight lock unavailable, calling upstream: %s", e)
+            return await call()
+        if token is not None:
+            try:
+                cached: Optional[dict] = await sync_to_async(_cached, thread_sensitive=False)(key)
+                if cached is not None:
+                    return cached
+                LLM_SINGLE_FLIGHT.labels(role='leader').inc()
+                return await call()
+            finally:
+                await sync_to_async(_release, thread_sensitive=False)(key, token)
+
+        waiting: bool = True
+        try:
+            while waiting and time.monotonic() < deadline:
+                await asyncio.sleep(_poll_interval())
+                waiting, result = await sync_to_async(_poll_other_worker, thread_sensitive=False)(key)
+                if result is not None:
+                    LLM_SINGLE_FLIGHT.labels(role='worker_follower').inc()
+                    return result
+        except RedisError as e:
+            logger.warning("Single-flight wait failed, calling upstream: %s", e)
+            break
+        if waiting:
+            break
+
+    LLM_SINGLE_FLIGHT.labels(role='fallback').inc()
+    return await call()
+
+
+async def asingle_flight(key: str, call: Callable[[], Awaitable[dict]]) -> dict:
+    """
+    Async counterpart of single_flight for coroutines on one event loop.
+
+    Followers await the leader's future, so waiting never blocks the loop.
+    Arguments, return value and exceptions are the same as single_flight.
+    """
+    flight_key = (asyncio.get_running_loop(), key)
+    future: Optional[asyncio.Future] = _async_flights.get(flight_key)
+    if future is not None:
+        try:
+            result: Optional[dict] = await asyncio.wait_for(asyncio.shield(future), _wait_timeout())
+        except asyncio.TimeoutError:
+            result = None
+        if result is not None:
+            LLM_SINGLE_FLIGHT.labels(role='process_follower').inc()
+            return result
+        # The leader was cancelled (e.g. by its own timeout) or is too slow
+        LLM_SINGLE_FLIGHT.labels(role='fallback').inc()
+        return await call()
+
+    future = _async_flights[flight_key] = asyncio.get_running_loop().create_future()
+    try:
+        result = await _alead_across_workers(key, call)
+        future.set_result(result)
+        return result
+    except asyncio.CancelledError:
+        future.set_result(None)
+        raise
+    except Exception as e:
+        future.set_exception(e)
+        # Mark it retrieved so a failure nobody waited for isn't logged as lost
+        future.exception()
+        raise
+    finally:
+        _async_flights.pop(flight_key, None)
@@ -0,0 +1,274 @@
+"""
+Local OpenAI-compatible stub server for the LLM helpers.
+
+Answers ``POST /v1/chat/completions`` with a canned completion so the LLM path
+can be exercised and benchmarked without network access or an API key. The
+server speaks HTTP/1.1 with keep-alive and counts the TCP connections it
+accepts, which makes connection reuse by the client directly observable.
+
+The stub models the timing of a real provider: ``latency`` seconds pass
+before the first byte of the answer, then the completion is produced at
+``tokens_per_second`` (one token per word). Requests with ``"stream": true``
+are answered as Server-Sent Events with one ``chat.completion.chunk`` per
+token, followed by a usage chunk when ``stream_options.include_usage`` is set,
+exactly like the OpenAI API. A fraction ``error_rate`` of requests fails
+with ``error_status`` (a 429 also carries ``Retry-After``).
+
+Typical usage example:
+
+    with StubLLMServer() as stub:
+        with override_settings(LLM_API_BASE=stub.base_url):
+            get_llm_response("Hello")
+        print(stub.connections, stub.requests)
+
+Run it as a standalone server with ``python manage.py run_llm_stub``.
+"""
+
+import json
+import random
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Optional
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: "_StubHTTPServer"
+
+    def setup(self) -> None:
+        super().setup()
+        # Headers and body are written separately; don't let Nagle delay the body
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        with self.server.lock:
+            self.server.connections += 1
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+    def do_POST(self) -> None:
+        length: int = int(self.headers.get("Content-Length", 0))
+        payload: dict[str, Any] = json.loads(self.rfile.read(length) or b"{}")
+        with self.server.lock:
+            self.server.requests += 1
+            self.server.in_flight += 1
+            self.server.peak_in_flight = max(self.server.peak_in_flight, self.server.in_flight)
+            failing: bool = self.server.error_rate > 0 and self.server.random.random() < self.server.error_rate
+        try:
+            self._complete(payload, failing)
+        except (BrokenPipeError, ConnectionResetError):
+            # The client went away mid-answer, e.g. a closed stream
+            self.close_connection = True
+        finally:
+            with self.server.lock:
+                self.server.in_flight -= 1
+
+    def _complete(self, payload: dict[str, Any], failing: bool) -> None:
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": "Not found"}})
+            return
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        if failing:
+            with self.server.lock:
+                self.server.errors += 1
+            self._send_error(self.server.error_status)
+            return
+
+        prompt: str = str(payload.get("messages", [{}])[-1].get("content", ""))
+        tokens: list[str] = self._completion_tokens(prompt)
+        finish_reason: str = "stop"
+        max_tokens: Optional[int] = payload.get("max_completion_tokens") or payload.get("max_tokens")
+        if max_tokens and len(tokens) > max_tokens:
+            tokens, finish_reason = tokens[:max_tokens], "length"
+        usage: dict[str, int] = {
+            "prompt_tokens": len(prompt.split()),
+            "completion_tokens": len(tokens),
+            "total_tokens": len(prompt.split()) + len(tokens),
+        }
+        if payload.get("stream"):
+            include_usage: bool = bool((payload.get("stream_options") or {}).get("include_usage"))
+            self._stream(payload, tokens, finish_reason, usage if include_usage else None)
+            return
+
+        if self.server.tokens_per_second:
+            time.sleep(len(tokens) / self.server.tokens_per_second)
+        self._send_json(200, {
+            "id": f"chatcmpl-stub-{self.server.requests}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": payload.get("model", "stub"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": "".join(tokens)},
+                "finish_reason": finish_reason,
+            }],
+            "usage": usage,
+        })
+
+    def _completion_tokens(self, prompt: str) -> list[str]:
+        """The completion as a list of tokens (words, later ones with their leading space)."""
+        if self.server.reply_tokens is not None:
+            content: str = " ".join(f"token{index}" for index in range(self.server.reply_tokens))
+        else:
+            content = self.server.reply or f"stub reply to: {prompt}"
+        words: list[str] = content.split(" ")
+        return [words[0]] + [" " + word for word in words[1:]] if content else []
+
+    def _stream(self, payload: dict[str, Any], tokens: list[str], finish_reason: str,
+                usage: Optional[dict[str, int]]) -> None:
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        chunk_id: str = f"chatcmpl-stub-{self.server.requests}"
+
+        def event(choices: list[dict[str, Any]], **extra: Any) -> None:
+            self._write_chunk(chunk_id, payload, choices, **extra)
+
+        event([{"index": 0, "delta": {"role": "assistant", "content": ""}, "finish_reason": None}])
+        delay: float = 1 / self.server.tokens_per_second if self.server.tokens_per_second else 0.0
+        for token in tokens:
+            if delay:
+                time.sleep(delay)
+            event([{"index": 0, "delta": {"content": token}, "finish_reason": None}])
+        event([{"index": 0, "delta": {}, "finish_reason": finish_reason}])
+        if usage is not None:
+            event([], usage=usage)
+        self._write_raw(b"data: [DONE]\n\n")
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+    def _write_chunk(self, chunk_id: str, payload: dict[str, Any], choices: list[dict[str, Any]], **extra: Any) -> None:
+        body: dict[str, Any] = {
+            "id": chunk_id,
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": payload.get("model", "stub"),
+            "choices": choices,
+            **extra,
+        }
+        self._write_raw(f"data: {json.dumps(body)}\n\n".encode())
+
+    def _write_raw(self, data: bytes) -> None:
+        """Write one piece of a chunked (Transfer-Encoding) body and flush it."""
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+    def _send_error(self, status: int) -> None:
+        headers: dict[str, str] = {"Retry-After": "1"} if status == 429 else {}
+        error_type: str = "rate_limit_exceeded" if status == 429 else "server_error"
+        self._send_json(status, {"error": {"message": f"Injected error {status}", "type": error_type, "code": status}},
+                        headers)
+
+    def _send_json(self, status: int, body: dict[str, Any], headers: Optional[dict[str, str]] = None) -> None:
+        data: bytes = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class _StubHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # Load tests open many connections at once; the default backlog of 5 drops SYNs
+    request_queue_size = 128
+
+    def __init__(self, address: tuple[str, int], latency: float, reply: Optional[str], tokens_per_second: float,
+                 reply_tokens: Optional[int], error_rate: float, error_status: int, seed: Optional[int]) -> None:
+        super().__init__(address, _StubHandler)
+        self.latency: float = latency
+        self.reply: Optional[str] = reply
+        self.tokens_per_second: float = tokens_per_second
+        self.reply_tokens: Optional[int] = reply_tokens
+        self.error_rate: float = error_rate
+        self.error_status: int = error_status
+        self.random: random.Random = random.Random(seed)
+        self.connections: int = 0
+        self.requests: int = 0
+        self.errors: int = 0
+        self.in_flight: int = 0
+        self.peak_in_flight: int = 0
+        self.lock: threading.Lock = threading.Lock()
+
+
+class StubLLMServer:
+    """
+    OpenAI-compatible chat completions server running in a background thread.
+
+    Args:
+        host: Interface to bind.
+        port: Port to bind; 0 picks a free one.
+        latency: Seconds to wait before answering each request (time to
+            first byte).
+        reply: Fixed completion text. Defaults to echoing the last message.
+        tokens_per_second: Generation speed; 0 produces the whole completion
+            at once.
+        reply_tokens: Answer with a completion of exactly this many tokens
+            instead of ``reply``.
+        error_rate: Fraction of requests (0 to 1) answered with ``error_status``.
+        error_status: HTTP status of injected errors, e.g. 429 or 500.
+        seed: Seed for choosing the failing requests, for repeatable runs.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.0, reply: Optional[str] = None,
+                 tokens_per_second: float = 0.0, reply_tokens: Optional[int] = None, error_rate: float = 0.0,
+                 error_status: int = 500, seed: Optional[int] = None) -> None:
+        self._server: _StubHTTPServer = _StubHTTPServer(
+            (host, port), latency, reply, tokens_per_second, reply_tokens, error_rate, error_status, seed,
+        )
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        """Base URL to use as LLM_API_BASE, e.g. ``http://127.0.0.1:8123/v1``."""
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    @property
+    def connections(self) -> int:
+        """Number of TCP connections accepted so far."""
+        return self._server.connections
+
+    @property
+    def requests(self) -> int:
+        """Number of HTTP requests answered so far."""
+        return self._server.requests
+
+    @property
+    def errors(self) -> int:
+        """Number of injected errors returned so far."""
+        return self._server.errors
+
+    @property
+    def peak_in_flight(self) -> int:
+        """Highest number of requests the server was answering at the same time."""
+        return self._server.peak_in_flight
+
+    def start(self) -> "StubLLMServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self) -> None:
+        """Serve in the calling thread until interrupted (standalone use)."""
+        try:
+            self._server.serve_forever()
+        finally:
+            self._server.server_close()
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> "StubLLMServer":
+        return self.start()
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.stop()
@@ -0,0 +1,237 @@
+"""
+Latency and token accounting of upstream LLM calls.
+
+Every upstream call in ``llm_helper`` runs inside ``track_llm_call()`` (or
+``atrack_llm_call()`` in coroutines). When the call ends, successfully or not:
+
+    - Prometheus metrics are updated: ``llm_request_seconds`` and
+      ``llm_time_to_first_token_seconds`` histograms, and the
+      ``llm_tokens_total`` counter, labelled by model and outcome;
+    - a usage record is appended to the Redis list ``llm_usage:pending``.
+
+The periodic ``flush_llm_usage`` task moves pending records into the
+``LLMUsage`` table in batches of ``LLM_USAGE_FLUSH_BATCH`` rows, so the
+request path never writes to the database. A batch is moved to
+``llm_usage:processing`` and only deleted once its insert has committed, so
+a flush that fails or dies midway leaves it for the next run (a crash right
+after the commit writes it twice). The pending list is capped at
+``LLM_USAGE_BUFFER_MAX`` records (oldest dropped) in case the flush stops
+running. Redis errors are logged; metrics are recorded regardless.
+
+Cache hits and calls refused by ``llm_governor`` never reach the upstream API
+and are not recorded here (see ``llm_cache_requests_total`` and
+``llm_governor_decisions_total``).
+"""
+
+import asyncio
+import json
+import logging
+import time
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, AsyncIterator, Iterator, Optional, TypedDict
+
+import httpx
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from openai import APIConnectionError, APIStatusError, APITimeoutError, RateLimitError
+from redis.exceptions import RedisError
+
+from WebTemplate.redis_client import get_redis
+from .metrics import LLM_REQUEST_SECONDS, LLM_TIME_TO_FIRST_TOKEN_SECONDS, LLM_TOKENS
+
+
+logger = logging.getLogger(__name__)
+
+PENDING_KEY: str = "llm_usage:pending"
+PROCESSING_KEY: str = "llm_usage:processing"
+FLUSH_LOCK_KEY: str = "llm_usage:flushing"
+FLUSH_LOCK_SECONDS: int = 300
+
+# Move the oldest ARGV[1] pending records to the processing list, unless it
+# still holds a batch a previous flush did not finish; return the batch
+_CLAIM: str = """
+if redis.call('LLEN', KEYS[2]) == 0 then
+    local batch = redis.call('LRANGE', KEYS[1], 0, tonumber(ARGV[1]) - 1)
+    for _, record in ipairs(batch) do
+        redis.call('RPUSH', KEYS[2], record)
+    end
+    redis.call('LTRIM', KEYS[1], #batch, -1)
+end
+return redis.call('LRANGE', KEYS[2], 0, -1)
+"""
+
+
+class LLMUsageRecord(TypedDict):
+    """
+    One upstream call waiting in the usage buffer.
+
+    Attributes:
+        model: Model name.
+        operation: "invoke", "ainvoke" or "stream".
+        outcome: "success" or an error class, see classify_error.
+        prompt_tokens: Input tokens reported by the provider.
+        completion_tokens: Output tokens reported by the provider.
+        latency_ms: Wall time of the call.
+        time_to_first_token_ms: Time until the first streamed token, or None
+            for non-streaming calls and streams that produced no token.
+        created: Unix time at which the call started.
+    """
+
+    model: str
+    operation: str
+    outcome: str
+    prompt_tokens: int
+    completion_tokens: int
+    latency_ms: int
+    time_to_first_token_ms: Optional[int]
+    created: float
+
+
+def classify_error(error: Optional[BaseException]) -> str:
+    """Map the exception that ended a call to a small, fixed set of outcome labels."""
+    if error is None:
+        return 'success'
+    if isinstance(error, (GeneratorExit, asyncio.CancelledError)):
+        return 'cancelled'
+    if isinstance(error, RateLimitError):
+        return 'rate_limited'
+    if isinstance(error, (APITimeoutError, httpx.TimeoutException, TimeoutError)):
+        return 'timeout'
+    if isinstance(error, (APIConnectionError, httpx.TransportError)):
+        return 'connection_error'
+    if isinstance(error, APIStatusError):
+        return 'server_error' if error.status_code >= 500 else 'client_error'
+    return 'error'
+
+
+class LLMCall:
+    """
+    Measurements of one upstream call, filled in by the caller while it runs.
+
+    Attributes:
+        model: Model name.
+        operation: "invoke", "ainvoke" or "stream".
+        prompt_tokens: Input tokens reported so far.
+        completion_tokens: Output tokens reported so far.
+        time_to_first_token: Seconds until first_token() was called, or None.
+    """
+
+    def __init__(self, model: str, operation: str) -> None:
+        self.model: str = model
+        self.operation: str = operation
+        self.prompt_tokens: int = 0
+        self.completion_tokens: int = 0
+        self.time_to_first_token: Optional[float] = None
+        self._created: float = time.time()
+        self._started: float = time.monotonic()
+
+    def first_token(self) -> None:
+        """Mark the arrival of streamed content; only the first call counts."""
+        if self.time_to_first_token is None:
+            self.time_to_first_token = time.monotonic() - self._started
+
+    def add_usage(self, usage: Optional[dict[str, Any]]) -> None:
+        """Add the ``usage_metadata`` of a LangChain message or chunk, if it has any."""
+        if usage:
+            self.prompt_tokens += int(usage.get('input_tokens') or 0)
+            self.completion_tokens += int(usage.get('output_tokens') or 0)
+
+    def finish(self, error: Optional[BaseException] = None) -> LLMUsageRecord:
+        """Record the call's metrics and return its usage record."""
+        latency: float = time.monotonic() - self._started
+        outcome: str = classify_error(error)
+        LLM_REQUEST_SECONDS.labels(model=self.model, outcome=outcome).observe(latency)
+        if self.time_to_first_token is not None:
+            LLM_TIME_TO_FIRST_TOKEN_SECONDS.labels(model=self.model).observe(self.time_to_first_token)
+        if self.prompt_tokens:
+            LLM_TOKENS.labels(model=self.model, kind='prompt').inc(self.prompt_tokens)
+        if self.completion_tokens:
+            LLM_TOKENS.labels(model=self.model, kind='completion').inc(self.completion_tokens)
+        return {
+            'model': self.model,
+            'operation': self.operation,
+            'outcome': outcome,
+            'prompt_tokens': self.prompt_tokens,
+            'completion_tokens': self.completion_tokens,
+            'latency_ms': round(latency * 1000),
+            'time_to_first_token_ms': None if self.time_to_first_token is None else round(self.time_to_first_token * 1000),
+            'created': self._created,
+        }
+
+
+def buffer_usage(record: LLMUsageRecord) -> None:
+    """Append a usage record to the pending list; errors are logged, never raised."""
+    try:
+        pipe = get_redis().pipeline(transaction=False)
+        pipe.rpush(PENDING_KEY, json.dumps(record))
+        pipe.ltrim(PENDING_KEY, -int(getattr(settings, 'LLM_USAGE_BUFFER_MAX', 100000)), -1)
+        pipe.execute()
+    except RedisError as e:
+        logger.warning("LLM usage record dropped: %s", e)
+
+
+def claim_usage(limit: int) -> list[LLMUsageRecord]:
+    """
+    Move up to ``limit`` of the oldest pending records to the processing list and return them.
+
+    A batch left there by a flush that failed is returned again first. Call
+    ack_usage once the batch is stored.
+
+    Raises:
+        redis.exceptions.RedisError: If Redis is unavailable.
+    """
+    raw_records: list[bytes] = get_redis().eval(_CLAIM, 2, PENDING_KEY, PROCESSING_KEY, limit)
+    return [json.loads(raw) for raw in raw_records]
+
+
+def ack_usage() -> None:
+    """Drop the claimed batch once it has been stored."""
+    get_redis().delete(PROCESSING_KEY)
+
+
+@contextmanager
+def usage_flush_lock() -> Iterator[bool]:
+    """
+    Hold the flush lock for the block, so only one flush claims batches at a time.
+
+    Yields False without locking if another flush holds it.
+
+    Raises:
+        redis.exceptions.RedisError: If Redis is unavailable.
+    """
+    if not get_redis().set(FLUSH_LOCK_KEY, 1, nx=True, ex=FLUSH_LOCK_SECONDS):
+        yield False
+        return
+    try:
+        yield True
+    finally:
+        get_redis().delete(FLUSH_LOCK_KEY)
+
+
+@contextmanager
+def track_llm_call(model: str, operation: str) -> Iterator[LLMCall]:
+    """
+    Measure the upstream call made inside the block.
+
+    The block reports streamed tokens and provider usage on the yielded
+    LLMCall. Exceptions are classified as the outcome and re-raised.
+    """
+    call: LLMCall = LLMCall(model, operation)
+    try:
+        yield call
+    except BaseException as e:
+        buffer_usage(call.finish(e))
+        raise
+    buffer_usage(call.finish())
+
+
+@asynccontextmanager
+async def atrack_llm_call(model: str, operation: str) -> AsyncIterator[LLMCall]:
+    """Async counterpart of track_llm_call; the Redis write runs in a worker thread."""
+    call: LLMCall = LLMCall(model, operation)
+    try:
+        yield call
+    except BaseException as e:
+        await sync_to_async(buffer_usage, thread_sensitive=False)(call.finish(e))
+        raise
+    await sync_to_async(buffer_usage, thread_sensitive=False)(call.finish())
@@ -0,0 +1,248 @@
+"""
+Attachment extraction for incoming mail, part by part.
+
+``mail_sync`` hands over the ``BODYSTRUCTURE`` of every new message; only
+the parts it lists as attachments with a wanted extension
+(``MAIL_ATTACHMENT_EXTENSIONS``) are downloaded, with
+``BODY.PEEK[section]<offset.length>`` in pieces of
+``MAIL_ATTACHMENT_CHUNK_BYTES``. Each piece is decoded as it arrives
+(base64 or quoted-printable) and written to a temporary upload file, which
+the storage then moves into place as a new ``Documents`` row; a colliding
+name gets a unique suffix. Memory use is bounded by the piece size whatever
+the size of the attachment, and message bodies and unwanted parts are never
+transferred.
+
+``BODY.PEEK`` leaves the \\Seen flag alone.
+"""
+
+import binascii
+import imaplib
+import logging
+import os
+from email.header import decode_header, make_header
+from email.utils import collapse_rfc2231_value, decode_rfc2231
+from typing import BinaryIO, Optional, TypedDict
+from urllib.parse import unquote
+
+from django.conf import settings
+from django.core.files.uploadedfile import TemporaryUploadedFile
+
+from .mail_sync import IMAPValue, fetch_attributes
+from .models import BusinessLogicModel, Documents
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_EXTENSIONS: list[str] = ['.xlsx', '.xls', '.docx', '.pdf', '.csv', '.txt']
+
+
+class AttachmentPart(TypedDict):
+    """
+    An attachment listed in a BODYSTRUCTURE.
+
+    Attributes:
+        section: Part number for BODY[section], e.g. "2" or "1.3".
+        filename: Decoded file name.
+        content_type: MIME type, e.g. "application/pdf".
+        encoding: Content-Transfer-Encoding, lowercase.
+        size: Size of the encoded part in bytes.
+    """
+
+    section: str
+    filename: str
+    content_type: str
+    encoding: str
+    size: int
+
+
+def _parameters(value: IMAPValue) -> dict[str, str]:
+    if not isinstance(value, list):
+        return {}
+    return {str(value[index]).lower(): value[index + 1] or "" for index in range(0, len(value) - 1, 2)}
+
+
+def _filename(parameters: dict[str, str]) -> Optional[str]:
+    """The file name from RFC 2231 (``filename*``), RFC 2047 (encoded words) or plain parameters."""
+    for key in ('filename', 'name'):
+        if f"{key}*" in parameters:
+            charset, _, text = decode_rfc2231(parameters[f"{key}*"])
+            if charset:
+                return unquote(text, encoding=charset, errors='replace')
+            return collapse_rfc2231_value(unquote(text))
+        if parameters.get(key):
+            return str(make_header(decode_header(parameters[key])))
+    return None
+
+
+def find_attachments(structure: list[IMAPValue], section: str = "") -> list[AttachmentPart]:
+    """
+    List the attachments of a message from its parsed BODYSTRUCTURE.
+
+    A part is an attachment if its Content-Disposition is "attachment" and it
+    has a file name. Messages attached to a message are not descended into.
+
+    Args:
+        structure: BODYSTRUCTURE as parsed by mail_sync.parse_response.
+        section: Section of ``structure`` itself; "" for the whole message.
+
+    Returns:
+        list[AttachmentPart]: In the order of the message.
+    """
+    if structure and isinstance(structure[0], list):
+        children: list[list[IMAPValue]] = []
+        for child in structure:
+            if not isinstance(child, list):
+                break
+            children.append(child)
+        attachments: list[AttachmentPart] = []
+        for number, child in enumerate(children, 1):
+            attachments += find_attachments(child, f"{section}.{number}" if section else str(number))
+        return attachments
+
+    if len(structure) < 7:
+        return []
+    main_type, sub_type = str(structure[0]).lower(), str(structure[1]).lower()
+    # Extension data starts after the type-specific fields (RFC 3501, 7.4.2)
+    extension: int = {'text': 8, 'message': 10 if sub_type == 'rfc822' else 7}.get(main_type, 7)
+    disposition: IMAPValue = structure[extension + 1] if len(structure) > extension + 1 else None
+    if not isinstance(disposition, list) or str(disposition[0]).lower() != 'attachment':
+        return []
+    filename: Optional[str] = _filename(_parameters(disposition[1] if len(disposition) > 1 else None))
+    filename = filename or _filename(_parameters(structure[2]))
+    if not filename:
+        return []
+    return [{
+        'section': section or "1",
+        'filename': filename,
+        'content_type': f"{main_type}/{sub_type}",
+        'encoding': str(structure[5] or '7bit').lower(),
+        'size': int(structure[6] or 0),
+    }]
+
+
+def is_wanted(part: AttachmentPart) -> bool:
+    """Whether an attachment has one of the MAIL_ATTACHMENT_EXTENSIONS (any, if the setting is empty)."""
+    extensions: list[str] = getattr(settings, 'MAIL_ATTACHMENT_EXTENSIONS', DEFAULT_EXTENSIONS)
+    return not extensions or os.path.splitext(part['filename'])[1].lower() in extensions
+
+
+class _Base64Decoder:
+    def __init__(self) -> None:
+        self._pending: bytes = b""
+
+    def feed(self, data: bytes) -> bytes:
+        data = self._pending + data.translate(None, b" \t\r\n")
+        usable: int = len(data) - len(data) % 4
+        self._pending = data[usable:]
+        return binascii.a2b_base64(data[:usable])
+
+    def flush(self) -> bytes:
+        if not self._pending.strip(b"="):
+            return b""
+        return binascii.a2b_base64(self._pending + b"=" * (-len(self._pending) % 4))
+
+
+class _QuotedPrintableDecoder:
+    def __init__(self) -> None:
+        self._pending: bytes = b""
+
+    def feed(self, data: bytes) -> bytes:
+        # Decode whole lines only, so an escape or soft line break is never cut in half
+        data = self._pending + data
+        end: int = data.rfind(b"\n") + 1
+        self._pending = data[end:]
+        return binascii.a2b_qp(data[:end])
+
+    def flush(self) -> bytes:
+        return binascii.a2b_qp(self._pending)
+
+
+class _IdentityDecoder:
+    def feed(self, data: bytes) -> bytes:
+        return data
+
+    def flush(self) -> bytes:
+        return b""
+
+
+def _decoder(encoding: str):
+    if encoding == 'base64':
+        return _Base64Decoder()
+    if encoding == 'quoted-printable':
+        return _QuotedPrintableDecoder()
+    return _IdentityDecoder()
+
+
+def download_part(imap: imaplib.IMAP4, uid: int, part: AttachmentPart, destination: BinaryIO,
+                  chunk_size: Optional[int] = None) -> int:
+    """
+    Download and decode one part of a message into a file, piece by piece.
+
+    Args:
+        imap: Connection with the message's mailbox selected.
+        uid: UID of the message.
+        part: The part to download.
+        destination: Binary file the decoded content is written to.
+        chunk_size: Encoded bytes per request. Defaults to
+            settings.MAIL_ATTACHMENT_CHUNK_BYTES.
+
+    Returns:
+        int: Decoded bytes written.
+
+    Raises:
+        imaplib.IMAP4.error: If the message no longer exists.
+    """
+    chunk_size = chunk_size or getattr(settings, 'MAIL_ATTACHMENT_CHUNK_BYTES', 1024 * 1024)
+    decoder = _decoder(part['encoding'])
+    offset: int = 0
+    written: int = 0
+    while True:
+        status, data = imap.uid('FETCH', str(uid), f"(BODY.PEEK[{part['section']}]<{offset}.{chunk_size}>)")
+        if status != 'OK' or not fetch_attributes(data):
+            raise imaplib.IMAP4.error(f"Cannot fetch part {part['section']} of message {uid}: {data}")
+        # Literals come back as bytes; an empty piece may be sent as "" or NIL
+        chunk: bytes = next((piece[1] for piece in data if isinstance(piece, tuple)), b"")
+        written += destination.write(decoder.feed(chunk))
+        offset += len(chunk)
+        if len(chunk) < chunk_size:
+            break
+    written += destination.write(decoder.flush())
+    return written
+
+
+def save_attachment(imap: imaplib.IMAP4, uid: int, part: AttachmentPart, item: BusinessLogicModel) -> Documents:
+    """
+    Download an attachment into a temporary file and register it as a document of ``item``.
+
+    The storage moves the temporary file into MEDIA_ROOT/Documents/ under the
+    attachment's name, made unique if a file of that name exists.
+
+    Returns:
+        Documents: The new row; its indexing for retrieval is scheduled on commit.
+    """
+    upload: TemporaryUploadedFile = TemporaryUploadedFile(
+        os.path.basename(part['filename']), part['content_type'], 0, None,
+    )
+    try:
+        upload.size = download_part(imap, uid, part, upload)
+        upload.seek(0)
+        document: Documents = Documents(client_inn=item)
+        document.document.save(upload.name, upload, save=True)
+    finally:
+        upload.close()
+    logger.info("Saved attachment %r of message %s as document %s (%s bytes)",
+                part['filename'], uid, document.pk, upload.size)
+    return document
+
+
+def save_attachments(imap: imaplib.IMAP4, uid: int, structure: list[IMAPValue],
+                     item: BusinessLogicModel) -> list[Documents]:
+    """
+    Save the wanted attachments of a message as documents of ``item``.
+
+    A mail_sync handler once ``item`` is bound, e.g. with functools.partial.
+
+    Returns:
+        list[Documents]: The new rows, in the order of the message.
+    """
+    return [save_attachment(imap, uid, part, item) for part in find_attachments(structure) if is_wanted(part)]
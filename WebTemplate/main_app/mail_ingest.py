@@ -0,0 +1,352 @@
+"""
+Parallel ingestion of several IMAP accounts and mailboxes.
+
+The periodic ``ingest_mailboxes`` task fans out one ``ingest_mailbox`` task
+per configured (account, mailbox) pair (``MAIL_ACCOUNTS``), so mailboxes are
+synced in parallel across Celery workers. Each sync runs
+``mail_sync.sync_mailbox`` with the attachment handler of
+``mail_attachments``.
+
+Features:
+    - Every worker process keeps a pool of authenticated IMAP connections per
+      account (``IMAPConnectionPool``): logins are reused across mailboxes
+      and tasks, and a connection that went stale is replaced after a failed
+      NOOP.
+    - A per-account lock with ``max_connections`` slots in Redis caps the
+      syncs of an account running at the same time across all workers,
+      which keeps the account within the server's connection limit; a
+      per-mailbox lock keeps two workers from syncing the same mailbox.
+      Both expire after ``MAIL_INGEST_LOCK_TTL`` if a worker dies. Busy
+      mailboxes are skipped until the next round; Redis errors disable the
+      locks for that sync (fail open).
+    - Lag and throughput per mailbox are exported by sync_mailbox as the
+      ``mail_ingest_*`` metrics.
+
+Account passwords stay in the settings; tasks only carry the login and the
+mailbox name.
+"""
+
+import imaplib
+import logging
+import os
+import queue
+import threading
+import uuid
+from contextlib import contextmanager
+from functools import partial
+from typing import Iterator, Optional, TypedDict
+
+from celery.signals import worker_process_shutdown
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from redis.exceptions import RedisError
+
+from WebTemplate.redis_client import get_redis
+from .mail_attachments import save_attachments
+from .mail_sync import SyncReport, connect, sync_mailbox
+from .models import BusinessLogicModel
+
+
+logger = logging.getLogger(__name__)
+
+ACCOUNT_LOCK_PREFIX: str = "mail_ingest:account:"
+MAILBOX_LOCK_PREFIX: str = "mail_ingest:mailbox:"
+
+_RELEASE_LOCK: str = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+class MailAccount(TypedDict):
+    """
+    An IMAP account to ingest, from settings.MAIL_ACCOUNTS.
+
+    Attributes:
+        user: IMAP login; identifies the account.
+        password: IMAP password.
+        host: IMAP server host name.
+        port: IMAP server port.
+        ssl: Whether to connect with implicit TLS.
+        mailboxes: Mailboxes to ingest, e.g. ["INBOX", "Reports"].
+        item_id: BusinessLogicModel the attachments are saved to.
+        max_connections: Connections to the account per worker process, and
+            syncs of the account running at the same time across workers.
+    """
+
+    user: str
+    password: Optional[str]
+    host: str
+    port: int
+    ssl: bool
+    mailboxes: list[str]
+    item_id: Optional[int]
+    max_connections: int
+
+
+def get_mail_accounts() -> list[MailAccount]:
+    """Return the configured accounts, filling in defaults from the MAIL_* settings."""
+    configured: list[dict] = getattr(settings, 'MAIL_ACCOUNTS', None) or [{
+        'user': settings.MAIL_IMAP_USER,
+        'password': settings.MAIL_IMAP_PASSWORD,
+        'mailboxes': getattr(settings, 'MAIL_IMAP_MAILBOXES', ["INBOX"]),
+    }]
+    return [
+        {
+            'user': account['user'],
+            'password': account.get('password'),
+            'host': account.get('host') or settings.MAIL_IMAP_HOST,
+            'port': int(account.get('port') or getattr(settings, 'MAIL_IMAP_PORT', 993)),
+            'ssl': account.get('ssl', getattr(settings, 'MAIL_IMAP_SSL', True)),
+            'mailboxes': list(account.get('mailboxes') or ["INBOX"]),
+            'item_id': account.get('item_id') or getattr(settings, 'MAIL_DOCUMENTS_ITEM_ID', None),
+            'max_connections': max(1, int(account.get('max_connections')
+                                          or getattr(settings, 'MAIL_IMAP_MAX_CONNECTIONS', 2))),
+        }
+        for account in configured
+    ]
+
+
+def get_mail_account(user: str) -> Optional[MailAccount]:
+    """Return the configured account with this login, or None."""
+    return next((account for account in get_mail_accounts() if account['user'] == user), None)
+
+
+def is_connection_error(error: BaseException) -> bool:
+    """
+    Tell whether ``error`` means the IMAP connection is dead and must be reopened.
+
+    ``imaplib.IMAP4.abort`` and socket errors are; other ``IMAP4.error``s
+    (a NO or BAD answer, e.g. to a missing mailbox) leave it usable.
+    """
+    return isinstance(error, (imaplib.IMAP4.abort, OSError))
+
+
+class IMAPConnectionPool:
+    """
+    Thread-safe pool of authenticated IMAP connections to one account.
+
+    Args:
+        host: IMAP server host name.
+        port: IMAP server port.
+        user: Login.
+        password: Password.
+        ssl: Whether to connect with implicit TLS.
+        max_connections: Maximum number of simultaneously open connections.
+    """
+
+    def __init__(self, host: str, port: int, user: str, password: Optional[str], ssl: bool = True,
+                 max_connections: int = 2) -> None:
+        self.host: str = host
+        self.port: int = port
+        self.user: str = user
+        self.password: Optional[str] = password
+        self.ssl: bool = ssl
+        self._idle: queue.LifoQueue[imaplib.IMAP4] = queue.LifoQueue()
+        self._slots: threading.BoundedSemaphore = threading.BoundedSemaphore(max(1, max_connections))
+        self.connections_opened: int = 0
+
+    def _connect(self) -> imaplib.IMAP4:
+        imap: imaplib.IMAP4 = connect(self.host, self.port, self.user, self.password, ssl=self.ssl)
+        self.connections_opened += 1
+        logger.debug("Opened IMAP connection #%s to %s@%s", self.connections_opened, self.user, self.host)
+        return imap
+
+    @staticmethod
+    def _is_alive(imap: imaplib.IMAP4) -> bool:
+        try:
+            return imap.noop()[0] == 'OK'
+        except (imaplib.IMAP4.error, OSError):
+            return False
+
+    @staticmethod
+    def _close(imap: imaplib.IMAP4) -> None:
+        """Close the socket without a LOGOUT; the connection may already be gone."""
+        try:
+            imap.shutdown()
+        except OSError:
+            pass
+
+    @classmethod
+    def _discard(cls, imap: imaplib.IMAP4) -> None:
+        """Send LOGOUT, falling back to closing the socket if the server is gone."""
+        try:
+            imap.logout()
+        except (imaplib.IMAP4.error, OSError):
+            cls._close(imap)
+
+    @contextmanager
+    def connection(self) -> Iterator[imaplib.IMAP4]:
+        """
+        Check out an authenticated connection for the duration of the ``with`` block.
+
+        An idle connection is reused if it still answers NOOP. The connection
+        is returned to the pool afterwards unless it was dropped.
+        """
+        self._slots.acquire()
+        imap: Optional[imaplib.IMAP4] = None
+        try:
+            try:
+                idle: imaplib.IMAP4 = self._idle.get_nowait()
+                if self._is_alive(idle):
+                    imap = idle
+                else:
+                    logger.info("IMAP connection to %s@%s went stale, reconnecting", self.user, self.host)
+                    self._discard(idle)
+            except queue.Empty:
+                pass
+            if imap is None:
+                imap = self._connect()
+            yield imap
+        except BaseException as e:
+            if imap is not None and is_connection_error(e):
+                self._close(imap)
+                imap = None
+            raise
+        finally:
+            if imap is not None:
+                self._idle.put(imap)
+            self._slots.release()
+
+    def close_all(self) -> None:
+        """Log out every idle connection in the pool."""
+        while True:
+            try:
+                self._discard(self._idle.get_nowait())
+            except queue.Empty:
+                return
+
+
+_pools: dict[tuple[str, int, str], IMAPConnectionPool] = {}
+_pools_pid: Optional[int] = None
+_pools_lock: threading.Lock = threading.Lock()
+
+
+def get_imap_pool(account: MailAccount) -> IMAPConnectionPool:
+    """
+    Return the connection pool of an account in the current process, creating it on first use.
+
+    Pools are recreated after a fork so child processes never reuse the
+    parent's sockets.
+    """
+    global _pools_pid
+    key: tuple[str, int, str] = (account['host'], account['port'], account['user'])
+    with _pools_lock:
+        if _pools_pid != os.getpid():
+            _pools.clear()
+            _pools_pid = os.getpid()
+        if key not in _pools:
+            _pools[key] = IMAPConnectionPool(
+                host=account['host'],
+                port=account['port'],
+                user=account['user'],
+                password=account['password'],
+                ssl=account['ssl'],
+                max_connections=account['max_connections'],
+            )
+        return _pools[key]
+
+
+def reset_imap_pools() -> None:
+    """Close and forget the current process' pools (used on shutdown and in tests)."""
+    global _pools_pid
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.close_all()
+        _pools.clear()
+        _pools_pid = None
+
+
+@worker_process_shutdown.connect
+def _close_pools_on_shutdown(**kwargs) -> None:
+    reset_imap_pools()
+
+
+def _acquire_locks(account: MailAccount, mailbox: str, token: str) -> Optional[list[str]]:
+    """Take the mailbox lock and a free account slot; None if either is busy, [] if Redis is down."""
+    ttl: int = int(getattr(settings, 'MAIL_INGEST_LOCK_TTL', 15 * 60))
+    acquired: list[str] = []
+    try:
+        redis = get_redis()
+        mailbox_key: str = f"{MAILBOX_LOCK_PREFIX}{account['user']}:{mailbox}"
+        if not redis.set(mailbox_key, token, nx=True, ex=ttl):
+            return None
+        acquired.append(mailbox_key)
+        for slot in range(account['max_connections']):
+            account_key: str = f"{ACCOUNT_LOCK_PREFIX}{account['user']}:{slot}"
+            if redis.set(account_key, token, nx=True, ex=ttl):
+                acquired.append(account_key)
+                return acquired
+    except RedisError as e:
+        logger.warning("Mail ingest locks unavailable, syncing %s/%s anyway: %s", account['user'], mailbox, e)
+        _release_locks(acquired, token)
+        return []
+    _release_locks(acquired, token)
+    return None
+
+
+def _release_locks(keys: list[str], token: str) -> None:
+    for key in keys:
+        try:
+            get_redis().eval(_RELEASE_LOCK, 1, key, token)
+        except RedisError as e:
+            logger.warning("Mail ingest lock %s not released: %s", key, e)
+
+
+@contextmanager
+def ingest_lock(account: MailAccount, mailbox: str) -> Iterator[bool]:
+    """
+    Hold the mailbox lock and one of the account's slots for the ``with`` block.
+
+    Yields:
+        bool: False if the mailbox is being synced or every slot of the
+        account is taken; the block should then skip the sync.
+    """
+    token: str = uuid.uuid4().hex
+    keys: Optional[list[str]] = _acquire_locks(account, mailbox, token)
+    if keys is None:
+        yield False
+        return
+    try:
+        yield True
+    finally:
+        _release_locks(keys, token)
+
+
+def mailboxes_to_ingest() -> list[tuple[str, str]]:
+    """Return every configured (account login, mailbox) pair."""
+    return [(account['user'], mailbox) for account in get_mail_accounts() for mailbox in account['mailboxes']]
+
+
+def sync_account_mailbox(user: str, mailbox: str) -> Optional[SyncReport]:
+    """
+    Sync one configured mailbox over a pooled connection, under the ingest locks.
+
+    Args:
+        user: Login of a configured account.
+        mailbox: One of its mailboxes.
+
+    Returns:
+        Optional[SyncReport]: None if the mailbox or the account was busy.
+
+    Raises:
+        ImproperlyConfigured: If the account or mailbox is not configured, or
+            no item is set for the documents.
+        imaplib.IMAP4.error: If an IMAP operation fails.
+        OSError: If the server cannot be reached.
+    """
+    account: Optional[MailAccount] = get_mail_account(user)
+    if account is None or mailbox not in account['mailboxes']:
+        raise ImproperlyConfigured(f"Mailbox {user}/{mailbox} is not in MAIL_ACCOUNTS")
+    if account['item_id'] is None:
+        raise ImproperlyConfigured(f"No item_id for {user} and no MAIL_DOCUMENTS_ITEM_ID")
+    item: BusinessLogicModel = BusinessLogicModel.objects.get(pk=account['item_id'])
+
+    with ingest_lock(account, mailbox) as acquired:
+        if not acquired:
+            logger.info("Skipping %s/%s: already being synced or no free connection slot", user, mailbox)
+            return None
+        with get_imap_pool(account).connection() as imap:
+            return sync_mailbox(imap, user, mailbox, partial(save_attachments, item=item))
@@ -0,0 +1,67 @@
+"""
+Benchmark the bulk notification fan-out against the per-row create loop.
+
+Usage:
+    python manage.py benchmark_fanout --users 2000 --chunk-size 500
+
+Everything runs inside a transaction that is rolled back at the end, so the
+command leaves no rows behind.
+"""
+
+import time
+from typing import Any
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandParser
+from django.db import transaction
+
+from main_app.fanout import chunk_recipients, write_notification_chunk
+from main_app.models import BusinessLogicModel
+from users.models import NotificationTypes, WebNotifications
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = "Compare rows/sec of the WebNotifications create() loop and the chunked bulk_create fan-out."
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument('--users', type=int, default=2000, help="Number of recipients to notify.")
+        parser.add_argument('--chunk-size', type=int, default=500, help="Recipients per bulk_create chunk.")
+
+    def handle(self, *args: Any, **options: Any) -> None:
+        try:
+            with transaction.atomic():
+                self._run(options['users'], options['chunk_size'])
+                raise _Rollback()
+        except _Rollback:
+            pass
+
+    def _run(self, user_count: int, chunk_size: int) -> None:
+        User.objects.bulk_create([User(username=f"fanout_bench_{i}") for i in range(user_count)])
+        user_ids: list[int] = list(User.objects.filter(username__startswith="fanout_bench_").values_list('id', flat=True))
+        item: BusinessLogicModel = BusinessLogicModel.objects.create()
+        notification_type: str = NotificationTypes.type_1
+
+        started: float = time.perf_counter()
+        for user_id in user_ids:
+            WebNotifications.objects.create(item_id=item.id, user_id=user_id, notification_type=notification_type)
+        loop_seconds: float = time.perf_counter() - started
+        self._report("create() loop", len(user_ids), loop_seconds)
+
+        started = time.perf_counter()
+        for index, chunk in enumerate(chunk_recipients(user_ids, chunk_size)):
+            timing = write_notification_chunk(item.id, notification_type, chunk, chunk=index)
+            self.stdout.write(f"  chunk {timing['chunk']}: {timing['rows']} rows in {timing['seconds']:.4f}s "
+                              f"({timing['rows_per_second']:.0f} rows/sec)")
+        bulk_seconds: float = time.perf_counter() - started
+        self._report(f"bulk_create x{chunk_size}", len(user_ids), bulk_seconds)
+
+        if bulk_seconds > 0:
+            self.stdout.write(self.style.SUCCESS(f"Speed-up: {loop_seconds / bulk_seconds:.1f}x"))
+
+    def _report(self, label: str, rows: int, seconds: float) -> None:
+        rate: float = rows / seconds if seconds > 0 else float(rows)
+        self.stdout.write(f"{label}: {rows} rows in {seconds:.3f}s ({rate:.0f} rows/sec)")
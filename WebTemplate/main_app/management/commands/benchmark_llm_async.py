@@ -0,0 +1,72 @@
+"""
+Load-test the sync LLM call and the async LLM view against a delayed local stub.
+
+Usage:
+    python manage.py benchmark_llm_async --requests 40 --latency 0.5 --workers 4
+
+The sync path (``get_llm_response``) is driven from ``--workers`` threads, the
+way ``gunicorn -w 4`` sync workers would serve a sync view: each in-flight
+completion occupies one worker.
+The async path runs every request as a coroutine on a single event loop, the
+way one ASGI worker serves ``llm_response_async_view``. The stub answers
+every call after ``--latency`` seconds, so the difference in wall time is the
+concurrency gained.
+"""
+
+import asyncio
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any
+
+from django.core.management.base import BaseCommand, CommandParser
+from django.test import AsyncRequestFactory, override_settings
+
+from main_app.llm_helper import get_llm_response, reset_llm_clients
+from main_app.llm_stub import StubLLMServer
+from main_app.views import llm_response_async_view
+
+
+class Command(BaseCommand):
+    help = "Compare wall time of N concurrent LLM calls through sync workers and the async view."
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument('--requests', type=int, default=40, help="Concurrent requests per run.")
+        parser.add_argument('--latency', type=float, default=0.5, help="Stub server latency per call, in seconds.")
+        parser.add_argument('--workers', type=int, default=4, help="Sync workers (threads) making the sync calls.")
+
+    def handle(self, *args: Any, **options: Any) -> None:
+        count: int = options['requests']
+        os.environ.setdefault('DEEPSEEK_API_KEY', 'stub')
+        body: str = json.dumps({'prompt': 'ping', 'cache': False})
+        with StubLLMServer(latency=options['latency']) as stub, \
+                override_settings(LLM_API_BASE=stub.base_url, LLM_HTTP_MAX_CONNECTIONS=max(count, 20)):
+            reset_llm_clients()
+
+            started: float = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=options['workers']) as pool:
+                statuses = list(pool.map(
+                    lambda _: 200 if get_llm_response('ping', use_cache=False)['success'] else 502,
+                    range(count),
+                ))
+            self._report(f"sync calls, {options['workers']} workers", statuses, time.perf_counter() - started)
+
+            async_factory = AsyncRequestFactory()
+
+            async def run_async() -> list[int]:
+                responses = await asyncio.gather(*(
+                    llm_response_async_view(async_factory.post('/api/llm/async/', body, content_type='application/json'))
+                    for _ in range(count)
+                ))
+                return [response.status_code for response in responses]
+
+            started = time.perf_counter()
+            statuses = asyncio.run(run_async())
+            self._report("async view, 1 event loop", statuses, time.perf_counter() - started)
+            reset_llm_clients()
+
+    def _report(self, label: str, statuses: list[int], seconds: float) -> None:
+        ok: int = sum(1 for status in statuses if status == 200)
+        self.stdout.write(f"{label}: {len(statuses)} requests ({ok} ok) in {seconds:.2f}s "
+                          f"({len(statuses) / seconds:.1f} req/s)")
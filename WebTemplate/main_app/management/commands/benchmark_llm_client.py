@@ -0,0 +1,58 @@
+"""
+Benchmark a new LLM client per call against the shared client registry.
+
+Usage:
+    python manage.py benchmark_llm_client --calls 200 --latency 0.01
+
+Both runs talk to a local OpenAI-compatible stub server, so the numbers show
+only the client-side overhead (client construction and connection setup) and
+no API key or network access is needed.
+"""
+
+import os
+import time
+from typing import Any
+
+from django.core.management.base import BaseCommand, CommandParser
+from django.test import override_settings
+from langchain.schema import HumanMessage
+from langchain_openai import ChatOpenAI
+
+from main_app.llm_helper import get_llm_response, reset_llm_clients
+from main_app.llm_stub import StubLLMServer
+
+
+class Command(BaseCommand):
+    help = "Compare per-call latency of a fresh ChatOpenAI per request and the process-wide client registry."
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument('--calls', type=int, default=200, help="Number of sequential calls per run.")
+        parser.add_argument('--latency', type=float, default=0.0, help="Stub server latency per call, in seconds.")
+
+    def handle(self, *args: Any, **options: Any) -> None:
+        calls: int = options['calls']
+        os.environ.setdefault('DEEPSEEK_API_KEY', 'stub')
+        with StubLLMServer(latency=options['latency']) as stub, override_settings(LLM_API_BASE=stub.base_url):
+            started: float = time.perf_counter()
+            for _ in range(calls):
+                llm = ChatOpenAI(model="deepseek-chat", openai_api_key="stub", openai_api_base=stub.base_url,
+                                 temperature=0.0, max_tokens=2048)
+                llm.invoke([HumanMessage(content="ping")])
+            self._report("new client per call", calls, time.perf_counter() - started, stub.connections)
+
+            opened: int = stub.connections
+            reset_llm_clients()
+            started = time.perf_counter()
+            for _ in range(calls):
+                response = get_llm_response("ping")
+                if not response['success']:
+                    self.stderr.write(response['error'])
+                    return
+            shared_seconds: float = time.perf_counter() - started
+            self._report("shared client", calls, shared_seconds, stub.connections - opened)
+            reset_llm_clients()
+
+    def _report(self, label: str, calls: int, seconds: float, connections: int) -> None:
+        per_call_ms: float = seconds / calls * 1000 if calls else 0.0
+        self.stdout.write(f"{label}: {calls} calls in {seconds:.3f}s ({per_call_ms:.2f} ms/call, "
+                          f"{connections} connections)")
@@ -0,0 +1,95 @@
+"""
+Load-test the LLM endpoint at several concurrency levels.
+
+Usage:
+    python manage.py loadtest_llm --concurrency 1,8,32 --requests 200
+    python manage.py loadtest_llm --stream --error-rate 0.05 --error-status 429
+    python manage.py loadtest_llm --url http://127.0.0.1:8000/api/llm/ --concurrency 8,64
+
+Without ``--url`` the command starts a local stub (see run_llm_stub for its
+options), points LLM_API_BASE at it and drives ``/api/llm/`` in-process
+through URL routing, middleware and the view. With ``--url`` it sends real
+HTTP requests to a running server, which should itself be configured with
+LLM_API_BASE pointing at ``manage.py run_llm_stub``. Either way no network
+access or API key is needed.
+
+Every level reports throughput, latency percentiles and the status codes
+seen; ``--stream`` also reports the median time to the first event.
+"""
+
+import json
+import os
+from typing import Any, Callable, Optional
+
+import httpx
+from django.core.management.base import BaseCommand, CommandError, CommandParser
+from django.test import override_settings
+from django.urls import reverse
+
+from main_app.llm_helper import reset_llm_clients
+from main_app.llm_loadtest import LoadReport, Sender, client_sender, http_sender, run_load
+from main_app.llm_stub import StubLLMServer
+from main_app.management.commands.run_llm_stub import add_stub_arguments, stub_options
+
+
+class Command(BaseCommand):
+    help = "Report p50/p95/p99 latency and requests per second of the LLM endpoint at given concurrency levels."
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument('--concurrency', default='1,4,16', help="Comma-separated concurrency levels.")
+        parser.add_argument('--requests', type=int, default=100, help="Requests per concurrency level.")
+        parser.add_argument('--url', default=None, help="Endpoint of a running server; in-process if omitted.")
+        parser.add_argument('--prompt', default='ping', help="Prompt sent with every request.")
+        parser.add_argument('--stream', action='store_true', help="Request Server-Sent Events.")
+        parser.add_argument('--json', action='store_true', help="Print the reports as JSON.")
+        add_stub_arguments(parser)
+
+    def handle(self, *args: Any, **options: Any) -> None:
+        try:
+            levels: list[int] = [int(level) for level in options['concurrency'].split(',') if level.strip()]
+        except ValueError:
+            raise CommandError("--concurrency must be a comma-separated list of integers")
+        if not levels or min(levels) < 1 or options['requests'] < 1:
+            raise CommandError("concurrency levels and --requests must be positive")
+        body: dict[str, Any] = {'prompt': options['prompt'], 'cache': False, 'stream': options['stream']}
+
+        if options['url']:
+            limits = httpx.Limits(max_connections=max(levels), max_keepalive_connections=max(levels))
+            with httpx.Client(limits=limits, timeout=120.0) as client:
+                reports = self._run(levels, options['requests'], options['json'],
+                                    lambda: http_sender(client, options['url'], body, options['stream']))
+        else:
+            os.environ.setdefault('DEEPSEEK_API_KEY', 'stub')
+            with StubLLMServer(**stub_options(options)) as stub, \
+                    override_settings(LLM_API_BASE=stub.base_url, LLM_HTTP_MAX_CONNECTIONS=max(max(levels), 20),
+                                      LLM_HTTP_MAX_KEEPALIVE=max(max(levels), 10)):
+                reset_llm_clients()
+                try:
+                    reports = self._run(levels, options['requests'], options['json'],
+                                        lambda: client_sender(reverse('llm-response'), body, options['stream']))
+                finally:
+                    reset_llm_clients()
+
+        if options['json']:
+            self.stdout.write(json.dumps(reports, indent=2))
+
+    def _run(self, levels: list[int], requests: int, quiet: bool, make_sender: Callable[[], Sender]) -> list[LoadReport]:
+        reports: list[LoadReport] = []
+        for concurrency in levels:
+            send: Sender = make_sender()
+            report: LoadReport = run_load(send, concurrency, requests)
+            reports.append(report)
+            if not quiet:
+                self._report(report)
+        return reports
+
+    def _report(self, report: LoadReport) -> None:
+        first_event: Optional[float] = report['first_event_p50_ms']
+        statuses: str = ", ".join(f"{status}: {count}" for status, count in sorted(report['statuses'].items()))
+        self.stdout.write(
+            f"concurrency {report['concurrency']:>4}: {report['requests']} requests ({report['ok']} ok) "
+            f"in {report['seconds']:.2f}s, {report['rps']:.1f} req/s, "
+            f"p50 {report['p50_ms']:.0f} ms, p95 {report['p95_ms']:.0f} ms, p99 {report['p99_ms']:.0f} ms"
+            + (f", first event p50 {first_event:.0f} ms" if first_event is not None else "")
+            + f" [{statuses}]"
+        )
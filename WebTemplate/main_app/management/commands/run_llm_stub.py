@@ -0,0 +1,57 @@
+"""
+Run the OpenAI-compatible stub server in the foreground.
+
+Usage:
+    python manage.py run_llm_stub --port 8001 --latency 0.3 --tokens-per-second 50
+    LLM_API_BASE=http://127.0.0.1:8001/v1 DEEPSEEK_API_KEY=stub gunicorn -k uvicorn.workers.UvicornWorker WebTemplate.asgi:application
+
+Point a running Django server at the stub through LLM_API_BASE to load-test
+the LLM endpoints offline, e.g. with ``manage.py loadtest_llm --url``.
+"""
+
+from typing import Any
+
+from django.core.management.base import BaseCommand, CommandParser
+
+from main_app.llm_stub import StubLLMServer
+
+
+def add_stub_arguments(parser: CommandParser) -> None:
+    """Options shaping the stub's answers, shared with loadtest_llm."""
+    parser.add_argument('--latency', type=float, default=0.2, help="Seconds before the first byte of every answer.")
+    parser.add_argument('--tokens-per-second', type=float, default=50.0, help="Generation speed; 0 answers at once.")
+    parser.add_argument('--reply-tokens', type=int, default=40, help="Completion length in tokens.")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Fraction of requests answered with an error.")
+    parser.add_argument('--error-status', type=int, default=500, help="HTTP status of injected errors, e.g. 429.")
+    parser.add_argument('--seed', type=int, default=None, help="Seed for choosing the failing requests.")
+
+
+def stub_options(options: dict[str, Any]) -> dict[str, Any]:
+    """Map parsed stub options to StubLLMServer keyword arguments."""
+    return {
+        'latency': options['latency'],
+        'tokens_per_second': options['tokens_per_second'],
+        'reply_tokens': options['reply_tokens'],
+        'error_rate': options['error_rate'],
+        'error_status': options['error_status'],
+        'seed': options['seed'],
+    }
+
+
+class Command(BaseCommand):
+    help = "Serve a local OpenAI-compatible chat completions stub with configurable latency, token rate and errors."
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument('--host', default='127.0.0.1', help="Interface to bind.")
+        parser.add_argument('--port', type=int, default=8001, help="Port to bind.")
+        add_stub_arguments(parser)
+
+    def handle(self, *args: Any, **options: Any) -> None:
+        stub = StubLLMServer(host=options['host'], port=options['port'], **stub_options(options))
+        self.stdout.write(f"LLM stub listening on {stub.base_url} (Ctrl+C to stop)")
+        try:
+            stub.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write(f"Served {stub.requests} requests ({stub.errors} injected errors) "
+                          f"over {stub.connections} connections")
@@ -0,0 +1,104 @@
+"""
+Prometheus metrics for the notification pipeline, the LLM helpers and mail ingestion.
+
+The metrics are registered in the default prometheus_client registry, the same
+one ``django_prometheus`` exports, so they appear next to the request metrics.
+"""
+
+from prometheus_client import Counter, Gauge, Histogram
+
+
+# Outcome "delivered" counts rows/emails actually produced; "merged" counts
+# events folded into an existing notification or digest by the coalescing window.
+NOTIFICATION_EVENTS = Counter(
+    'notification_events_total',
+    'Notification events processed, by channel and outcome.',
+    ['channel', 'outcome'],
+)
+
+# Lookups of the LLM response cache (main_app.llm_cache). Tier is "local" or
+# "redis"; outcome is "hit", "miss" or "bypass" (caller opted out or the call
+# is not deterministic).
+LLM_CACHE_REQUESTS = Counter(
+    'llm_cache_requests_total',
+    'LLM response cache lookups, by tier and outcome.',
+    ['tier', 'outcome'],
+)
+
+# Role of each coalesced LLM call (main_app.llm_singleflight): "leader" made the
+# upstream call, "process_follower"/"worker_follower" shared a leader's result
+# from the same process or another worker, "fallback" had to call upstream
+# itself (leader failed or timed out in-process, or Redis was unavailable).
+# A worker that takes over the lock of a failed leader counts as "leader".
+LLM_SINGLE_FLIGHT = Counter(
+    'llm_single_flight_total',
+    'Deterministic LLM calls by single-flight role.',
+    ['role'],
+)
+
+# Admission decisions of the upstream LLM governor (main_app.llm_governor):
+# "admitted" at once, "queued" then admitted, "rejected_full" or
+# "rejected_timeout" (answered with 503 + Retry-After).
+LLM_GOVERNOR_DECISIONS = Counter(
+    'llm_governor_decisions_total',
+    'Upstream LLM call admissions, by outcome.',
+    ['outcome'],
+)
+
+LLM_QUEUE_WAIT_SECONDS = Histogram(
+    'llm_queue_wait_seconds',
+    'Time admitted upstream LLM calls spent waiting for a slot.',
+    buckets=(0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+
+# Upstream LLM calls (main_app.llm_usage). Outcome is "success", "cancelled",
+# "rate_limited", "timeout", "connection_error", "client_error",
+# "server_error" or "error"; kind is "prompt" or "completion".
+LLM_REQUEST_SECONDS = Histogram(
+    'llm_request_seconds',
+    'Wall time of upstream LLM calls, by model and outcome.',
+    ['model', 'outcome'],
+    buckets=(0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120),
+)
+
+LLM_TIME_TO_FIRST_TOKEN_SECONDS = Histogram(
+    'llm_time_to_first_token_seconds',
+    'Time from the start of a streamed LLM call to its first token, by model.',
+    ['model'],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 30),
+)
+
+LLM_TOKENS = Counter(
+    'llm_tokens_total',
+    'Tokens reported by the LLM provider, by model and kind.',
+    ['model', 'kind'],
+)
+
+# Mail ingestion (main_app.mail_sync), by account and mailbox. Throughput is
+# rate(mail_ingest_messages_total); lag is the time from a message's arrival
+# on the server (INTERNALDATE) to the commit of its batch.
+MAIL_INGEST_MESSAGES = Counter(
+    'mail_ingest_messages_total',
+    'Incoming messages processed, by account and mailbox.',
+    ['account', 'mailbox'],
+)
+
+MAIL_INGEST_LAG_SECONDS = Histogram(
+    'mail_ingest_lag_seconds',
+    'Time from the arrival of a message on the IMAP server to its processing, by account and mailbox.',
+    ['account', 'mailbox'],
+    buckets=(5, 15, 30, 60, 120, 300, 600, 1800, 3600, 4 * 3600, 24 * 3600),
+)
+
+MAIL_INGEST_BACKLOG = Gauge(
+    'mail_ingest_backlog_messages',
+    'New messages found by the current or last sync and not processed yet, by account and mailbox.',
+    ['account', 'mailbox'],
+)
+
+MAIL_SYNC_SECONDS = Histogram(
+    'mail_sync_seconds',
+    'Wall time of mailbox syncs, by account, mailbox and outcome.',
+    ['account', 'mailbox', 'outcome'],
+    buckets=(0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300),
+)
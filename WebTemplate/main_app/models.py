@@ -1,7 +1,14 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models.signals import post_save
+from django.dispatch import receiver
 from django.utils import timezone
 from django.conf import settings
+from kombu.exceptions import OperationalError
+import logging
 import os
+import uuid
+
+logger = logging.getLogger(__name__)
 
 User = settings.AUTH_USER_MODEL
 
@@ -32,6 +39,58 @@ class Documents(models.Model):
         verbose_name_plural = 'Документы'
 
 
+def enqueue_document_indexing(document_id: int) -> None:
+    from .tasks import ingest_document
+    try:
+        ingest_document.delay(document_id)
+    except OperationalError as e:
+        # The upload itself is saved; the document is indexed the next time it is saved
+        logger.warning("Could not schedule indexing of document %s: %s", document_id, e)
+
+
+@receiver(post_save, sender=Documents)
+def schedule_document_indexing(sender, instance, **kwargs):
+    # Index for retrieval (main_app.llm_retrieval) once the upload is committed
+    if instance.document:
+        transaction.on_commit(lambda: enqueue_document_indexing(instance.pk))
+
+
+class DocumentChunk(models.Model):
+    """A passage of a document in the retrieval index (main_app.llm_retrieval)."""
+    document = models.ForeignKey(Documents, on_delete=models.CASCADE, related_name='chunks')
+    position = models.PositiveIntegerField()
+    text = models.TextField()
+    # Number of index terms, for BM25 length normalization
+    length = models.PositiveIntegerField()
+
+    class Meta:
+        ordering = ['document', 'position']
+        constraints = [
+            models.UniqueConstraint(fields=['document', 'position'], name='unique_document_chunk_position'),
+        ]
+
+
+class DocumentTerm(models.Model):
+    """Posting of the inverted index: how often a term occurs in a chunk."""
+    term = models.CharField(max_length=64)
+    chunk = models.ForeignKey(DocumentChunk, on_delete=models.CASCADE, related_name='terms')
+    frequency = models.PositiveIntegerField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['term'], name='document_term_idx'),
+        ]
+
+
+class DocumentIndexState(models.Model):
+    """What was indexed for a document, so unchanged files are not indexed again."""
+    document = models.OneToOneField(Documents, on_delete=models.CASCADE, related_name='index_state')
+    sha256 = models.CharField(max_length=64)
+    chunks = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True)
+    indexed_at = models.DateTimeField(auto_now=True)
+
+
 class FeedbackComments(models.Model):
     email = models.TextField()
     company = models.TextField()
@@ -44,3 +103,77 @@ class FeedbackComments(models.Model):
     class Meta:
         verbose_name = 'Обратная связь'
         verbose_name_plural = 'Обратная связь'
+
+
+class LLMUsage(models.Model):
+    """One upstream LLM call, written in batches by flush_llm_usage for cost analysis."""
+    model = models.CharField(max_length=100)
+    operation = models.CharField(max_length=20)
+    outcome = models.CharField(max_length=30)
+    prompt_tokens = models.PositiveIntegerField(default=0)
+    completion_tokens = models.PositiveIntegerField(default=0)
+    latency_ms = models.PositiveIntegerField()
+    time_to_first_token_ms = models.PositiveIntegerField(null=True, blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        verbose_name = 'Использование LLM'
+        verbose_name_plural = 'Использование LLM'
+        indexes = [
+            models.Index(fields=['model', 'created_at'], name='llm_usage_model_created_idx'),
+        ]
+
+
+class Conversation(models.Model):
+    """A server-side chat session; clients send only the new user turn (see main_app.llm_conversations)."""
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True, related_name='llm_conversations')
+    system_message = models.TextField(blank=True)
+    summarize = models.BooleanField(default=True)
+    summary = models.TextField(blank=True)
+    summary_tokens = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(default=timezone.now)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = 'Диалог LLM'
+        verbose_name_plural = 'Диалоги LLM'
+
+
+class ConversationMessage(models.Model):
+    class Roles(models.TextChoices):
+        USER = 'user', 'Пользователь'
+        ASSISTANT = 'assistant', 'Ассистент'
+
+    conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE, related_name='messages')
+    role = models.CharField(max_length=10, choices=Roles.choices)
+    content = models.TextField()
+    tokens = models.PositiveIntegerField()
+    # Folded into Conversation.summary; no longer sent to the model verbatim
+    summarized = models.BooleanField(default=False)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        ordering = ['id']
+        verbose_name = 'Сообщение диалога LLM'
+        verbose_name_plural = 'Сообщения диалога LLM'
+        indexes = [
+            models.Index(fields=['conversation', 'summarized', 'id'], name='conv_msg_pending_idx'),
+        ]
+
+
+class MailboxSyncState(models.Model):
+    """How far a mailbox has been read by UID (main_app.mail_sync)."""
+    account = models.CharField(max_length=255)
+    mailbox = models.CharField(max_length=255)
+    uidvalidity = models.PositiveBigIntegerField()
+    # Highest UID processed; only greater UIDs are fetched on the next sync
+    last_uid = models.PositiveBigIntegerField(default=0)
+    synced_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = 'Состояние синхронизации почты'
+        verbose_name_plural = 'Состояния синхронизации почты'
+        constraints = [
+            models.UniqueConstraint(fields=['account', 'mailbox'], name='unique_mailbox_sync_state'),
+        ]
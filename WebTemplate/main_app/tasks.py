@@ -6,23 +6,52 @@ of notifications and emails, allowing the main application to remain
 responsive while these operations are performed asynchronously.
 """
 
-from typing import Any
+import imaplib
+import logging
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+from typing import Optional
 
-from celery import shared_task
-from django.db.models import QuerySet
+from celery import group, shared_task
+from django.conf import settings
+from django.db.models import Max, QuerySet
+from django.utils import timezone
+from redis.exceptions import RedisError
 from users.models import NotificationTypes, WebNotifications
-from users.utlis import match_status_n_preferences, notify_email
-from .models import BusinessLogicModel
+from users.unread_counter import invalidate_unread
+from users.utlis import notify_email_batch, notify_email_digest_batch, resolve_email_audience, resolve_email_recipients
+from .coalescing import (EmailEvent, buffer_email_event, get_coalesce_window, group_events_by_user, pop_email_events,
+                         requeue_email_events)
+from .fanout import (ChunkTiming, FanoutReport, chunk_recipients, dedupe_recipients, get_subtask_threshold,
+                     is_known_notification_type, write_notification_chunk)
+from .llm_conversations import compact
+from .llm_governor import LLMOverloaded
+from .llm_helper import LLMResponse, stream_llm_response
+from .llm_jobs import LLMJobParams, is_cancelled
+from .llm_retrieval import index_document
+from .llm_usage import LLMUsageRecord, ack_usage, claim_usage, usage_flush_lock
+from .mail_ingest import mailboxes_to_ingest, sync_account_mailbox
+from .mail_sync import SyncReport
+from .metrics import NOTIFICATION_EVENTS
+from .models import BusinessLogicModel, Documents, LLMUsage
+
+
+logger = logging.getLogger(__name__)
+
+# Delay before a failed digest is sent again if coalescing was turned off meanwhile
+DIGEST_RETRY_SECONDS: int = 60
 
 
 @shared_task
-def celery_notification(item_id: int, notification_type: str, item_related_user_ids: list[int]) -> None:
+def celery_notification(item_id: int, notification_type: str, item_related_user_ids: list[int]) -> Optional[FanoutReport]:
     """
     Create web notifications for a list of users based on notification type.
 
-    This task creates WebNotification records in the database for each user
-    associated with a particular item. The notification type determines the
-    category of notification created.
+    Recipient ids are deduplicated and written in chunks of
+    NOTIFICATION_FANOUT_CHUNK_SIZE rows, one ``bulk_create`` per chunk. When the
+    audience is larger than NOTIFICATION_FANOUT_SUBTASK_THRESHOLD the chunks are
+    dispatched as parallel ``celery_notification_chunk`` subtasks instead of
+    being written inline.
 
     Args:
         item_id: The ID of the item that triggered the notification.
@@ -31,24 +60,49 @@ def celery_notification(item_id: int, notification_type: str, item_related_user_
         item_related_user_ids: A list of user IDs who should receive the notification.
 
     Returns:
-        None
+        Optional[FanoutReport]: Recipient count, per-chunk timings of the chunks
+        written inline and the number of dispatched subtasks. None if the
+        notification type is unknown.
 
     Side Effects:
-        Creates WebNotifications records in the database for each user in
+        Creates one WebNotifications record per unique user in
         item_related_user_ids.
+    """
+    if not is_known_notification_type(notification_type):
+        logger.warning("Unknown notification type %r for item %s", notification_type, item_id)
+        return None
+
+    recipients: list[int] = dedupe_recipients(item_related_user_ids)
+    chunks: list[list[int]] = list(chunk_recipients(recipients))
+    report: FanoutReport = {'recipients': len(recipients), 'chunks': [], 'subtasks': 0}
+
+    if len(recipients) > get_subtask_threshold() and len(chunks) > 1:
+        group(celery_notification_chunk.s(item_id, notification_type, user_ids, index)
+              for index, user_ids in enumerate(chunks)).apply_async()
+        report['subtasks'] = len(chunks)
+        return report
+
+    for index, user_ids in enumerate(chunks):
+        report['chunks'].append(write_notification_chunk(item_id, notification_type, user_ids, chunk=index))
+    logger.debug("Fan-out for item %s: %s", item_id, report)
+    return report
+
+
+@shared_task
+def celery_notification_chunk(item_id: int, notification_type: str, user_ids: list[int], chunk: int = 0) -> ChunkTiming:
+    """
+    Write a single fan-out chunk dispatched by celery_notification.
+
+    Args:
+        item_id: The ID of the item that triggered the notification.
+        notification_type: One of the NotificationTypes values.
+        user_ids: Deduplicated recipient ids of this chunk.
+        chunk: Index of the chunk within the fan-out, used for reporting.
 
-    Note:
-        All notification types currently create notifications with the same
-        structure. The branching logic may be intended for future differentiation
-        of notification handling per type.
+    Returns:
+        ChunkTiming: Rows written by the chunk and the time it took.
     """
-    for user_id in item_related_user_ids:
-        if notification_type == NotificationTypes.type_1:
-            WebNotifications.objects.create(item_id=item_id, user_id=user_id, notification_type=notification_type)
-        elif notification_type == NotificationTypes.type_2:
-            WebNotifications.objects.create(item_id=item_id, user_id=user_id, notification_type=notification_type)
-        elif notification_type == NotificationTypes.type_3:
-            WebNotifications.objects.create(item_id=item_id, user_id=user_id, notification_type=notification_type)
+    return write_notification_chunk(item_id, notification_type, user_ids, chunk=chunk)
 
 
 @shared_task
@@ -56,9 +110,14 @@ def celery_email(pk: int, message_type: str, sender_id: int, status_label: str,
     """
     Send email notifications to users based on their notification preferences.
 
-    This task filters users by their notification preferences matching the given
-    status label, then sends emails to those users who are both in the
-    item_related_user_ids list and have matching notification preferences.
+    With a coalescing window configured the event is buffered and delivered by
+    flush_email_digest at the end of the window, merged with every other event
+    of the same item and type.
+
+    Otherwise a single query resolves the audience: users who are in
+    item_related_user_ids, are subscribed to the given status label, are not
+    the sender and have an email address. The emails are then sent over one
+    pooled SMTP session.
 
     Args:
         pk: The primary key of the item that triggered the email notification.
@@ -72,57 +131,311 @@ def celery_email(pk: int, message_type: str, sender_id: int, status_label: str,
         None
 
     Side Effects:
-        - Sends emails to qualifying users via the notify_email function.
-        - Prints success or failure messages to stdout for each notification attempt.
+        - Sends emails to qualifying users via notify_email_batch, reusing one
+          pooled SMTP session for the whole audience.
+        - Logs every recipient the SMTP server refused.
 
     Raises:
         No exceptions are raised; all exceptions during email sending are caught
-        and logged to stdout.
+        and logged.
     """
     # TODO: Uncomment if item data is needed for email content
     # item = BusinessLogicModel.objects.get(id=pk)
 
-    # Get users who have notification preferences matching the status label
-    notification_preferences: QuerySet[Any] = match_status_n_preferences(status_label)
-    notification_ids: list[int] = list(notification_preferences.values_list('user_id', flat=True))
+    window: int = get_coalesce_window()
+    if window and status_label in NotificationTypes.values:
+        event: EmailEvent = {'message_type': message_type, 'sender_id': sender_id, 'user_ids': list(item_related_user_ids)}
+        try:
+            if buffer_email_event(pk, status_label, event, window):
+                flush_email_digest.apply_async((pk, status_label), countdown=window)
+            return
+        except RedisError as e:
+            logger.warning("Email coalescing unavailable, sending immediately: %s", e)
+
+    # Subscribed, related to the item, not the sender, with an email on file
+    emails: Optional[list[str]] = resolve_email_audience(status_label, item_related_user_ids, sender_id)
+    if emails is None:
+        logger.warning("Unknown status label %r for item %s", status_label, pk)
+        return
+
+    # Deliver the whole audience over one pooled SMTP session
+    try:
+        failures: dict[str, str] = notify_email_batch(pk=pk, message_type=message_type, emails=emails)
+    except Exception as e:
+        logger.error("Notification email batch for item %s failed: %s", pk, e)
+        return
+    NOTIFICATION_EVENTS.labels(channel='email', outcome='delivered').inc(len(emails) - len(failures))
+    for email_to, error in failures.items():
+        logger.warning("Notification failure for %s: %s", email_to, error)
 
-    # Filter to only users who are both related to the item AND have matching preferences
-    notifications: list[int] = list(set(x for x in item_related_user_ids if x in notification_ids))
 
-    for user_id in notifications:
+@shared_task
+def flush_email_digest(pk: int, status_label: str) -> int:
+    """
+    Send the digest emails of one coalescing window.
+
+    Takes every celery_email event buffered for (pk, status_label), resolves
+    the audience of all of them with one query and sends each user a single
+    email listing the events that concern them.
+
+    If the batch cannot be sent at all (e.g. the SMTP server is down) the
+    events are put back in the buffer and another flush is scheduled.
+
+    Args:
+        pk: The primary key of the item.
+        status_label: The notification type of the buffered events.
+
+    Returns:
+        int: Number of events merged away, i.e. events minus emails sent.
+    """
+    events: list[EmailEvent] = pop_email_events(pk, status_label)
+    if not events:
+        return 0
+    related_user_ids: set[int] = {user_id for event in events for user_id in event['user_ids']}
+    recipients: list[tuple[int, str]] = resolve_email_recipients(status_label, related_user_ids, None) or []
+    digests: dict[str, list[str]] = group_events_by_user(events, recipients)
+
+    try:
+        failures: dict[str, str] = notify_email_digest_batch(pk, digests)
+    except Exception as e:
+        # Nothing was sent; keep the events for another flush one window later
+        window: int = get_coalesce_window() or DIGEST_RETRY_SECONDS
+        logger.error("Digest email batch for item %s failed, retrying in %ss: %s", pk, window, e)
         try:
-            notify_email(pk=pk, message_type=message_type, receiver_id=user_id, sender_id=sender_id)
-            print(f"Email was sent to {user_id}!")
-        except Exception as e:
-            # Log the failure but continue processing other users
-            print(f"Notification failure for {user_id}: {e}")
-            pass
+            if requeue_email_events(pk, status_label, events, window):
+                flush_email_digest.apply_async((pk, status_label), countdown=window)
+        except RedisError as redis_error:
+            logger.error("Digest events of item %s dropped: %s", pk, redis_error)
+        return 0
+    for email_to, error in failures.items():
+        logger.warning("Notification failure for %s: %s", email_to, error)
+
+    merged: int = sum(len(message_types) - 1 for message_types in digests.values())
+    NOTIFICATION_EVENTS.labels(channel='email', outcome='delivered').inc(len(digests) - len(failures))
+    NOTIFICATION_EVENTS.labels(channel='email', outcome='merged').inc(merged)
+    logger.info("Digest for item %s (%s): %s events, %s emails, %s merged", pk, status_label, len(events), len(digests), merged)
+    return merged
 
 
 @shared_task
-def some_night_task() -> None:
+def some_night_task(max_age_hours: Optional[float] = None, chunk_size: Optional[int] = None) -> list[ChunkTiming]:
     """
-    Mark all existing notifications as read/seen.
+    Mark old notifications as read/seen in bounded chunks.
 
     This is intended to be run as a scheduled nightly task to reset the
-    'is_new' flag on all notifications, marking them as no longer new.
+    'is_new' flag on notifications created more than ``max_age_hours`` ago.
+    Rows are walked in primary-key order (keyset pagination) and each chunk is
+    flipped with one set-based UPDATE over a closed pk range, so memory use and
+    lock time are bounded by ``chunk_size`` regardless of table size.
+
+    Every chunk commits on its own and only touches rows that are still new,
+    so if the worker dies halfway a rerun simply continues with what is left.
+
+    Args:
+        max_age_hours: Only notifications older than this are reset. Defaults
+            to settings.NOTIFICATION_RESET_MAX_AGE_HOURS.
+        chunk_size: Maximum rows per UPDATE. Defaults to
+            settings.NOTIFICATION_RESET_CHUNK_SIZE.
 
     Returns:
-        None
+        list[ChunkTiming]: Rows touched and elapsed time for every chunk.
 
     Side Effects:
-        Updates all WebNotifications records in the database, setting
-        is_new to False.
-
-    Note:
-        TODO: The current implementation has a bug - calling save() on a
-        QuerySet is not valid. This should be replaced with:
-        WebNotifications.objects.all().update(is_new=False)
-        or the loop should call notification.save() on each instance.
-    """
-    # XXXXXX
-    notifications: QuerySet[WebNotifications] = WebNotifications.objects.all()
-    for notification in notifications:
-        notification.is_new = False
-    # TODO: Fix - QuerySet.save() is not valid; use bulk_update or update()
-    notifications.save()
+        Sets is_new to False on the matching WebNotifications records and drops
+        the unread counters of the affected users.
+    """
+    if max_age_hours is None:
+        max_age_hours = getattr(settings, 'NOTIFICATION_RESET_MAX_AGE_HOURS', 24)
+    size: int = chunk_size or getattr(settings, 'NOTIFICATION_RESET_CHUNK_SIZE', 5000)
+    cutoff = timezone.now() - timedelta(hours=max_age_hours)
+    stale: QuerySet[WebNotifications] = WebNotifications.objects.filter(is_new=True, created_at__lt=cutoff)
+
+    report: list[ChunkTiming] = []
+    last_pk: int = 0
+    while True:
+        # Find the upper bound of the next chunk without loading the rows
+        bounds: list[int] = list(stale.filter(pk__gt=last_pk).order_by('pk').values_list('pk', flat=True)[size - 1:size])
+        upper_pk: Optional[int] = bounds[0] if bounds else stale.filter(pk__gt=last_pk).aggregate(upper=Max('pk'))['upper']
+        if upper_pk is None:
+            break
+
+        chunk: QuerySet[WebNotifications] = stale.filter(pk__gt=last_pk, pk__lte=upper_pk)
+        user_ids: list[int] = list(chunk.values_list('user_id', flat=True).distinct())
+        started: float = time.perf_counter()
+        rows: int = chunk.update(is_new=False)
+        seconds: float = time.perf_counter() - started
+        invalidate_unread(user_ids)
+        timing: ChunkTiming = {
+            'chunk': len(report),
+            'rows': rows,
+            'seconds': seconds,
+            'rows_per_second': rows / seconds if seconds > 0 else float(rows),
+        }
+        report.append(timing)
+        logger.info("Nightly reset chunk %s: %s rows up to pk %s in %.3fs", timing['chunk'], rows, upper_pk, seconds)
+        last_pk = upper_pk
+    return report
+
+
+@shared_task(bind=True, track_started=True, max_retries=5)
+def run_llm_job(self, job_id: str, params: LLMJobParams) -> Optional[LLMResponse]:
+    """
+    Generate the completion of a background LLM job.
+
+    The completion is streamed rather than requested in one call, so the
+    job's cancellation flag can be checked every
+    LLM_JOB_CANCEL_CHECK_SECONDS while the model is still generating. A
+    cancelled job closes the upstream stream and stores no result. A job
+    refused by the upstream governor is retried after its Retry-After delay
+    and stays queued in the meantime.
+
+    Args:
+        job_id: The job id; also the id of this task.
+        params: Prompt and generation settings, see LLMJobParams.
+
+    Returns:
+        Optional[LLMResponse]: The same dictionary get_llm_response returns,
+        stored in the result backend for LLM_JOB_RESULT_TTL seconds. None if
+        the job was cancelled.
+    """
+    if is_cancelled(job_id):
+        return None
+    check_every: float = getattr(settings, 'LLM_JOB_CANCEL_CHECK_SECONDS', 1.0)
+    next_check: float = time.monotonic() + check_every
+    pieces: list[str] = []
+    stream = stream_llm_response(
+        prompt=params['prompt'],
+        system_message=params.get('system_message'),
+        temperature=params.get('temperature', 0.0),
+        max_tokens=params.get('max_tokens'),
+        use_cache=params.get('use_cache', True),
+    )
+    try:
+        for piece in stream:
+            pieces.append(piece)
+            if time.monotonic() >= next_check:
+                if is_cancelled(job_id):
+                    logger.info("LLM job %s cancelled after %s chunks", job_id, len(pieces))
+                    return None
+                next_check = time.monotonic() + check_every
+    except LLMOverloaded as e:
+        if not pieces and self.request.retries < self.max_retries:
+            raise self.retry(countdown=e.retry_after)
+        return {'success': False, 'response': None, 'error': str(e)}
+    except Exception as e:
+        logger.warning("LLM job %s failed: %s", job_id, e)
+        return {'success': False, 'response': None, 'error': str(e)}
+    finally:
+        stream.close()
+    return {'success': True, 'response': "".join(pieces), 'error': None}
+
+
+@shared_task
+def flush_llm_usage() -> int:
+    """
+    Move buffered LLM usage records into the LLMUsage table.
+
+    Runs every minute from Celery beat; a run that finds another still
+    flushing does nothing. Records are claimed from Redis and written with one
+    bulk insert per LLM_USAGE_FLUSH_BATCH rows until the buffer is empty. A
+    batch is released only after its insert committed, so a batch whose insert
+    fails is retried by the next run.
+
+    Returns:
+        int: The number of rows written.
+    """
+    batch_size: int = max(1, getattr(settings, 'LLM_USAGE_FLUSH_BATCH', 500))
+    written: int = 0
+    with usage_flush_lock() as locked:
+        if not locked:
+            return 0
+        while True:
+            records: list[LLMUsageRecord] = claim_usage(batch_size)
+            if not records:
+                break
+            LLMUsage.objects.bulk_create([
+                LLMUsage(
+                    model=record['model'],
+                    operation=record['operation'],
+                    outcome=record['outcome'],
+                    prompt_tokens=record['prompt_tokens'],
+                    completion_tokens=record['completion_tokens'],
+                    latency_ms=record['latency_ms'],
+                    time_to_first_token_ms=record['time_to_first_token_ms'],
+                    created_at=datetime.fromtimestamp(record['created'], tz=dt_timezone.utc),
+                )
+                for record in records
+            ])
+            ack_usage()
+            written += len(records)
+            if len(records) < batch_size:
+                break
+    if written:
+        logger.info("Flushed %s LLM usage records", written)
+    return written
+
+
+@shared_task
+def compact_conversation(conversation_id: str) -> bool:
+    """
+    Fold the older messages of an LLM conversation into its summary.
+
+    Scheduled by send_turn once the history outgrows
+    LLM_CONVERSATION_COMPACT_TOKENS; see llm_conversations.compact.
+
+    Returns:
+        bool: True if messages were folded into the summary.
+    """
+    return compact(conversation_id)
+
+
+@shared_task(autoretry_for=(OSError,), retry_backoff=True, max_retries=3)
+def ingest_document(document_id: int) -> int:
+    """
+    Extract, chunk and index an uploaded document for retrieval.
+
+    Scheduled when a Documents row is saved; see llm_retrieval.index_document.
+    A document deleted before the task runs is skipped; its chunks were
+    already removed with it.
+
+    Returns:
+        int: The number of chunks written.
+    """
+    document: Optional[Documents] = Documents.objects.filter(pk=document_id).first()
+    if document is None:
+        return 0
+    chunks: int = index_document(document)
+    logger.info("Indexed document %s: %s chunks", document_id, chunks)
+    return chunks
+
+
+@shared_task
+def ingest_mailboxes() -> int:
+    """
+    Schedule the sync of every configured mailbox (settings.MAIL_ACCOUNTS).
+
+    One ingest_mailbox task per mailbox, so mailboxes are synced in parallel
+    by the available workers. Run periodically by Celery beat.
+
+    Returns:
+        int: The number of mailbox syncs scheduled.
+    """
+    mailboxes: list[tuple[str, str]] = mailboxes_to_ingest()
+    if mailboxes:
+        group(ingest_mailbox.s(user, mailbox) for user, mailbox in mailboxes).apply_async()
+    return len(mailboxes)
+
+
+@shared_task(autoretry_for=(OSError, imaplib.IMAP4.abort), retry_backoff=True, max_retries=3)
+def ingest_mailbox(user: str, mailbox: str) -> Optional[SyncReport]:
+    """
+    Save the attachments of the new messages of one mailbox as documents.
+
+    See mail_ingest.sync_account_mailbox. A mailbox that is already being
+    synced, or whose account has no free connection slot, is skipped until
+    the next round.
+
+    Returns:
+        Optional[SyncReport]: None if the mailbox was skipped.
+    """
+    return sync_account_mailbox(user, mailbox)
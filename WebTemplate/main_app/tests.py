@@ -1,3 +1,1599 @@
-from django.test import TestCase
+from django.core.files.base import ContentFile
+from django.core.handlers.asgi import ASGIHandler
+from django.core.management import call_command
+from django.core.signals import request_started
+from django.db import close_old_connections
+from django.test import AsyncRequestFactory, RequestFactory, TestCase, override_settings
+from django.contrib.auth.models import AnonymousUser, User
+from django.utils import timezone
+from datetime import timedelta
+from io import BytesIO, StringIO
+from typing import Optional
+from unittest.mock import patch
+from asgiref.sync import async_to_sync
+import asyncio
+import shutil
+import tempfile
+import zipfile
+import json
+import os
+import time
+import threading
+import fakeredis
+import httpx
+from celery.backends.cache import CacheBackend
+from kombu.exceptions import OperationalError
+from langchain_core.language_models import GenericFakeChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, HumanMessage, SystemMessage
+from langchain_core.outputs import ChatGenerationChunk
+from openai import APITimeoutError, RateLimitError
+from prometheus_client import REGISTRY
+from redis.exceptions import RedisError
 
-# Create your tests here.
+from django.urls import path
+from WebTemplate.celery import app as celery_app
+from WebTemplate.redis_client import get_redis, set_redis
+
+from users.models import EmailNotificationSettings, NotificationTypes, WebNotifications
+from .fanout import chunk_recipients, dedupe_recipients
+from . import llm_cache, llm_helper
+from .llm_helper import (aget_llm_response, get_async_llm_client, get_llm_client, get_llm_response, reset_llm_clients,
+                         stream_llm_response)
+from .llm_loadtest import client_sender, percentile, run_load
+from .llm_stub import StubLLMServer
+from .imap_stub import StubIMAPServer
+from .llm_conversations import build_context, create_conversation
+from .llm_retrieval import chunk_text, extract_text, search, tokenize
+from .helpers import fetch_email_data
+from .mail_attachments import download_part, find_attachments, save_attachments
+from .coalescing import merge_recent_notifications
+from .mail_ingest import ACCOUNT_LOCK_PREFIX, MAILBOX_LOCK_PREFIX, IMAPConnectionPool, reset_imap_pools
+from .mail_sync import connect, fetch_structures, select_mailbox, sync_mailbox
+from .models import (BusinessLogicModel, Conversation, DocumentChunk, DocumentIndexState,
+                     Documents, DocumentTerm, LLMUsage, MailboxSyncState)
+from .llm_governor import ACTIVE_KEY, BUCKET_KEY, WAITING_KEY, _release, aupstream_slot, upstream_slot
+from .llm_jobs import cancel_llm_job, get_llm_job, job_key
+from .llm_singleflight import LOCK_PREFIX, _acquire, _lead_across_workers, single_flight
+from .llm_usage import (FLUSH_LOCK_KEY, PENDING_KEY, PROCESSING_KEY, buffer_usage, claim_usage, classify_error,
+                        track_llm_call)
+from .tasks import (celery_email, celery_notification, flush_email_digest, flush_llm_usage, ingest_mailbox,
+                    ingest_mailboxes, run_llm_job, some_night_task)
+from . import views
+from .views import llm_batch_view, llm_response_async_view, llm_response_view, parse_batch_items
+
+# Routes reversed by the views under test (ROOT_URLCONF=__name__)
+urlpatterns = [
+    path('api/llm/', views.llm_response_view, name='llm-response'),
+    path('api/llm/jobs/<str:job_id>/', views.llm_job_status_view, name='llm-job-status'),
+    path('api/llm/conversations/<uuid:conversation_id>/messages/', views.llm_conversation_message_view,
+         name='llm-conversation-messages'),
+]
+
+
+@override_settings(NOTIFICATION_COALESCE_WINDOW_SECONDS=0)
+class NotificationFanoutTests(TestCase):
+    def setUp(self):
+        set_redis(fakeredis.FakeRedis())
+        self.addCleanup(set_redis, None)
+        self.item = BusinessLogicModel.objects.create()
+        self.users = [User.objects.create_user(username=f"fanout_{i}", password="test") for i in range(5)]
+        self.user_ids = [user.id for user in self.users]
+
+    def test_dedupe_recipients_keeps_order(self):
+        self.assertEqual(dedupe_recipients([3, 1, 3, None, "1", 2]), [3, 1, 2])
+
+    def test_chunk_recipients(self):
+        self.assertEqual(list(chunk_recipients([1, 2, 3, 4, 5], 2)), [[1, 2], [3, 4], [5]])
+
+    @override_settings(NOTIFICATION_FANOUT_CHUNK_SIZE=2)
+    def test_celery_notification_writes_unique_rows_in_chunks(self):
+        report = celery_notification(self.item.id, NotificationTypes.type_1, self.user_ids + self.user_ids[:2])
+        self.assertEqual(report['recipients'], 5)
+        self.assertEqual([chunk['rows'] for chunk in report['chunks']], [2, 2, 1])
+        self.assertEqual(report['subtasks'], 0)
+        self.assertEqual(WebNotifications.objects.filter(item=self.item).count(), 5)
+
+    def test_celery_notification_unknown_type(self):
+        self.assertIsNone(celery_notification(self.item.id, "unknown", self.user_ids))
+        self.assertFalse(WebNotifications.objects.exists())
+
+    @override_settings(NOTIFICATION_FANOUT_CHUNK_SIZE=2, NOTIFICATION_FANOUT_SUBTASK_THRESHOLD=3)
+    @patch('main_app.tasks.group')
+    def test_celery_notification_dispatches_subtasks(self, mock_group):
+        report = celery_notification(self.item.id, NotificationTypes.type_2, self.user_ids)
+        self.assertEqual(report['subtasks'], 3)
+        self.assertEqual(report['chunks'], [])
+        mock_group.return_value.apply_async.assert_called_once()
+
+
+@override_settings(NOTIFICATION_COALESCE_WINDOW_SECONDS=0)
+class CeleryEmailTests(TestCase):
+    def setUp(self):
+        self.sender = User.objects.create_user(username='sender', password='test', email='sender@test.ru')
+        self.receiver = User.objects.create_user(username='receiver', password='test', email='receiver@test.ru')
+        for user in (self.sender, self.receiver):
+            EmailNotificationSettings.objects.create(user=user, notification_types=[NotificationTypes.type_1])
+
+    @patch('users.utlis.get_smtp_pool')
+    def test_celery_email_sends_to_resolved_audience(self, mock_pool):
+        mock_pool.return_value.send_batch.return_value = {}
+        celery_email(1, 'Тип 1', self.sender.id, NotificationTypes.type_1, [self.sender.id, self.receiver.id])
+        messages = mock_pool.return_value.send_batch.call_args.args[0]
+        self.assertEqual([message.to for message in messages], ['receiver@test.ru'])
+
+    @patch('users.utlis.get_smtp_pool')
+    def test_celery_email_unknown_status(self, mock_pool):
+        celery_email(1, 'Тип 1', self.sender.id, 'unknown', [self.receiver.id])
+        mock_pool.assert_not_called()
+
+
+class NightlyResetTests(TestCase):
+    def setUp(self):
+        set_redis(fakeredis.FakeRedis())
+        self.addCleanup(set_redis, None)
+        self.item = BusinessLogicModel.objects.create()
+        self.user = User.objects.create_user(username='night', password='test')
+        old = timezone.now() - timedelta(days=2)
+        WebNotifications.objects.bulk_create(
+            [WebNotifications(item=self.item, user=self.user, created_at=old) for _ in range(7)]
+            + [WebNotifications(item=self.item, user=self.user) for _ in range(2)]
+        )
+
+    def test_resets_old_notifications_in_chunks(self):
+        report = some_night_task(max_age_hours=24, chunk_size=3)
+        self.assertEqual([chunk['rows'] for chunk in report], [3, 3, 1])
+        self.assertEqual(WebNotifications.objects.filter(is_new=True).count(), 2)
+
+    def test_rerun_after_partial_run_is_safe(self):
+        first_pk = WebNotifications.objects.order_by('pk').first().pk
+        WebNotifications.objects.filter(pk__lte=first_pk + 3).update(is_new=False)
+        report = some_night_task(max_age_hours=24, chunk_size=3)
+        self.assertEqual(sum(chunk['rows'] for chunk in report), 3)
+        self.assertEqual(some_night_task(max_age_hours=24, chunk_size=3), [])
+
+
+@override_settings(NOTIFICATION_COALESCE_WINDOW_SECONDS=60)
+class CoalescingTests(TestCase):
+    def setUp(self):
+        set_redis(fakeredis.FakeRedis())
+        self.addCleanup(set_redis, None)
+        self.item = BusinessLogicModel.objects.create()
+        self.sender = User.objects.create_user(username='sender', password='test', email='sender@test.ru')
+        self.receiver = User.objects.create_user(username='receiver', password='test', email='receiver@test.ru')
+        for user in (self.sender, self.receiver):
+            EmailNotificationSettings.objects.create(user=user, notification_types=[NotificationTypes.type_1])
+
+    def test_repeated_events_merge_into_one_notification(self):
+        user_ids = [self.sender.id, self.receiver.id]
+        celery_notification(self.item.id, NotificationTypes.type_1, user_ids)
+        report = celery_notification(self.item.id, NotificationTypes.type_1, user_ids)
+        self.assertEqual(report['chunks'][0]['merged'], 2)
+        self.assertEqual(report['chunks'][0]['rows'], 0)
+        notifications = WebNotifications.objects.filter(item=self.item)
+        self.assertEqual(notifications.count(), 2)
+        self.assertEqual(set(notifications.values_list('event_count', flat=True)), {2})
+
+    @patch('users.utlis.get_smtp_pool')
+    @patch('main_app.tasks.flush_email_digest.apply_async')
+    def test_email_burst_sends_one_digest(self, mock_schedule, mock_pool):
+        mock_pool.return_value.send_batch.return_value = {}
+        for message_type in ('first', 'second', 'third'):
+            celery_email(self.item.id, message_type, self.sender.id, NotificationTypes.type_1, [self.sender.id, self.receiver.id])
+        mock_schedule.assert_called_once_with((self.item.id, NotificationTypes.type_1), countdown=60)
+        mock_pool.return_value.send_batch.assert_not_called()
+
+        self.assertEqual(flush_email_digest(self.item.id, NotificationTypes.type_1), 2)
+        messages = mock_pool.return_value.send_batch.call_args.args[0]
+        self.assertEqual([message.to for message in messages], ['receiver@test.ru'])
+        self.assertIn('first', messages[0].body.decode())
+        self.assertIn('third', messages[0].body.decode())
+        self.assertEqual(flush_email_digest(self.item.id, NotificationTypes.type_1), 0)
+
+    @patch('users.utlis.get_smtp_pool')
+    @patch('main_app.tasks.flush_email_digest.apply_async')
+    def test_failed_digest_is_buffered_again(self, mock_schedule, mock_pool):
+        mock_pool.return_value.send_batch.side_effect = OSError("connection refused")
+        for message_type in ('first', 'second'):
+            celery_email(self.item.id, message_type, self.sender.id, NotificationTypes.type_1, [self.receiver.id])
+        self.assertEqual(flush_email_digest(self.item.id, NotificationTypes.type_1), 0)
+        self.assertEqual(mock_schedule.call_count, 2)
+
+        mock_pool.return_value.send_batch.side_effect = None
+        mock_pool.return_value.send_batch.return_value = {}
+        self.assertEqual(flush_email_digest(self.item.id, NotificationTypes.type_1), 1)
+        body = mock_pool.return_value.send_batch.call_args.args[0][0].body.decode()
+        self.assertLess(body.index('first'), body.index('second'))
+
+    def test_merge_locks_the_item_not_the_users(self):
+        with patch('main_app.coalescing.connection') as mock_connection:
+            mock_connection.vendor = 'postgresql'
+            cursor = mock_connection.cursor.return_value.__enter__.return_value
+            with self.assertNumQueries(1):
+                merge_recent_notifications(self.item.id, NotificationTypes.type_1, [self.receiver.id], 60)
+            merge_recent_notifications(self.item.id, NotificationTypes.type_1, [self.sender.id], 60)
+            merge_recent_notifications(self.item.id, NotificationTypes.type_2, [self.receiver.id], 60)
+        keys = [call.args[1][0] for call in cursor.execute.call_args_list]
+        self.assertIn('pg_advisory_xact_lock', cursor.execute.call_args.args[0])
+        self.assertEqual(keys[0], keys[1])
+        self.assertNotEqual(keys[0], keys[2])
+
+
+@patch.dict(os.environ, {'DEEPSEEK_API_KEY': 'stub'})
+@override_settings(LLM_CACHE_ENABLED=False)
+class LLMClientRegistryTests(TestCase):
+    def setUp(self):
+        self.stub = StubLLMServer().start()
+        self.addCleanup(self.stub.stop)
+        reset_llm_clients()
+        self.addCleanup(reset_llm_clients)
+        settings_override = override_settings(LLM_API_BASE=self.stub.base_url)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def test_client_is_reused_per_key(self):
+        self.assertIs(get_llm_client(temperature=0.0), get_llm_client(temperature=0))
+        self.assertIsNot(get_llm_client(temperature=0.0), get_llm_client(temperature=0.7))
+        self.assertIsNot(get_llm_client(max_tokens=100), get_llm_client(max_tokens=200))
+
+    def test_clients_share_keep_alive_connection(self):
+        for temperature in (0.0, 0.5, 0.0, 0.5):
+            response = get_llm_response("ping", temperature=temperature)
+            self.assertTrue(response['success'], response['error'])
+            self.assertEqual(response['response'], "stub reply to: ping")
+        self.assertEqual(self.stub.requests, 4)
+        self.assertEqual(self.stub.connections, 1)
+
+    def test_concurrent_first_use_builds_one_client(self):
+        clients = []
+        threads = [threading.Thread(target=lambda: clients.append(get_llm_client())) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len({id(client) for client in clients}), 1)
+
+    def test_registry_is_rebuilt_after_fork(self):
+        client = get_llm_client()
+        with patch('main_app.llm_helper.os.getpid', return_value=os.getpid() + 1):
+            self.assertIsNot(get_llm_client(), client)
+
+
+@patch.dict(os.environ, {'DEEPSEEK_API_KEY': 'stub'})
+class LLMResponseCacheTests(TestCase):
+    def setUp(self):
+        self.redis = fakeredis.FakeRedis()
+        set_redis(self.redis)
+        self.addCleanup(set_redis, None)
+        llm_cache.local_cache.clear()
+        self.addCleanup(llm_cache.local_cache.clear)
+        self.stub = StubLLMServer().start()
+        self.addCleanup(self.stub.stop)
+        reset_llm_clients()
+        self.addCleanup(reset_llm_clients)
+        settings_override = override_settings(LLM_API_BASE=self.stub.base_url)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def test_cache_key_covers_every_input(self):
+        key = llm_cache.cache_key("m", "sys", "prompt", 0.0, 100)
+        self.assertEqual(key, llm_cache.cache_key("m", "sys", "prompt", 0, 100))
+        self.assertNotEqual(key, llm_cache.cache_key("m", None, "prompt", 0.0, 100))
+        self.assertNotEqual(key, llm_cache.cache_key("m", "sys", "prompt", 0.0, 200))
+        self.assertNotIn("prompt", key)
+
+    def test_deterministic_call_is_served_from_local_tier(self):
+        first = get_llm_response("hello", system_message="be brief")
+        second = get_llm_response("hello", system_message="be brief")
+        self.assertEqual(first, second)
+        self.assertEqual(self.stub.requests, 1)
+
+    def test_redis_tier_is_shared_between_processes(self):
+        get_llm_response("hello")
+        llm_cache.local_cache.clear()
+        self.assertEqual(get_llm_response("hello")['response'], "stub reply to: hello")
+        self.assertEqual(self.stub.requests, 1)
+        self.assertEqual(len(llm_cache.local_cache), 1)
+
+    def test_non_deterministic_and_bypassed_calls_are_not_cached(self):
+        get_llm_response("hello", temperature=0.7)
+        get_llm_response("hello", temperature=0.7)
+        get_llm_response("hello", use_cache=False)
+        get_llm_response("hello", use_cache=False)
+        self.assertEqual(self.stub.requests, 4)
+        self.assertEqual(self.redis.keys(f"{llm_cache.KEY_PREFIX}*"), [])
+
+    def test_empty_stream_is_not_cached(self):
+        class EmptyStreamModel(FakeStreamingChatModel):
+            def _stream(self, *args, **kwargs):
+                # e.g. a completion stopped by the content filter
+                yield ChatGenerationChunk(message=AIMessageChunk(content=""))
+
+        with patch('main_app.llm_helper.get_llm_client', return_value=EmptyStreamModel(messages=iter([]))):
+            self.assertEqual(list(stream_llm_response("hello")), [])
+        self.assertEqual(len(llm_cache.local_cache), 0)
+        self.assertEqual(self.redis.keys(f"{llm_cache.KEY_PREFIX}*"), [])
+
+    def test_errors_are_not_cached(self):
+        self.stub.stop()
+        self.assertFalse(get_llm_response("hello")['success'])
+        self.assertEqual(len(llm_cache.local_cache), 0)
+
+    def test_view_bypass_flag(self):
+        factory = RequestFactory()
+        for _ in range(2):
+            request = factory.post('/api/llm/', json.dumps({'prompt': 'hello', 'cache': False}), content_type='application/json')
+            self.assertEqual(async_to_sync(llm_response_view)(request).status_code, 200)
+        self.assertEqual(self.stub.requests, 2)
+
+
+class FakeStreamingChatModel(GenericFakeChatModel):
+    """GenericFakeChatModel streams word by word; this one also records when the stream is closed."""
+
+    model_name: str = "fake"
+    max_tokens: int = 100
+    fail_after: Optional[int] = None
+    closed: bool = False
+
+    def _stream(self, *args, **kwargs):
+        try:
+            for index, chunk in enumerate(super()._stream(*args, **kwargs)):
+                if self.fail_after is not None and index >= self.fail_after:
+                    raise RuntimeError("upstream dropped")
+                yield chunk
+        finally:
+            self.closed = True
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        # Unlike the default executor-based version, closes the stream when the consumer stops
+        chunks = self._stream(messages, stop=stop, **kwargs)
+        try:
+            for chunk in chunks:
+                yield chunk
+                await asyncio.sleep(0)
+        finally:
+            chunks.close()
+
+
+@override_settings(ROOT_URLCONF=__name__, LLM_CACHE_ENABLED=False)
+class LLMStreamingTests(TestCase):
+    def setUp(self):
+        self.factory = AsyncRequestFactory()
+
+    async def _post(self, model, body, **kwargs):
+        request = self.factory.post('/api/llm/', json.dumps(body), content_type='application/json', **kwargs)
+        with patch('main_app.llm_helper.get_async_llm_client', return_value=model):
+            response = await llm_response_view(request)
+            events = [] if not response.streaming else [
+                chunk.decode() async for chunk in response.streaming_content
+            ]
+        return response, events
+
+    async def test_tokens_are_streamed_as_events(self):
+        model = FakeStreamingChatModel(messages=iter([AIMessage(content="Hello big world")]))
+        response, events = await self._post(model, {'prompt': 'hi', 'stream': True})
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        self.assertTrue(response.is_async)
+        tokens = [json.loads(event[len('data: '):])['token'] for event in events[:-1]]
+        self.assertGreater(len(tokens), 1)
+        self.assertEqual("".join(tokens), "Hello big world")
+        self.assertEqual(events[-1], 'event: done\ndata: {"success": true}\n\n')
+
+    async def test_accept_header_selects_streaming(self):
+        model = FakeStreamingChatModel(messages=iter([AIMessage(content="ok")]))
+        response, _ = await self._post(model, {'prompt': 'hi'}, headers={'Accept': 'text/event-stream'})
+        self.assertTrue(response.streaming)
+
+    async def test_upstream_error_keeps_json_error_contract(self):
+        model = FakeStreamingChatModel(messages=iter([AIMessage(content="one two three")]), fail_after=1)
+        _, events = await self._post(model, {'prompt': 'hi', 'stream': True})
+        self.assertTrue(events[-1].startswith('event: error\n'))
+        payload = json.loads(events[-1].split('data: ', 1)[1])
+        self.assertEqual(payload, {'success': False, 'error': 'An error occurred: upstream dropped'})
+
+    async def test_missing_prompt_is_plain_json(self):
+        response, _ = await self._post(FakeStreamingChatModel(messages=iter([])), {'stream': True})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(json.loads(response.content), {'error': 'prompt field is required'})
+
+    async def test_client_disconnect_closes_upstream_stream(self):
+        model = FakeStreamingChatModel(messages=iter([AIMessage(content="a b c d e f")]))
+        request = self.factory.post('/api/llm/', json.dumps({'prompt': 'hi', 'stream': True}),
+                                    content_type='application/json')
+        with patch('main_app.llm_helper.get_async_llm_client', return_value=model):
+            response = await llm_response_view(request)
+            content = aiter(response.streaming_content)
+
+            async def consume():
+                async for _ in content:
+                    # The ASGI handler cancels the response when the client goes away
+                    asyncio.current_task().cancel()
+
+            with self.assertRaises(asyncio.CancelledError):
+                await asyncio.create_task(consume())
+        self.assertTrue(model.closed)
+
+    async def test_events_reach_the_asgi_client_as_they_are_generated(self):
+        first_token_sent = asyncio.Event()
+
+        class GatedModel(FakeStreamingChatModel):
+            async def _astream(self, *args, **kwargs):
+                chunks = super()._astream(*args, **kwargs)
+                yield await anext(chunks)
+                # The rest is only generated once the client has the first token
+                await asyncio.wait_for(first_token_sent.wait(), timeout=2)
+                async for chunk in chunks:
+                    yield chunk
+
+        body = json.dumps({'prompt': 'hi', 'stream': True}).encode()
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'POST', 'scheme': 'http',
+            'path': '/api/llm/', 'raw_path': b'/api/llm/', 'query_string': b'', 'root_path': '',
+            'headers': [(b'host', b'testserver'), (b'content-type', b'application/json')],
+            'client': ('127.0.0.1', 50000), 'server': ('testserver', 80),
+        }
+        requests = [{'type': 'http.request', 'body': body, 'more_body': False}]
+        sent = []
+
+        async def receive():
+            if requests:
+                return requests.pop(0)
+            await asyncio.Event().wait()
+
+        async def send(message):
+            if message['type'] == 'http.response.body' and message.get('body'):
+                sent.append(message['body'].decode())
+                first_token_sent.set()
+
+        # As django.test.Client does, keep the handler from closing the test transaction's connection
+        request_started.disconnect(close_old_connections)
+        self.addCleanup(request_started.connect, close_old_connections)
+        model = GatedModel(messages=iter([AIMessage(content="one two three")]))
+        with patch('main_app.llm_helper.get_async_llm_client', return_value=model):
+            await ASGIHandler()(scope, receive, send)
+        self.assertTrue(sent[0].startswith('data: {"token": "one"}'))
+        self.assertEqual(sent[-1], 'event: done\ndata: {"success": true}\n\n')
+        self.assertEqual("".join(json.loads(event[len('data: '):])['token'] for event in sent[:-1]), "one two three")
+
+
+@patch.dict(os.environ, {'DEEPSEEK_API_KEY': 'stub'})
+@override_settings(LLM_CACHE_ENABLED=False)
+class AsyncLLMViewTests(TestCase):
+    def setUp(self):
+        self.stub = StubLLMServer(latency=0.3).start()
+        self.addCleanup(self.stub.stop)
+        reset_llm_clients()
+        self.addCleanup(reset_llm_clients)
+        settings_override = override_settings(LLM_API_BASE=self.stub.base_url)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.factory = AsyncRequestFactory()
+
+    def _request(self, body):
+        return self.factory.post('/api/llm/async/', json.dumps(body), content_type='application/json')
+
+    async def test_concurrent_requests_share_one_event_loop(self):
+        started = time.perf_counter()
+        responses = await asyncio.gather(*(llm_response_async_view(self._request({'prompt': f'p{i}'})) for i in range(10)))
+        elapsed = time.perf_counter() - started
+        self.assertEqual({response.status_code for response in responses}, {200})
+        self.assertEqual(json.loads(responses[3].content)['response']['response'], "stub reply to: p3")
+        # Ten 0.3s calls one after another would take 3s
+        self.assertLess(elapsed, 1.5)
+
+    async def test_missing_prompt(self):
+        response = await llm_response_async_view(self._request({}))
+        self.assertEqual(response.status_code, 400)
+
+    def test_async_client_follows_the_event_loop(self):
+        async def get_client():
+            return get_async_llm_client()
+        first = asyncio.run(get_client())
+        self.assertIsNot(asyncio.run(get_client()), first)
+        # Each loop closed its connection pool when it shut down
+        self.assertTrue(first.http_async_client.is_closed)
+        self.assertEqual(len(llm_helper._async_registries), 0)
+
+
+@patch.dict(os.environ, {'DEEPSEEK_API_KEY': 'stub'})
+@override_settings(LLM_CACHE_ENABLED=False, LLM_BATCH_MAX_CONCURRENCY=4)
+class LLMBatchTests(TestCase):
+    def setUp(self):
+        self.factory = AsyncRequestFactory()
+
+    def _request(self, body):
+        return self.factory.post('/api/llm/batch/', json.dumps(body), content_type='application/json')
+
+    def test_parse_batch_items_applies_shared_system_message(self):
+        items = parse_batch_items({'prompts': ['a', {'prompt': 'b', 'system_message': 'own'}], 'system_message': 'shared'})
+        self.assertEqual(items, [{'prompt': 'a', 'system_message': 'shared'}, {'prompt': 'b', 'system_message': 'own'}])
+        for data in ({}, {'prompts': []}, {'prompts': [{'system_message': 'x'}]}):
+            with self.assertRaises(ValueError):
+                parse_batch_items(data)
+
+    async def test_batch_runs_concurrently_in_order(self):
+        reset_llm_clients()
+        self.addCleanup(reset_llm_clients)
+        with StubLLMServer(latency=0.3) as stub, override_settings(LLM_API_BASE=stub.base_url):
+            started = time.perf_counter()
+            response = await llm_batch_view(self._request({'prompts': [f'p{i}' for i in range(4)]}))
+            elapsed = time.perf_counter() - started
+        results = json.loads(response.content)['results']
+        self.assertEqual([result['response'] for result in results], [f"stub reply to: p{i}" for i in range(4)])
+        self.assertLess(elapsed, 1.0)
+
+    async def test_concurrency_cap_and_item_timeout(self):
+        in_flight, peak = 0, 0
+
+        async def fake_response(prompt, *args):
+            nonlocal in_flight, peak
+            in_flight += 1
+            peak = max(peak, in_flight)
+            try:
+                await asyncio.sleep(1.0 if prompt == 'slow' else 0.05)
+            finally:
+                in_flight -= 1
+            return {'success': True, 'response': prompt, 'error': None}
+
+        with patch('main_app.llm_helper.aget_llm_response', fake_response):
+            response = await llm_batch_view(self._request({
+                'prompts': ['a', 'slow', 'b', 'c', 'd'], 'concurrency': 2, 'timeout': 0.2,
+            }))
+        results = json.loads(response.content)['results']
+        self.assertEqual(peak, 2)
+        self.assertEqual([result['success'] for result in results], [True, False, True, True, True])
+        self.assertEqual(results[1]['error'], 'Timed out after 0.2s')
+
+    async def test_invalid_batch(self):
+        response = await llm_batch_view(self._request({'prompts': 'not a list'}))
+        self.assertEqual(response.status_code, 400)
+        with override_settings(LLM_BATCH_MAX_ITEMS=2):
+            response = await llm_batch_view(self._request({'prompts': ['a', 'b', 'c']}))
+        self.assertEqual(json.loads(response.content), {'error': 'at most 2 prompts per batch'})
+
+    @override_settings(LLM_TIMEOUT=30)
+    async def test_invalid_timeout(self):
+        for timeout in (-1, 0, 31, 'soon'):
+            response = await llm_batch_view(self._request({'prompts': ['a'], 'timeout': timeout}))
+            self.assertEqual(response.status_code, 400, timeout)
+
+
+@override_settings(ROOT_URLCONF=__name__, CELERY_TASK_ALWAYS_EAGER=True, LLM_CACHE_ENABLED=False,
+                   LLM_JOB_CANCEL_CHECK_SECONDS=0)
+class LLMJobTests(TestCase):
+    def setUp(self):
+        self.redis = fakeredis.FakeRedis()
+        set_redis(self.redis)
+        self.addCleanup(set_redis, None)
+        # Keep the results of the eager jobs in an in-memory result backend
+        self.addCleanup(setattr, celery_app, '_backend', celery_app.backend)
+        celery_app._backend = CacheBackend(app=celery_app, backend='memory')
+        store_eager_result = patch.object(type(run_llm_job._get_current_object()), 'store_eager_result', True)
+        store_eager_result.start()
+        self.addCleanup(store_eager_result.stop)
+        self.factory = RequestFactory()
+
+    def _create(self, body):
+        request = self.factory.post('/api/llm/jobs/', json.dumps(body), content_type='application/json')
+        return views.llm_job_create_view(request)
+
+    def test_job_runs_and_result_is_polled(self):
+        model = FakeStreamingChatModel(messages=iter([AIMessage(content="long answer")]))
+        with patch('main_app.llm_helper.get_llm_client', return_value=model):
+            response = self._create({'prompt': 'hi'})
+        self.assertEqual(response.status_code, 202)
+        created = json.loads(response.content)
+        self.assertEqual(created['status_url'], f"/api/llm/jobs/{created['job_id']}/")
+
+        status = views.llm_job_status_view(self.factory.get(created['status_url']), created['job_id'])
+        self.assertEqual(json.loads(status.content), {
+            'job_id': created['job_id'], 'status': 'done',
+            'result': {'success': True, 'response': 'long answer', 'error': None},
+        })
+        self.assertEqual(views.llm_job_cancel_view(self.factory.post('/'), created['job_id']).status_code, 409)
+
+    def test_failed_generation_is_reported(self):
+        model = FakeStreamingChatModel(messages=iter([AIMessage(content="a b c")]), fail_after=1)
+        with patch('main_app.llm_helper.get_llm_client', return_value=model):
+            job_id = json.loads(self._create({'prompt': 'hi'}).content)['job_id']
+        job = get_llm_job(job_id)
+        self.assertEqual(job['status'], 'failed')
+        self.assertEqual(job['result']['error'], 'upstream dropped')
+
+    @patch('main_app.llm_jobs.AsyncResult.revoke')
+    @patch('main_app.tasks.run_llm_job.apply_async')
+    def test_queued_job_is_cancelled_before_it_starts(self, mock_apply, mock_revoke):
+        job_id = json.loads(self._create({'prompt': 'hi'}).content)['job_id']
+        self.assertEqual(get_llm_job(job_id)['status'], 'queued')
+        self.assertEqual(cancel_llm_job(job_id)['status'], 'cancelled')
+        mock_revoke.assert_called_once()
+        with patch('main_app.llm_helper.get_llm_client') as mock_client:
+            self.assertIsNone(run_llm_job(job_id, {'prompt': 'hi'}))
+        mock_client.assert_not_called()
+
+    def test_running_job_stops_streaming_on_cancel(self):
+        job_id = 'running-job'
+        self.redis.hset(job_key(job_id), mapping={'cancelled': 0})
+        model = FakeStreamingChatModel(messages=iter([AIMessage(content="a b c d e f")]))
+        checks = iter([False, True])
+        with patch('main_app.llm_helper.get_llm_client', return_value=model), \
+                patch('main_app.tasks.is_cancelled', side_effect=lambda _: next(checks, True)):
+            self.assertIsNone(run_llm_job(job_id, {'prompt': 'hi'}))
+        self.assertTrue(model.closed)
+
+    def test_unknown_or_expired_job(self):
+        self.assertEqual(views.llm_job_status_view(self.factory.get('/'), 'missing').status_code, 404)
+        self.assertEqual(views.llm_job_cancel_view(self.factory.post('/'), 'missing').status_code, 404)
+
+
+@patch.dict(os.environ, {'DEEPSEEK_API_KEY': 'stub'})
+@override_settings(LLM_SINGLE_FLIGHT_POLL_INTERVAL=0.02)
+class LLMSingleFlightTests(TestCase):
+    def setUp(self):
+        self.redis = fakeredis.FakeRedis()
+        set_redis(self.redis)
+        self.addCleanup(set_redis, None)
+        llm_cache.local_cache.clear()
+        self.addCleanup(llm_cache.local_cache.clear)
+        self.stub = StubLLMServer(latency=0.3).start()
+        self.addCleanup(self.stub.stop)
+        reset_llm_clients()
+        self.addCleanup(reset_llm_clients)
+        settings_override = override_settings(LLM_API_BASE=self.stub.base_url)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def _key(self, prompt):
+        llm = get_llm_client()
+        return llm_cache.cache_key(llm.model_name, None, prompt, 0.0, llm.max_tokens)
+
+    def test_concurrent_threads_share_one_upstream_call(self):
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(get_llm_response("same"))) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.stub.requests, 1)
+        self.assertEqual([result['response'] for result in results], ["stub reply to: same"] * 8)
+
+    async def test_concurrent_coroutines_share_one_upstream_call(self):
+        results = await asyncio.gather(*(aget_llm_response("same") for _ in range(8)))
+        self.assertEqual(self.stub.requests, 1)
+        self.assertEqual({result['response'] for result in results}, {"stub reply to: same"})
+
+    def test_waits_for_leader_in_another_worker(self):
+        key = self._key("shared")
+        self.redis.set(LOCK_PREFIX + key, "other-worker")
+
+        def other_worker_finishes():
+            time.sleep(0.2)
+            self.redis.set(key, "answer from other worker")
+            self.redis.delete(LOCK_PREFIX + key)
+
+        threading.Thread(target=other_worker_finishes).start()
+        self.assertEqual(get_llm_response("shared")['response'], "answer from other worker")
+        self.assertEqual(self.stub.requests, 0)
+
+    def test_calls_upstream_when_other_worker_gives_up(self):
+        key = self._key("abandoned")
+        self.redis.set(LOCK_PREFIX + key, "other-worker", px=200)
+        self.assertEqual(get_llm_response("abandoned")['response'], "stub reply to: abandoned")
+        self.assertEqual(self.stub.requests, 1)
+        self.assertIsNone(self.redis.get(LOCK_PREFIX + key))
+
+    def test_one_worker_takes_over_from_a_failed_leader(self):
+        key = self._key("failed leader")
+        self.redis.set(LOCK_PREFIX + key, "other-worker")
+        calls, results = [], []
+
+        def call():
+            calls.append(1)
+            time.sleep(0.2)
+            self.redis.set(key, "answer from new leader")
+            return {'success': True, 'response': "answer from new leader", 'error': None}
+
+        # Each thread stands for a worker process waiting on the failed leader
+        workers = [threading.Thread(target=lambda: results.append(_lead_across_workers(key, call)))
+                   for _ in range(4)]
+        for worker in workers:
+            worker.start()
+        time.sleep(0.1)
+        self.redis.delete(LOCK_PREFIX + key)
+        for worker in workers:
+            worker.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual([result['response'] for result in results], ["answer from new leader"] * 4)
+
+    @override_settings(LLM_TIMEOUT=300)
+    def test_lock_outlives_the_upstream_timeout(self):
+        key = self._key("slow")
+        self.assertIsNotNone(_acquire(key))
+        self.assertGreater(self.redis.pttl(LOCK_PREFIX + key), 300 * 1000)
+
+    def test_leader_error_is_shared_with_waiting_threads(self):
+        calls, errors = [], []
+
+        def failing_call():
+            calls.append(1)
+            time.sleep(0.2)
+            raise RuntimeError("upstream down")
+
+        def run():
+            try:
+                single_flight("error-key", failing_call)
+            except RuntimeError as e:
+                errors.append(str(e))
+
+        threads = [threading.Thread(target=run) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(errors, ["upstream down"] * 4)
+
+
+@patch.dict(os.environ, {'DEEPSEEK_API_KEY': 'stub'})
+@override_settings(LLM_CACHE_ENABLED=False, LLM_MAX_CONCURRENCY=2, LLM_RATE_LIMIT_PER_SECOND=0,
+                   LLM_QUEUE_MAX_WAITING=50, LLM_QUEUE_TIMEOUT=10)
+class LLMGovernorTests(TestCase):
+    def setUp(self):
+        self.redis = fakeredis.FakeRedis()
+        self.redis.flushall()
+        set_redis(self.redis)
+        self.addCleanup(set_redis, None)
+        self.stub = StubLLMServer(latency=0.2).start()
+        self.addCleanup(self.stub.stop)
+        reset_llm_clients()
+        self.addCleanup(reset_llm_clients)
+        settings_override = override_settings(LLM_API_BASE=self.stub.base_url)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.factory = RequestFactory()
+
+    def _hold_slots(self, count):
+        for i in range(count):
+            self.redis.zadd(ACTIVE_KEY, {f"other-worker-{i}": time.time() + 60})
+
+    def _post(self, prompt):
+        body = json.dumps({'prompt': prompt, 'cache': False})
+        return async_to_sync(llm_response_view)(self.factory.post('/api/llm/', body, content_type='application/json'))
+
+    def test_concurrency_is_capped_across_callers(self):
+        results = []
+        threads = [threading.Thread(target=lambda i=i: results.append(get_llm_response(f"p{i}")))
+                   for i in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertTrue(all(result['success'] for result in results), results)
+        self.assertEqual(self.stub.requests, 6)
+        self.assertEqual(self.stub.peak_in_flight, 2)
+        self.assertEqual(self.redis.zcard(ACTIVE_KEY), 0)
+        self.assertEqual(self.redis.zcard(WAITING_KEY), 0)
+
+    async def test_async_callers_share_the_same_cap(self):
+        results = await asyncio.gather(*(aget_llm_response(f"p{i}") for i in range(6)))
+        self.assertTrue(all(result['success'] for result in results), results)
+        self.assertEqual(self.stub.peak_in_flight, 2)
+
+    @override_settings(LLM_QUEUE_MAX_WAITING=1)
+    def test_full_queue_returns_503_with_retry_after(self):
+        self._hold_slots(2)
+        self.redis.zadd(WAITING_KEY, {"other-waiter": time.time()})
+        response = self._post("hi")
+        self.assertEqual(response.status_code, 503)
+        self.assertGreaterEqual(int(response['Retry-After']), 1)
+        self.assertEqual(self.stub.requests, 0)
+
+    @override_settings(LLM_QUEUE_TIMEOUT=0.2)
+    def test_queue_timeout_returns_503_and_leaves_queue(self):
+        self._hold_slots(2)
+        started = time.monotonic()
+        response = self._post("hi")
+        self.assertEqual(response.status_code, 503)
+        self.assertIn('Retry-After', response)
+        self.assertGreaterEqual(time.monotonic() - started, 0.2)
+        self.assertEqual(self.redis.zcard(WAITING_KEY), 0)
+        self.assertEqual(self.stub.requests, 0)
+
+    def test_waiting_caller_is_admitted_when_a_slot_frees(self):
+        self._hold_slots(2)
+        threading.Timer(0.2, self.redis.zrem, (ACTIVE_KEY, "other-worker-0")).start()
+        response = get_llm_response("hi")
+        self.assertTrue(response['success'], response['error'])
+
+    async def test_cancelled_waiter_leaves_queue_off_the_event_loop(self):
+        self._hold_slots(2)
+        release_threads = []
+
+        def release(token):
+            release_threads.append(threading.get_ident())
+            _release(token)
+
+        async def wait_for_slot():
+            async with aupstream_slot():
+                pass
+
+        with patch('main_app.llm_governor._release', side_effect=release):
+            waiter = asyncio.create_task(wait_for_slot())
+            await asyncio.sleep(0.1)
+            self.assertEqual(self.redis.zcard(WAITING_KEY), 1)
+            waiter.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await waiter
+        self.assertEqual(len(release_threads), 1)
+        self.assertNotEqual(release_threads[0], threading.get_ident())
+        self.assertEqual(self.redis.zcard(WAITING_KEY), 0)
+
+    @override_settings(LLM_MAX_CONCURRENCY=10, LLM_RATE_LIMIT_PER_SECOND=10, LLM_RATE_LIMIT_BURST=1)
+    def test_token_bucket_limits_rate(self):
+        started = time.monotonic()
+        for _ in range(3):
+            with upstream_slot():
+                pass
+        # The burst covers the first call; the next two wait 0.1s each for a token
+        self.assertGreaterEqual(time.monotonic() - started, 0.18)
+
+    @override_settings(LLM_RATE_LIMIT_PER_SECOND=1, LLM_RATE_LIMIT_BURST=5)
+    def test_provider_rate_limit_drains_bucket(self):
+        request = httpx.Request('POST', self.stub.base_url)
+        with self.assertRaises(RateLimitError):
+            with upstream_slot():
+                raise RateLimitError("slow down", response=httpx.Response(429, request=request), body=None)
+        self.assertEqual(float(self.redis.hget(BUCKET_KEY, 'tokens')), 0.0)
+        self.assertEqual(self.redis.zcard(ACTIVE_KEY), 0)
+
+    def test_fails_open_when_redis_is_down(self):
+        with patch('main_app.llm_governor._try_acquire', side_effect=RedisError("down")):
+            response = get_llm_response("hi")
+        self.assertTrue(response['success'], response['error'])
+        self.assertEqual(self.stub.requests, 1)
+
+    @override_settings(LLM_QUEUE_MAX_WAITING=0)
+    def test_job_is_retried_when_overloaded(self):
+        self._hold_slots(2)
+        with patch.object(run_llm_job, 'retry', side_effect=RuntimeError("retry")) as retry, \
+                patch('main_app.tasks.is_cancelled', return_value=False):
+            with self.assertRaises(RuntimeError):
+                run_llm_job('job', {'prompt': 'hi'})
+        self.assertGreaterEqual(retry.call_args.kwargs['countdown'], 1)
+
+
+@patch.dict(os.environ, {'DEEPSEEK_API_KEY': 'stub'})
+@override_settings(LLM_CACHE_ENABLED=False, LLM_GOVERNOR_ENABLED=False)
+class LLMUsageTests(TestCase):
+    def setUp(self):
+        self.redis = fakeredis.FakeRedis()
+        self.redis.flushall()
+        set_redis(self.redis)
+        self.addCleanup(set_redis, None)
+        self.stub = StubLLMServer().start()
+        self.addCleanup(self.stub.stop)
+        reset_llm_clients()
+        self.addCleanup(reset_llm_clients)
+        settings_override = override_settings(LLM_API_BASE=self.stub.base_url)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def _pending(self):
+        return [json.loads(raw) for raw in self.redis.lrange(PENDING_KEY, 0, -1)]
+
+    def _sample(self, name, **labels):
+        return REGISTRY.get_sample_value(name, labels) or 0
+
+    def test_call_records_latency_and_tokens(self):
+        model = get_llm_client().model_name
+        requests_before = self._sample('llm_request_seconds_count', model=model, outcome='success')
+        tokens_before = self._sample('llm_tokens_total', model=model, kind='completion')
+
+        self.assertTrue(get_llm_response("ping")['success'])
+        [record] = self._pending()
+        self.assertEqual(record['operation'], 'invoke')
+        self.assertEqual(record['outcome'], 'success')
+        self.assertEqual((record['prompt_tokens'], record['completion_tokens']), (1, 4))
+        self.assertIsNone(record['time_to_first_token_ms'])
+        self.assertEqual(self._sample('llm_request_seconds_count', model=model, outcome='success'), requests_before + 1)
+        self.assertEqual(self._sample('llm_tokens_total', model=model, kind='completion'), tokens_before + 4)
+
+    async def test_async_call_is_recorded(self):
+        self.assertTrue((await aget_llm_response("ping"))['success'])
+        self.assertEqual([record['operation'] for record in self._pending()], ['ainvoke'])
+
+    def test_stream_records_time_to_first_token(self):
+        model = FakeStreamingChatModel(messages=iter([AIMessage(content="a b c")]))
+        ttft_before = self._sample('llm_time_to_first_token_seconds_count', model='fake')
+        with patch('main_app.llm_helper.get_llm_client', return_value=model):
+            self.assertEqual("".join(stream_llm_response("hi")), "a b c")
+        [record] = self._pending()
+        self.assertEqual((record['operation'], record['outcome']), ('stream', 'success'))
+        self.assertIsNotNone(record['time_to_first_token_ms'])
+        self.assertEqual(self._sample('llm_time_to_first_token_seconds_count', model='fake'), ttft_before + 1)
+
+    def test_closed_stream_is_recorded_as_cancelled(self):
+        model = FakeStreamingChatModel(messages=iter([AIMessage(content="a b c")]))
+        with patch('main_app.llm_helper.get_llm_client', return_value=model):
+            stream = stream_llm_response("hi")
+            next(stream)
+            stream.close()
+        self.assertEqual([record['outcome'] for record in self._pending()], ['cancelled'])
+
+    def test_errors_are_classified(self):
+        request = httpx.Request('POST', self.stub.base_url)
+        self.assertEqual(classify_error(APITimeoutError(request=request)), 'timeout')
+        self.assertEqual(classify_error(RateLimitError("slow", response=httpx.Response(429, request=request), body=None)),
+                         'rate_limited')
+        with self.assertRaises(ValueError):
+            with track_llm_call('m', 'invoke'):
+                raise ValueError("bad")
+        self.assertEqual(self._pending()[-1]['outcome'], 'error')
+
+    @override_settings(LLM_USAGE_FLUSH_BATCH=2)
+    def test_flush_writes_buffered_records_in_batches(self):
+        for index in range(5):
+            with track_llm_call('m', 'invoke') as call:
+                call.add_usage({'input_tokens': index, 'output_tokens': 1})
+        with self.assertNumQueries(3):
+            self.assertEqual(flush_llm_usage(), 5)
+        self.assertEqual(self.redis.llen(PENDING_KEY), 0)
+        self.assertEqual(sorted(LLMUsage.objects.values_list('prompt_tokens', flat=True)), [0, 1, 2, 3, 4])
+
+    def _buffer(self, prompt_tokens):
+        buffer_usage({'model': 'm', 'operation': 'invoke', 'outcome': 'success', 'prompt_tokens': prompt_tokens,
+                      'completion_tokens': 1, 'latency_ms': 5, 'time_to_first_token_ms': None, 'created': time.time()})
+
+    def test_failed_flush_keeps_records(self):
+        self._buffer(1)
+        with patch.object(LLMUsage.objects, 'bulk_create', side_effect=RuntimeError("db down")):
+            with self.assertRaises(RuntimeError):
+                flush_llm_usage()
+        self.assertEqual(self.redis.llen(PROCESSING_KEY), 1)
+        self.assertIsNone(self.redis.get(FLUSH_LOCK_KEY))
+        self.assertEqual(flush_llm_usage(), 1)
+        self.assertEqual(self.redis.llen(PROCESSING_KEY), 0)
+
+    def test_batch_of_a_crashed_flush_is_written_by_the_next_one(self):
+        self._buffer(1)
+        self.assertEqual(len(claim_usage(10)), 1)
+        self._buffer(2)
+        self.assertEqual(flush_llm_usage(), 1)
+        self.assertEqual(flush_llm_usage(), 1)
+        self.assertEqual(sorted(LLMUsage.objects.values_list('prompt_tokens', flat=True)), [1, 2])
+
+    def test_flush_skips_while_another_runs(self):
+        self._buffer(1)
+        self.redis.set(FLUSH_LOCK_KEY, 1)
+        self.assertEqual(flush_llm_usage(), 0)
+        self.assertEqual(self.redis.llen(PENDING_KEY), 1)
+
+
+@patch.dict(os.environ, {'DEEPSEEK_API_KEY': 'stub'})
+@override_settings(LLM_CACHE_ENABLED=False, LLM_GOVERNOR_ENABLED=False)
+class LLMStubServerTests(TestCase):
+    def setUp(self):
+        set_redis(fakeredis.FakeRedis())
+        self.addCleanup(set_redis, None)
+        reset_llm_clients()
+        self.addCleanup(reset_llm_clients)
+
+    def _stub(self, **kwargs):
+        stub = StubLLMServer(**kwargs).start()
+        self.addCleanup(stub.stop)
+        settings_override = override_settings(LLM_API_BASE=stub.base_url)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        return stub
+
+    def test_streams_one_chunk_per_token_on_a_kept_alive_connection(self):
+        stub = self._stub(reply_tokens=5)
+        self.assertEqual(list(stream_llm_response("hi")), ["token0", " token1", " token2", " token3", " token4"])
+        self.assertEqual(get_llm_response("hi")['response'], "token0 token1 token2 token3 token4")
+        self.assertEqual((stub.requests, stub.connections), (2, 1))
+
+    def test_token_rate_paces_the_completion(self):
+        self._stub(tokens_per_second=100, reply_tokens=20)
+        started = time.monotonic()
+        self.assertTrue(get_llm_response("hi")['success'])
+        self.assertGreaterEqual(time.monotonic() - started, 0.2)
+
+    def test_max_tokens_truncates_the_completion(self):
+        self._stub(reply_tokens=50)
+        self.assertEqual(get_llm_response("hi", max_tokens=3)['response'], "token0 token1 token2")
+
+    def test_injected_errors(self):
+        stub = self._stub(error_rate=1.0, error_status=429)
+        response = httpx.post(f"{stub.base_url}/chat/completions", json={'messages': []})
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response.headers['Retry-After'], '1')
+        self.assertEqual(stub.errors, 1)
+
+    def test_error_rate_is_repeatable_with_a_seed(self):
+        def failures(seed):
+            with StubLLMServer(error_rate=0.5, error_status=400, seed=seed) as stub:
+                return [httpx.post(f"{stub.base_url}/chat/completions", json={}).status_code for _ in range(10)]
+        self.assertEqual(failures(7), failures(7))
+        self.assertIn(400, failures(7))
+
+
+@patch.dict(os.environ, {'DEEPSEEK_API_KEY': 'stub'})
+@override_settings(ROOT_URLCONF=__name__, LLM_CACHE_ENABLED=False, LLM_GOVERNOR_ENABLED=False)
+class LLMLoadTestTests(TestCase):
+    def setUp(self):
+        set_redis(fakeredis.FakeRedis())
+        self.addCleanup(set_redis, None)
+        reset_llm_clients()
+        self.addCleanup(reset_llm_clients)
+
+    def test_percentile_uses_nearest_rank(self):
+        values = [float(value) for value in range(1, 101)]
+        self.assertEqual(percentile(values, 50), 50.0)
+        self.assertEqual(percentile(values, 99), 99.0)
+        self.assertEqual(percentile([3.0], 95), 3.0)
+        self.assertEqual(percentile([], 50), 0.0)
+
+    def test_run_load_drives_the_endpoint(self):
+        with StubLLMServer(latency=0.1, reply_tokens=3) as stub, override_settings(LLM_API_BASE=stub.base_url):
+            report = run_load(client_sender('/api/llm/', {'prompt': 'hi', 'stream': True}, stream=True),
+                              concurrency=4, requests=8)
+        self.assertEqual((report['requests'], report['ok'], report['statuses']), (8, 8, {200: 8}))
+        self.assertEqual(stub.peak_in_flight, 4)
+        self.assertLess(report['seconds'], 0.8)
+        self.assertLessEqual(report['p50_ms'], report['p99_ms'])
+        self.assertGreaterEqual(report['p50_ms'], 100)
+        self.assertIsNotNone(report['first_event_p50_ms'])
+
+    def test_command_reports_every_level(self):
+        out = StringIO()
+        call_command('loadtest_llm', '--concurrency', '1,2', '--requests', '4', '--latency', '0',
+                     '--tokens-per-second', '0', '--error-rate', '1', '--error-status', '400', '--json', stdout=out)
+        reports = json.loads(out.getvalue())
+        self.assertEqual([report['concurrency'] for report in reports], [1, 2])
+        self.assertEqual([report['ok'] for report in reports], [0, 0])
+        self.assertEqual(reports[0]['statuses'], {'200': 4})
+
+
+@override_settings(ROOT_URLCONF=__name__, CELERY_TASK_ALWAYS_EAGER=True, LLM_CONVERSATION_CONTEXT_TOKENS=4000,
+                   LLM_CONVERSATION_COMPACT_TOKENS=3000, LLM_CONVERSATION_KEEP_RECENT=6,
+                   LLM_CONVERSATION_MAX_TURN_TOKENS=2000)
+class LLMConversationTests(TestCase):
+    def setUp(self):
+        set_redis(fakeredis.FakeRedis())
+        self.addCleanup(set_redis, None)
+        self.factory = RequestFactory()
+        self.sent = []
+        self.reply = {'success': True, 'error': None}
+        patcher = patch('main_app.llm_conversations.get_chat_response', side_effect=self._fake_chat)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _fake_chat(self, messages, temperature=0.0, max_tokens=None):
+        self.sent.append(messages)
+        if max_tokens is not None:
+            return {'success': True, 'response': f"summary {len(self.sent)}", 'error': None}
+        return {**self.reply, 'response': f"answer {len(self.sent)}" if self.reply['success'] else None}
+
+    def _turn(self, conversation, prompt, user=None):
+        request = self.factory.post(f'/api/llm/conversations/{conversation.pk}/messages/',
+                                    json.dumps({'prompt': prompt}), content_type='application/json')
+        request.user = user or AnonymousUser()
+        return views.llm_conversation_message_view(request, conversation.pk)
+
+    def test_client_sends_only_the_new_turn(self):
+        conversation = create_conversation(system_message="Be brief.")
+        self.assertEqual(json.loads(self._turn(conversation, "first question").content)['response'], "answer 1")
+        self._turn(conversation, "second question")
+
+        sent = self.sent[-1]
+        self.assertIsInstance(sent[0], SystemMessage)
+        self.assertEqual([message.content for message in sent[1:]],
+                         ["first question", "answer 1", "second question"])
+        self.assertEqual(conversation.messages.count(), 4)
+
+    @override_settings(LLM_CONVERSATION_CONTEXT_TOKENS=60)
+    def test_context_stays_within_the_token_budget(self):
+        conversation = create_conversation(summarize=False)
+        for index in range(20):
+            body = json.loads(self._turn(conversation, f"question number {index:02d} " * 3).content)
+            self.assertLessEqual(body['context_tokens'], 60)
+        self.assertLessEqual(len(self.sent[-1]), 8)
+        self.assertIsInstance(self.sent[-1][0], HumanMessage)
+        self.assertEqual(conversation.messages.count(), 40)
+
+    @override_settings(LLM_CONVERSATION_COMPACT_TOKENS=15, LLM_CONVERSATION_KEEP_RECENT=2)
+    def test_older_turns_are_compacted_into_a_summary(self):
+        conversation = create_conversation(system_message="Be brief.")
+        for index in range(4):
+            self._turn(conversation, f"a fairly long question number {index}")
+        conversation.refresh_from_db()
+        self.assertTrue(conversation.summary.startswith("summary"))
+        self.assertEqual(conversation.messages.filter(summarized=False).count(), 2)
+
+        messages, _ = build_context(conversation, "next")
+        self.assertIn("Summary of the earlier conversation", messages[0].content)
+        self.assertEqual(len(messages), 4)
+
+    def test_failed_turn_is_not_stored(self):
+        self.reply = {'success': False, 'error': 'upstream down'}
+        conversation = create_conversation()
+        response = self._turn(conversation, "hello")
+        self.assertEqual(response.status_code, 502)
+        self.assertFalse(conversation.messages.exists())
+
+    def test_overloaded_turn_returns_503(self):
+        self.reply = {'success': False, 'error': 'busy', 'retry_after': 3}
+        response = self._turn(create_conversation(), "hello")
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '3')
+
+    @override_settings(LLM_CONVERSATION_MAX_TURN_TOKENS=5)
+    def test_long_prompt_is_rejected(self):
+        self.assertEqual(self._turn(create_conversation(), "x" * 100).status_code, 400)
+        self.assertEqual(self.sent, [])
+
+    def test_conversation_of_another_user_is_hidden(self):
+        owner = User.objects.create_user(username='owner', password='x')
+        other = User.objects.create_user(username='other', password='x')
+        request = self.factory.post('/api/llm/conversations/', '{}', content_type='application/json')
+        request.user = owner
+        conversation_id = json.loads(views.llm_conversation_create_view(request).content)['conversation_id']
+        conversation = Conversation.objects.get(pk=conversation_id)
+        self.assertEqual(conversation.user, owner)
+        self.assertEqual(self._turn(conversation, "hi", user=other).status_code, 404)
+        self.assertEqual(self._turn(conversation, "hi", user=owner).status_code, 200)
+
+
+@override_settings(CELERY_TASK_ALWAYS_EAGER=True, LLM_RETRIEVAL_CHUNK_WORDS=20, LLM_RETRIEVAL_CHUNK_OVERLAP=5,
+                   LLM_RETRIEVAL_TOP_K=2, LLM_RETRIEVAL_MAX_K=20)
+class DocumentRetrievalTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.item = BusinessLogicModel.objects.create()
+        self.user = User.objects.create_user(username='reader', password='x')
+        WebNotifications.objects.create(item=self.item, user=self.user)
+        self.factory = RequestFactory()
+
+    def _upload(self, name, text, item=None):
+        with self.captureOnCommitCallbacks(execute=True):
+            document = Documents(client_inn=item or self.item)
+            document.document.save(name, ContentFile(text.encode()))
+        return document
+
+    def test_upload_is_indexed_in_chunks(self):
+        document = self._upload('contract.txt', " ".join(f"word{index}" for index in range(50)))
+        self.assertEqual(DocumentChunk.objects.filter(document=document).count(), 3)
+        self.assertEqual(DocumentIndexState.objects.get(document=document).chunks, 3)
+        self.assertEqual(DocumentTerm.objects.filter(term='word0').count(), 1)
+
+    def test_search_ranks_by_bm25(self):
+        self._upload('a.txt', "the delivery terms are thirty days after the invoice date")
+        relevant = self._upload('b.txt', "penalty clause: the penalty is one percent per day of delay penalty")
+        self._upload('c.txt', "the office is open on weekdays")
+        results = search("what is the penalty for delay?", None)
+        self.assertEqual(results[0]['document_id'], relevant.pk)
+        self.assertGreater(results[0]['score'], 0)
+        self.assertLessEqual(len(results), 2)
+
+    def test_search_can_be_limited_to_an_item(self):
+        other_item = BusinessLogicModel.objects.create()
+        self._upload('a.txt', "invoice number one")
+        mine = self._upload('b.txt', "invoice number two", item=other_item)
+        self.assertEqual([hit['document_id'] for hit in search("invoice", [other_item.pk])], [mine.pk])
+
+    def test_index_follows_changes_and_deletes(self):
+        document = self._upload('notes.txt', "alpha beta")
+        with self.captureOnCommitCallbacks(execute=True):
+            document.save()
+        self.assertEqual(DocumentChunk.objects.filter(document=document).count(), 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            document.document.save('notes.txt', ContentFile(b"gamma delta"))
+        self.assertEqual(search("alpha", None), [])
+        self.assertEqual(search("gamma", None)[0]['document_id'], document.pk)
+
+        document.delete()
+        self.assertEqual(search("gamma", None), [])
+        self.assertFalse(DocumentTerm.objects.exists())
+
+    def test_unsupported_file_is_recorded_without_chunks(self):
+        document = self._upload('image.png', "binary")
+        self.assertIn("Unsupported", DocumentIndexState.objects.get(document=document).error)
+        self.assertFalse(DocumentChunk.objects.exists())
+
+    def test_extracts_docx_text(self):
+        buffer = BytesIO()
+        with zipfile.ZipFile(buffer, 'w') as archive:
+            archive.writestr('word/document.xml', (
+                '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main"><w:body>'
+                '<w:p><w:r><w:t>Hello </w:t></w:r><w:r><w:t>world</w:t></w:r></w:p><w:p><w:r><w:t>Bye</w:t></w:r></w:p>'
+                '</w:body></w:document>'
+            ))
+        self.assertEqual(extract_text('letter.docx', buffer.getvalue()), "Hello world\nBye")
+
+    def test_tokenize_and_chunk(self):
+        self.assertEqual(tokenize("Договор №5, a Penalty!"), ["договор", "penalty"])
+        self.assertEqual(chunk_text("a b c d e f g", size=4, overlap=1), ["a b c d", "d e f g"])
+
+    def test_answer_sends_only_top_k_chunks(self):
+        self._upload('long.txt', " ".join(["filler text"] * 100) + " the warranty lasts two years")
+        sent = []
+
+        def fake_chat(messages, temperature=0.0, max_tokens=None):
+            sent.append(messages)
+            return {'success': True, 'response': "Two years [1].", 'error': None}
+
+        request = self.factory.post('/api/llm/documents/answer/', json.dumps({'question': "How long is the warranty?", 'k': 1}),
+                                    content_type='application/json')
+        request.user = self.user
+        with patch('main_app.llm_retrieval.get_chat_response', side_effect=fake_chat):
+            response = views.llm_document_answer_view(request)
+        body = json.loads(response.content)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(body['sources']), 1)
+        self.assertIn("warranty", body['sources'][0]['text'])
+        self.assertLess(len(sent[0][0].content), 400)
+
+    def test_search_view_validates_k(self):
+        request = self.factory.get('/api/llm/documents/search/', {'q': 'anything', 'k': 100})
+        request.user = self.user
+        self.assertEqual(views.llm_document_search_view(request).status_code, 400)
+
+    def test_views_require_login(self):
+        self._upload('secret.txt', "the secret code is forty two")
+        search_request = self.factory.get('/api/llm/documents/search/', {'q': 'secret'})
+        answer_request = self.factory.post('/api/llm/documents/answer/', json.dumps({'question': "secret?"}),
+                                           content_type='application/json')
+        search_request.user = answer_request.user = AnonymousUser()
+        with patch('main_app.llm_retrieval.get_chat_response') as mock_chat:
+            self.assertEqual(views.llm_document_search_view(search_request).status_code, 401)
+            self.assertEqual(views.llm_document_answer_view(answer_request).status_code, 401)
+        mock_chat.assert_not_called()
+
+    def test_search_view_only_reads_items_of_the_user(self):
+        readable = self._upload('mine.txt', "invoice for the reader")
+        hidden_item = BusinessLogicModel.objects.create()
+        self._upload('other.txt', "invoice from a mail attachment", item=hidden_item)
+
+        def hits(user, **params):
+            request = self.factory.get('/api/llm/documents/search/', {'q': 'invoice', **params})
+            request.user = user
+            return [hit['document_id'] for hit in json.loads(views.llm_document_search_view(request).content)['results']]
+
+        self.assertEqual(hits(self.user), [readable.pk])
+        self.assertEqual(hits(self.user, item_id=hidden_item.pk), [])
+        self.assertEqual(hits(User.objects.create_user(username='stranger', password='x')), [])
+        staff = User.objects.create_user(username='staff', password='x', is_staff=True)
+        self.assertEqual(len(hits(staff)), 2)
+
+    @patch('main_app.tasks.ingest_document.delay', side_effect=OperationalError("broker down"))
+    def test_upload_survives_broker_outage(self, mock_delay):
+        with self.assertLogs('main_app.models', level='WARNING'):
+            document = self._upload('notes.txt', "alpha beta")
+        mock_delay.assert_called_once_with(document.pk)
+        self.assertTrue(Documents.objects.filter(pk=document.pk).exists())
+
+
+def make_email(subject: str, attachments: Optional[dict[str, bytes]] = None) -> bytes:
+    from email.message import EmailMessage
+
+    message = EmailMessage()
+    message['Subject'] = subject
+    message['From'] = 'sender@example.com'
+    message['To'] = 'simpleboard@example.com'
+    message.set_content(f"Body of {subject}")
+    for name, data in (attachments or {}).items():
+        message.add_attachment(data, maintype='application', subtype='octet-stream', filename=name)
+    return message.as_bytes()
+
+
+class MailboxSyncTests(TestCase):
+    def setUp(self):
+        self.stub = StubIMAPServer(mailboxes=("INBOX", "Archive")).start()
+        self.addCleanup(self.stub.stop)
+        self.imap = connect(self.stub.host, self.stub.port, "user", "password", ssl=False)
+        self.addCleanup(self.imap.logout)
+        self.seen = []
+
+    def _handler(self, imap, uid, structure):
+        self.seen.append(uid)
+
+    def _sync(self, mailbox="INBOX", **kwargs):
+        return sync_mailbox(self.imap, "user", mailbox, self._handler, **kwargs)
+
+    def test_only_new_messages_are_fetched(self):
+        for index in range(3):
+            self.stub.add_message("INBOX", make_email(f"first {index}"))
+        report = self._sync()
+        self.assertEqual((report['fetched'], report['last_uid']), (3, 3))
+
+        self.stub.add_message("INBOX", make_email("second 0"))
+        self.stub.add_message("INBOX", make_email("second 1"))
+        fetched_before = self.stub.fetched_messages
+        report = self._sync()
+        self.assertEqual(report['fetched'], 2)
+        self.assertEqual(self.stub.fetched_messages - fetched_before, 2)
+        self.assertEqual(self.seen, [1, 2, 3, 4, 5])
+        self.assertEqual(MailboxSyncState.objects.get(account="user", mailbox="INBOX").last_uid, 5)
+
+    def test_no_new_mail_fetches_nothing(self):
+        self.stub.add_message("INBOX", make_email("only"))
+        self._sync()
+        fetches = self.stub.commands['UID FETCH']
+        # "UID SEARCH UID 2:*" still returns UID 1, the highest; it must not be processed again
+        report = self._sync()
+        self.assertEqual(report['fetched'], 0)
+        self.assertEqual(self.stub.commands['UID FETCH'], fetches)
+        self.assertEqual(len(self.seen), 1)
+
+    def test_fetches_in_batches(self):
+        for index in range(5):
+            self.stub.add_message("INBOX", make_email(f"message {index}"))
+        report = self._sync(batch_size=2)
+        self.assertEqual(report['fetched'], 5)
+        self.assertEqual(self.stub.commands['UID FETCH'], 3)
+
+    def test_failed_batch_is_fetched_again(self):
+        for index in range(4):
+            self.stub.add_message("INBOX", make_email(f"message {index}"))
+
+        def failing_handler(imap, uid, structure):
+            if uid == 3:
+                raise ValueError("cannot process")
+            self.seen.append(uid)
+
+        with self.assertRaises(ValueError):
+            sync_mailbox(self.imap, "user", "INBOX", failing_handler, batch_size=2)
+        self.assertEqual(MailboxSyncState.objects.get(mailbox="INBOX").last_uid, 2)
+
+        self.seen.clear()
+        report = self._sync(batch_size=2)
+        self.assertEqual(self.seen, [3, 4])
+        self.assertEqual(report['last_uid'], 4)
+
+    def test_expunged_messages_are_skipped(self):
+        for index in range(3):
+            self.stub.add_message("INBOX", make_email(f"message {index}"))
+        self.stub.expunge("INBOX", 2)
+        report = self._sync()
+        self.assertEqual(self.seen, [1, 3])
+        self.assertEqual(report['last_uid'], 3)
+
+    def test_uidvalidity_change_syncs_again(self):
+        self.stub.add_message("INBOX", make_email("old"))
+        self._sync()
+        self.stub.add_message("INBOX", make_email("new"))
+        self.stub.renumber("INBOX")
+        report = self._sync()
+        self.assertTrue(report['resynced'])
+        self.assertEqual(report['fetched'], 2)
+        self.assertEqual(MailboxSyncState.objects.get(mailbox="INBOX").uidvalidity, report['uidvalidity'])
+
+    def test_mailboxes_are_tracked_separately(self):
+        self.stub.add_message("INBOX", make_email("inbox"))
+        self.stub.add_message("Archive", make_email("archived"))
+        self.stub.add_message("Archive", make_email("archived too"))
+        self.assertEqual(self._sync("INBOX")['fetched'], 1)
+        self.assertEqual(self._sync("Archive")['fetched'], 2)
+        self.assertEqual(MailboxSyncState.objects.count(), 2)
+
+    def test_fetch_email_data_saves_attachments_once(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        item = BusinessLogicModel.objects.create()
+        self.stub.add_message("INBOX", make_email("report", {"report.xlsx": b"spreadsheet"}))
+        with override_settings(MAIL_IMAP_HOST=self.stub.host, MAIL_IMAP_PORT=self.stub.port, MAIL_IMAP_SSL=False,
+                               MAIL_IMAP_USER="user", MAIL_IMAP_PASSWORD="password", MAIL_DOCUMENTS_ITEM_ID=item.pk,
+                               MEDIA_ROOT=media_root):
+            self.assertEqual(fetch_email_data()['fetched'], 1)
+            self.assertEqual(fetch_email_data()['fetched'], 0)
+            document = Documents.objects.get(client_inn=item)
+            with document.document.open('rb') as file:
+                self.assertEqual(file.read(), b"spreadsheet")
+
+
+class MailAttachmentTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.item = BusinessLogicModel.objects.create()
+        self.stub = StubIMAPServer().start()
+        self.addCleanup(self.stub.stop)
+        self.imap = connect(self.stub.host, self.stub.port, "user", "password", ssl=False)
+        self.addCleanup(self.imap.logout)
+
+    def _structure(self, uid):
+        select_mailbox(self.imap, "INBOX")
+        return {message_uid: structure for message_uid, structure, _ in fetch_structures(self.imap, [uid])}[uid]
+
+    def _read(self, document):
+        with document.document.open('rb') as file:
+            return file.read()
+
+    def test_only_wanted_attachments_are_downloaded(self):
+        photo = os.urandom(200_000)
+        uid = self.stub.add_message("INBOX", make_email("mixed", {"data.xlsx": b"x" * 1000, "photo.png": photo}))
+        structure = self._structure(uid)
+        self.assertEqual([(part['section'], part['filename']) for part in find_attachments(structure)],
+                         [("2", "data.xlsx"), ("3", "photo.png")])
+
+        downloaded = self.stub.fetched_bytes
+        documents = save_attachments(self.imap, uid, structure, self.item)
+        self.assertEqual([self._read(document) for document in documents], [b"x" * 1000])
+        # Only the encoded spreadsheet was transferred, not the photo or the message body
+        self.assertLess(self.stub.fetched_bytes - downloaded, 2000)
+
+    def test_nested_parts_and_encoded_names(self):
+        from email.message import EmailMessage
+
+        message = EmailMessage()
+        message['Subject'] = 'nested'
+        message.set_content("plain")
+        message.add_alternative("<p>html</p>", subtype='html')
+        message.make_mixed()
+        message.add_attachment(b"1;2\n", maintype='text', subtype='csv', filename="отчёт.csv")
+        uid = self.stub.add_message("INBOX", message.as_bytes())
+        parts = find_attachments(self._structure(uid))
+        self.assertEqual([(part['section'], part['filename']) for part in parts], [("2", "отчёт.csv")])
+        self.assertEqual(self._read(save_attachments(self.imap, uid, self._structure(uid), self.item)[0]), b"1;2\n")
+
+    def test_names_are_made_unique(self):
+        uid = self.stub.add_message("INBOX", make_email("twice", {"report.pdf": b"one"}))
+        other = self.stub.add_message("INBOX", make_email("again", {"report.pdf": b"two"}))
+        first = save_attachments(self.imap, uid, self._structure(uid), self.item)[0]
+        second = save_attachments(self.imap, other, self._structure(other), self.item)[0]
+        self.assertNotEqual(first.document.name, second.document.name)
+        self.assertEqual((self._read(first), self._read(second)), (b"one", b"two"))
+
+    def test_decoding_across_piece_boundaries(self):
+        from email.message import EmailMessage
+
+        content = os.urandom(10_000)
+        text = "".join(f"строка {index} = {index * 7}\n" for index in range(300))
+        message = EmailMessage()
+        message.set_content("see attached")
+        message.add_attachment(content, maintype='application', subtype='pdf', filename="scan.pdf")
+        message.add_attachment(text, subtype='csv', filename="rows.csv", cte='quoted-printable')
+        uid = self.stub.add_message("INBOX", message.as_bytes())
+        parts = find_attachments(self._structure(uid))
+        self.assertEqual([part['encoding'] for part in parts], ['base64', 'quoted-printable'])
+        # Text travels with canonical CRLF line endings
+        for part, expected in zip(parts, (content, text.replace("\n", "\r\n").encode())):
+            output = BytesIO()
+            self.assertEqual(download_part(self.imap, uid, part, output, chunk_size=61), len(expected))
+            self.assertEqual(output.getvalue(), expected)
+
+    def test_memory_stays_bounded_by_the_piece_size(self):
+        import tracemalloc
+
+        size = 8 * 1024 * 1024
+        uid = self.stub.add_message("INBOX", make_email("large", {"large.xlsx": os.urandom(size)}))
+        part = find_attachments(self._structure(uid))[0]
+        with tempfile.TemporaryFile() as output:
+            tracemalloc.start()
+            try:
+                written = download_part(self.imap, uid, part, output, chunk_size=256 * 1024)
+                _, peak = tracemalloc.get_traced_memory()
+            finally:
+                tracemalloc.stop()
+        self.assertEqual(written, size)
+        self.assertLess(peak, 4 * 1024 * 1024)
+
+
+@override_settings(CELERY_TASK_ALWAYS_EAGER=True)
+class MailIngestTests(TestCase):
+    def setUp(self):
+        set_redis(fakeredis.FakeRedis())
+        self.addCleanup(set_redis, None)
+        self.addCleanup(reset_imap_pools)
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        self.stub = StubIMAPServer(mailboxes=("INBOX", "Reports")).start()
+        self.addCleanup(self.stub.stop)
+        self.item = BusinessLogicModel.objects.create()
+        self.accounts = [{
+            'user': 'user', 'password': 'password', 'host': self.stub.host, 'port': self.stub.port, 'ssl': False,
+            'mailboxes': ['INBOX', 'Reports'], 'item_id': self.item.pk, 'max_connections': 2,
+        }]
+        settings_override = override_settings(MAIL_ACCOUNTS=self.accounts, MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def _pool(self, max_connections=2):
+        pool = IMAPConnectionPool(self.stub.host, self.stub.port, 'user', 'password', ssl=False,
+                                  max_connections=max_connections)
+        self.addCleanup(pool.close_all)
+        return pool
+
+    def _sample(self, name, mailbox):
+        return REGISTRY.get_sample_value(name, {'account': 'user', 'mailbox': mailbox}) or 0
+
+    def test_pool_reuses_authenticated_connections(self):
+        pool = self._pool()
+        for _ in range(3):
+            with pool.connection() as imap:
+                self.assertEqual(imap.noop()[0], 'OK')
+        self.assertEqual((pool.connections_opened, self.stub.logins), (1, 1))
+
+    def test_pool_is_bounded(self):
+        pool = self._pool(max_connections=2)
+        active, peak, lock = [0], [0], threading.Lock()
+
+        def work():
+            with pool.connection():
+                with lock:
+                    active[0] += 1
+                    peak[0] = max(peak[0], active[0])
+                time.sleep(0.05)
+                with lock:
+                    active[0] -= 1
+
+        threads = [threading.Thread(target=work) for _ in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(peak[0], 2)
+        self.assertLessEqual(pool.connections_opened, 2)
+
+    def test_pool_replaces_dropped_connections(self):
+        pool = self._pool()
+        with pool.connection() as imap:
+            imap.shutdown()
+        with pool.connection() as imap:
+            self.assertEqual(imap.noop()[0], 'OK')
+        self.assertEqual(pool.connections_opened, 2)
+
+    def test_ingests_every_configured_mailbox(self):
+        self.stub.add_message("INBOX", make_email("a", {"a.xlsx": b"inbox"}))
+        self.stub.add_message("Reports", make_email("b", {"b.xlsx": b"report"}))
+        self.stub.add_message("Reports", make_email("c", {"c.csv": b"1;2"}))
+        self.assertEqual(ingest_mailboxes(), 2)
+        self.assertEqual(dict(MailboxSyncState.objects.values_list('mailbox', 'last_uid')), {'INBOX': 1, 'Reports': 2})
+        self.assertEqual(Documents.objects.filter(client_inn=self.item).count(), 3)
+        # Both mailboxes were synced over the same pooled login
+        self.assertEqual(self.stub.logins, 1)
+
+        self.stub.add_message("INBOX", make_email("d", {"d.pdf": b"new"}))
+        ingest_mailboxes()
+        self.assertEqual(Documents.objects.filter(client_inn=self.item).count(), 4)
+        self.assertEqual(self.stub.logins, 1)
+
+    def test_busy_account_is_skipped(self):
+        self.stub.add_message("INBOX", make_email("a", {"a.xlsx": b"inbox"}))
+        redis = get_redis()
+        for slot in range(2):
+            redis.set(f"{ACCOUNT_LOCK_PREFIX}user:{slot}", "other-worker")
+        self.assertIsNone(ingest_mailbox('user', 'INBOX'))
+        self.assertEqual(self.stub.commands['UID FETCH'], 0)
+        self.assertFalse(redis.exists(f"{MAILBOX_LOCK_PREFIX}user:INBOX"))
+
+        redis.delete(f"{ACCOUNT_LOCK_PREFIX}user:1")
+        self.assertEqual(ingest_mailbox('user', 'INBOX')['fetched'], 1)
+        self.assertEqual(redis.get(f"{ACCOUNT_LOCK_PREFIX}user:0"), b"other-worker")
+        self.assertFalse(redis.exists(f"{ACCOUNT_LOCK_PREFIX}user:1"))
+
+    def test_mailbox_being_synced_is_skipped(self):
+        self.stub.add_message("INBOX", make_email("a"))
+        get_redis().set(f"{MAILBOX_LOCK_PREFIX}user:INBOX", "other-worker")
+        self.assertIsNone(ingest_mailbox('user', 'INBOX'))
+        self.assertEqual(ingest_mailbox('user', 'Reports')['fetched'], 0)
+
+    def test_records_lag_and_throughput(self):
+        messages = self._sample('mail_ingest_messages_total', 'Reports')
+        lag_count = self._sample('mail_ingest_lag_seconds_count', 'Reports')
+        lag_sum = self._sample('mail_ingest_lag_seconds_sum', 'Reports')
+        received = timezone.now() - timedelta(hours=1)
+        for index in range(3):
+            self.stub.add_message("Reports", make_email(f"old {index}"), received=received)
+        ingest_mailbox('user', 'Reports')
+        self.assertEqual(self._sample('mail_ingest_messages_total', 'Reports') - messages, 3)
+        self.assertEqual(self._sample('mail_ingest_lag_seconds_count', 'Reports') - lag_count, 3)
+        self.assertGreaterEqual(self._sample('mail_ingest_lag_seconds_sum', 'Reports') - lag_sum, 3 * 3600)
+        self.assertEqual(self._sample('mail_ingest_backlog_messages', 'Reports'), 0)
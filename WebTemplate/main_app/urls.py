@@ -13,6 +13,19 @@ sitemaps = {
 urlpatterns = [
     path('', views.index, name='index'),
     path('sitemap.xml', sitemap, {'sitemaps': sitemaps}, name='django.contrib.sitemaps.views.sitemap'),
+    path('api/llm/', views.llm_response_view, name='llm-response'),
+    path('api/llm/async/', views.llm_response_async_view, name='llm-response-async'),
+    path('api/llm/batch/', views.llm_batch_view, name='llm-batch'),
+    path('api/llm/jobs/', views.llm_job_create_view, name='llm-job-create'),
+    path('api/llm/jobs/<str:job_id>/', views.llm_job_status_view, name='llm-job-status'),
+    path('api/llm/jobs/<str:job_id>/cancel/', views.llm_job_cancel_view, name='llm-job-cancel'),
+    path('api/llm/conversations/', views.llm_conversation_create_view, name='llm-conversation-create'),
+    path('api/llm/conversations/<uuid:conversation_id>/', views.llm_conversation_detail_view,
+         name='llm-conversation-detail'),
+    path('api/llm/conversations/<uuid:conversation_id>/messages/', views.llm_conversation_message_view,
+         name='llm-conversation-messages'),
+    path('api/llm/documents/search/', views.llm_document_search_view, name='llm-document-search'),
+    path('api/llm/documents/answer/', views.llm_document_answer_view, name='llm-document-answer'),
 
 
 
@@ -1,14 +1,25 @@
-from django.http import JsonResponse, HttpRequest, HttpResponse
+from django.http import JsonResponse, HttpRequest, HttpResponse, StreamingHttpResponse
 from django.shortcuts import render, get_object_or_404, redirect
+from django.urls import reverse
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
-from typing import Any, Optional
+from typing import Any, AsyncIterator, Optional
 
-from .models import BusinessLogicModel
+from .models import BusinessLogicModel, Conversation
 from users.models import BusinessModelComments
 from users.forms import ItemCommentForm
-from .llm_helper import get_llm_response
+from django.conf import settings
+from django.db.models import Q, QuerySet
+from .llm_conversations import TurnResult, create_conversation, estimate_tokens, send_turn
+from .llm_governor import LLMOverloaded
+from .llm_helper import LLMResponse, BatchItem, abatch_llm_responses, aget_llm_response, astream_llm_response
+from .llm_jobs import LLMJobStatus, cancel_llm_job, get_llm_job, submit_llm_job
+from .llm_retrieval import GroundedAnswer, RetrievedChunk, answer_question, search
 import json
+import logging
+
+
+logger = logging.getLogger(__name__)
 
 
 def index(request: HttpRequest) -> HttpResponse:
@@ -62,14 +73,84 @@ def some_item(request: HttpRequest, item_id: int) -> HttpResponse:
     return render(request, 'main/comment_template_XXXXXXX.html', {"form": form, "item_comments": item_comments})
 
 
+def sse_event(data: dict[str, Any], event: Optional[str] = None) -> str:
+    """
+    Format one Server-Sent Events message with a JSON payload.
+
+    Args:
+        data (dict[str, Any]): The payload, serialized as JSON on the data line.
+        event (Optional[str]): Event name. Unnamed events are delivered to the
+            client's default 'message' handler.
+
+    Returns:
+        str: The event, terminated by a blank line.
+    """
+    prefix: str = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def llm_overloaded_response(result: LLMResponse) -> JsonResponse:
+    """
+    Build the 503 answer for a call refused by the upstream governor.
+
+    Args:
+        result (LLMResponse): A result carrying 'retry_after'.
+
+    Returns:
+        JsonResponse: {'success': False, 'error': ...} with status 503 and a
+            Retry-After header.
+    """
+    response = JsonResponse({'success': False, 'error': result['error']}, status=503)
+    response['Retry-After'] = str(result['retry_after'])
+    return response
+
+
+async def stream_llm_events(prompt: str, system_message: Optional[str], temperature: float,
+                            use_cache: bool) -> AsyncIterator[str]:
+    """
+    Turn a streamed completion into Server-Sent Events.
+
+    Every piece of the completion is sent as ``data: {"token": "..."}``. The
+    stream ends with an ``event: done`` carrying ``{"success": true}`` or, if
+    the upstream call fails midway, an ``event: error`` carrying the same
+    ``{"success": false, "error": ...}`` payload as the JSON endpoint.
+
+    This is an async generator, so the ASGI handler sends every event as
+    soon as it is produced; a sync iterator would be read to the end before
+    the first byte goes out. If the client disconnects, the handler cancels
+    the response and the upstream stream is closed with it.
+    """
+    try:
+        async for token in astream_llm_response(prompt=prompt, system_message=system_message,
+                                                temperature=temperature, use_cache=use_cache):
+            yield sse_event({'token': token})
+    except LLMOverloaded as e:
+        yield sse_event({'success': False, 'error': str(e), 'retry_after': e.retry_after}, event='error')
+        return
+    except Exception as e:
+        logger.warning("LLM stream failed: %s", e)
+        yield sse_event({'success': False, 'error': f'An error occurred: {str(e)}'}, event='error')
+        return
+    yield sse_event({'success': True}, event='done')
+
+
 @csrf_exempt
 @require_http_methods(["POST"])
-def llm_response_view(request: HttpRequest) -> JsonResponse:
+async def llm_response_view(request: HttpRequest) -> HttpResponse:
     """
     API endpoint to generate a response from an LLM (Large Language Model).
 
     Expects a JSON payload in the request body with a 'prompt' and optional
-    'system_message' and 'temperature'.
+    'system_message', 'temperature', 'cache' and 'stream'. Calls with
+    temperature 0 are served from the response cache unless 'cache' is false.
+
+    With 'stream' set to true (or an ``Accept: text/event-stream`` header) the
+    completion is sent as Server-Sent Events while it is generated, see
+    stream_llm_events. Validation errors are still plain JSON responses.
+
+    The view is async so that, under ASGI, the events are streamed from the
+    event loop as they arrive. Non-streaming calls await the completion like
+    llm_response_async_view.
 
     Args:
         request (HttpRequest): The HTTP request object containing the JSON body.
@@ -84,18 +165,36 @@ def llm_response_view(request: HttpRequest) -> JsonResponse:
             - 200: Success.
             - 400: Invalid JSON or missing 'prompt'.
             - 500: Internal server error during LLM processing.
+            - 503: Upstream capacity exhausted; retry after the number of
+              seconds in the Retry-After header.
+        StreamingHttpResponse: A ``text/event-stream`` response in streaming mode.
     """
     try:
         data: dict[str, Any] = json.loads(request.body)
         prompt: Optional[str] = data.get('prompt')
         system_message: Optional[str] = data.get('system_message')
         temperature: float = data.get('temperature', 0.0)
+        use_cache: bool = bool(data.get('cache', True))
+        stream: bool = bool(data.get('stream')) or 'text/event-stream' in request.headers.get('Accept', '')
 
         if not prompt:
             return JsonResponse({'error': 'prompt field is required'}, status=400)
 
+        if stream:
+            response_stream = StreamingHttpResponse(
+                stream_llm_events(prompt, system_message, temperature, use_cache),
+                content_type='text/event-stream',
+            )
+            # Let proxies pass the events through as they are produced
+            response_stream['Cache-Control'] = 'no-cache'
+            response_stream['X-Accel-Buffering'] = 'no'
+            return response_stream
+
         # Call the helper function to interact with the LLM provider
-        response: str = get_llm_response(prompt=prompt, system_message=system_message, temperature=temperature)
+        response: LLMResponse = await aget_llm_response(prompt=prompt, system_message=system_message,
+                                                        temperature=temperature, use_cache=use_cache)
+        if 'retry_after' in response:
+            return llm_overloaded_response(response)
 
         return JsonResponse({'success': True, 'response': response})
 
@@ -105,3 +204,495 @@ def llm_response_view(request: HttpRequest) -> JsonResponse:
     except Exception as e:
         # Catch-all for any other errors during processing
         return JsonResponse({'error': f'An error occurred: {str(e)}'}, status=500)
+
+
+@csrf_exempt
+@require_http_methods(["POST"])
+async def llm_response_async_view(request: HttpRequest) -> JsonResponse:
+    """
+    JSON-only variant of llm_response_view for the ASGI stack.
+
+    Takes the same JSON payload and returns the same responses as the
+    non-streaming llm_response_view, awaiting the completion with
+    ``ainvoke``. While a completion is in flight the worker's event loop keeps
+    serving other requests, so slow LLM calls no longer hold a worker each.
+
+    Args:
+        request (HttpRequest): The HTTP request object containing the JSON body.
+
+    Returns:
+        JsonResponse: See llm_response_view (status codes 200, 400, 500 and 503).
+    """
+    try:
+        data: dict[str, Any] = json.loads(request.body)
+        prompt: Optional[str] = data.get('prompt')
+        system_message: Optional[str] = data.get('system_message')
+        temperature: float = data.get('temperature', 0.0)
+        use_cache: bool = bool(data.get('cache', True))
+
+        if not prompt:
+            return JsonResponse({'error': 'prompt field is required'}, status=400)
+
+        response = await aget_llm_response(prompt=prompt, system_message=system_message, temperature=temperature,
+                                           use_cache=use_cache)
+        if 'retry_after' in response:
+            return llm_overloaded_response(response)
+
+        return JsonResponse({'success': True, 'response': response})
+
+    except json.JSONDecodeError:
+        return JsonResponse({'error': 'Invalid JSON in request body'}, status=400)
+
+    except Exception as e:
+        return JsonResponse({'error': f'An error occurred: {str(e)}'}, status=500)
+
+
+def parse_batch_timeout(value: Any) -> Optional[float]:
+    """
+    Validate the per-item timeout of a batch request; None if not given.
+
+    Raises:
+        ValueError: If it is not a number of seconds above 0 and at most LLM_TIMEOUT.
+    """
+    if value in (None, ''):
+        return None
+    max_timeout: float = getattr(settings, 'LLM_TIMEOUT', 120.0)
+    error: str = f'timeout must be a number of seconds above 0 and at most {max_timeout:g}'
+    try:
+        timeout: float = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(error)
+    if not 0 < timeout <= max_timeout:
+        raise ValueError(error)
+    return timeout
+
+
+def parse_batch_items(data: dict[str, Any]) -> list[BatchItem]:
+    """
+    Read the prompts of a batch request.
+
+    Each entry of ``data['prompts']`` is either a prompt string or an object
+    with 'prompt' and an optional 'system_message'. Entries without their own
+    system message get the shared ``data['system_message']``.
+
+    Args:
+        data (dict[str, Any]): The decoded JSON body.
+
+    Returns:
+        list[BatchItem]: The prompts in request order.
+
+    Raises:
+        ValueError: If 'prompts' is missing, empty, too long or has an entry
+            without a prompt. The message is safe to return to the client.
+    """
+    prompts: Any = data.get('prompts')
+    if not isinstance(prompts, list) or not prompts:
+        raise ValueError('prompts field must be a non-empty list')
+    max_items: int = getattr(settings, 'LLM_BATCH_MAX_ITEMS', 100)
+    if len(prompts) > max_items:
+        raise ValueError(f'at most {max_items} prompts per batch')
+
+    shared_system_message: Optional[str] = data.get('system_message')
+    items: list[BatchItem] = []
+    for index, entry in enumerate(prompts):
+        if isinstance(entry, str):
+            entry = {'prompt': entry}
+        if not isinstance(entry, dict) or not entry.get('prompt'):
+            raise ValueError(f'prompts[{index}] has no prompt')
+        items.append({'prompt': entry['prompt'], 'system_message': entry.get('system_message', shared_system_message)})
+    return items
+
+
+@csrf_exempt
+@require_http_methods(["POST"])
+async def llm_batch_view(request: HttpRequest) -> JsonResponse:
+    """
+    API endpoint to answer a list of prompts in one request.
+
+    Expects a JSON payload with 'prompts' (see parse_batch_items) and optional
+    'system_message', 'temperature', 'cache', 'concurrency' and 'timeout'
+    (seconds per item, at most settings.LLM_TIMEOUT). The prompts run concurrently, never more than
+    'concurrency' or settings.LLM_BATCH_MAX_CONCURRENCY at a time.
+
+    Args:
+        request (HttpRequest): The HTTP request object containing the JSON body.
+
+    Returns:
+        JsonResponse: A JSON response containing:
+            - 'success': True once the batch ran, even if some items failed.
+            - 'results': One {'success', 'response', 'error'} object per
+              prompt, in request order.
+
+            Status codes:
+            - 200: The batch ran.
+            - 400: Invalid JSON, invalid 'prompts' or invalid 'timeout'.
+            - 500: Internal server error during processing.
+    """
+    try:
+        data: dict[str, Any] = json.loads(request.body)
+        items: list[BatchItem] = parse_batch_items(data)
+        max_concurrency: int = getattr(settings, 'LLM_BATCH_MAX_CONCURRENCY', 8)
+        concurrency: int = min(int(data.get('concurrency') or max_concurrency), max_concurrency)
+        timeout: Optional[float] = parse_batch_timeout(data.get('timeout'))
+
+        results = await abatch_llm_responses(items, temperature=data.get('temperature', 0.0),
+                                             use_cache=bool(data.get('cache', True)),
+                                             concurrency=concurrency, timeout=timeout)
+
+        return JsonResponse({'success': True, 'results': results})
+
+    except json.JSONDecodeError:
+        return JsonResponse({'error': 'Invalid JSON in request body'}, status=400)
+
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    except Exception as e:
+        return JsonResponse({'error': f'An error occurred: {str(e)}'}, status=500)
+
+
+@csrf_exempt
+@require_http_methods(["POST"])
+def llm_job_create_view(request: HttpRequest) -> JsonResponse:
+    """
+    API endpoint to run an LLM prompt as a background job.
+
+    Takes the same JSON payload as llm_response_view (plus an optional
+    'max_tokens'), enqueues a Celery task and returns without waiting for the
+    model. The result is fetched from the status URL.
+
+    Args:
+        request (HttpRequest): The HTTP request object containing the JSON body.
+
+    Returns:
+        JsonResponse: A JSON response containing 'job_id', 'status' ("queued")
+            and 'status_url'.
+
+            Status codes:
+            - 202: The job was queued.
+            - 400: Invalid JSON or missing 'prompt'.
+            - 500: The job could not be queued.
+    """
+    try:
+        data: dict[str, Any] = json.loads(request.body)
+        prompt: Optional[str] = data.get('prompt')
+
+        if not prompt:
+            return JsonResponse({'error': 'prompt field is required'}, status=400)
+
+        job_id: str = submit_llm_job({
+            'prompt': prompt,
+            'system_message': data.get('system_message'),
+            'temperature': data.get('temperature', 0.0),
+            'max_tokens': data.get('max_tokens'),
+            'use_cache': bool(data.get('cache', True)),
+        })
+        return JsonResponse({
+            'job_id': job_id,
+            'status': 'queued',
+            'status_url': reverse('llm-job-status', args=[job_id]),
+        }, status=202)
+
+    except json.JSONDecodeError:
+        return JsonResponse({'error': 'Invalid JSON in request body'}, status=400)
+
+    except Exception as e:
+        return JsonResponse({'error': f'An error occurred: {str(e)}'}, status=500)
+
+
+@require_http_methods(["GET"])
+def llm_job_status_view(request: HttpRequest, job_id: str) -> JsonResponse:
+    """
+    API endpoint to poll a background LLM job.
+
+    Args:
+        request (HttpRequest): The HTTP request object.
+        job_id (str): The id returned by llm_job_create_view.
+
+    Returns:
+        JsonResponse: The job's 'job_id', 'status' (queued, running, done,
+            failed or cancelled) and 'result', which holds the usual
+            {'success', 'response', 'error'} object once the job finished.
+
+            Status codes:
+            - 200: The job is known.
+            - 404: Unknown job id or the result expired.
+    """
+    job: Optional[LLMJobStatus] = get_llm_job(job_id)
+    if job is None:
+        return JsonResponse({'error': 'Job not found or expired'}, status=404)
+    return JsonResponse(job)
+
+
+@csrf_exempt
+@require_http_methods(["POST"])
+def llm_job_cancel_view(request: HttpRequest, job_id: str) -> JsonResponse:
+    """
+    API endpoint to cancel a queued or running LLM job.
+
+    Args:
+        request (HttpRequest): The HTTP request object.
+        job_id (str): The id returned by llm_job_create_view.
+
+    Returns:
+        JsonResponse: The job's status after the call.
+
+            Status codes:
+            - 200: The job is cancelled.
+            - 404: Unknown job id or the result expired.
+            - 409: The job already finished; its status is returned unchanged.
+    """
+    job: Optional[LLMJobStatus] = cancel_llm_job(job_id)
+    if job is None:
+        return JsonResponse({'error': 'Job not found or expired'}, status=404)
+    return JsonResponse(job, status=200 if job['status'] == 'cancelled' else 409)
+
+
+def get_user_conversation(request: HttpRequest, conversation_id) -> Optional[Conversation]:
+    """
+    Return the conversation if the requesting user may use it.
+
+    Anonymous conversations are open to anyone with the id; a user's
+    conversation only to that user. Others are reported as missing.
+    """
+    conversation: Optional[Conversation] = Conversation.objects.filter(pk=conversation_id).first()
+    if conversation is None or (conversation.user_id is not None and conversation.user_id != request.user.id):
+        return None
+    return conversation
+
+
+@csrf_exempt
+@require_http_methods(["POST"])
+def llm_conversation_create_view(request: HttpRequest) -> JsonResponse:
+    """
+    API endpoint to start a server-side LLM conversation.
+
+    Expects an optional JSON body with 'system_message' and 'summarize'
+    (whether older turns are compacted into a summary). The conversation
+    belongs to the logged-in user, if any.
+
+    Args:
+        request (HttpRequest): The HTTP request object.
+
+    Returns:
+        JsonResponse: The new 'conversation_id' and its 'messages_url'.
+
+            Status codes:
+            - 201: The conversation was created.
+            - 400: Invalid JSON in request body.
+    """
+    try:
+        data: dict[str, Any] = json.loads(request.body or b'{}')
+    except json.JSONDecodeError:
+        return JsonResponse({'error': 'Invalid JSON in request body'}, status=400)
+
+    summarize: Optional[bool] = data.get('summarize')
+    conversation: Conversation = create_conversation(
+        request.user,
+        system_message=data.get('system_message') or "",
+        summarize=None if summarize is None else bool(summarize),
+    )
+    return JsonResponse({
+        'conversation_id': str(conversation.pk),
+        'messages_url': reverse('llm-conversation-messages', args=[conversation.pk]),
+    }, status=201)
+
+
+@csrf_exempt
+@require_http_methods(["GET", "DELETE"])
+def llm_conversation_detail_view(request: HttpRequest, conversation_id) -> JsonResponse:
+    """
+    API endpoint to read (GET) or delete (DELETE) a conversation.
+
+    Args:
+        request (HttpRequest): The HTTP request object.
+        conversation_id: The id returned by llm_conversation_create_view.
+
+    Returns:
+        JsonResponse: For GET, the 'summary' of compacted turns and every
+            stored message as {'role', 'content', 'summarized', 'created_at'}.
+
+            Status codes:
+            - 200: The conversation was returned or deleted.
+            - 404: Unknown conversation, or it belongs to another user.
+    """
+    conversation: Optional[Conversation] = get_user_conversation(request, conversation_id)
+    if conversation is None:
+        return JsonResponse({'error': 'Conversation not found'}, status=404)
+    if request.method == 'DELETE':
+        conversation.delete()
+        return JsonResponse({'success': True})
+
+    messages = conversation.messages.values('role', 'content', 'summarized', 'created_at')
+    return JsonResponse({
+        'conversation_id': str(conversation.pk),
+        'system_message': conversation.system_message,
+        'summary': conversation.summary,
+        'messages': list(messages),
+    })
+
+
+@csrf_exempt
+@require_http_methods(["POST"])
+def llm_conversation_message_view(request: HttpRequest, conversation_id) -> JsonResponse:
+    """
+    API endpoint to send the next user turn of a conversation.
+
+    Expects a JSON body with 'prompt' (only the new turn; the history is kept
+    on the server) and an optional 'temperature'. The model sees a context
+    bounded by LLM_CONVERSATION_CONTEXT_TOKENS, see llm_conversations.
+
+    Args:
+        request (HttpRequest): The HTTP request object containing the JSON body.
+        conversation_id: The id returned by llm_conversation_create_view.
+
+    Returns:
+        JsonResponse: 'success', 'response', 'error' and 'context_tokens', the
+            estimated tokens sent upstream for this turn.
+
+            Status codes:
+            - 200: The model answered.
+            - 400: Invalid JSON, missing 'prompt' or a prompt longer than
+              LLM_CONVERSATION_MAX_TURN_TOKENS.
+            - 404: Unknown conversation, or it belongs to another user.
+            - 502: The upstream call failed; the turn was not stored.
+            - 503: Upstream capacity exhausted; retry after the number of
+              seconds in the Retry-After header.
+    """
+    conversation: Optional[Conversation] = get_user_conversation(request, conversation_id)
+    if conversation is None:
+        return JsonResponse({'error': 'Conversation not found'}, status=404)
+    try:
+        data: dict[str, Any] = json.loads(request.body)
+    except json.JSONDecodeError:
+        return JsonResponse({'error': 'Invalid JSON in request body'}, status=400)
+
+    prompt: Optional[str] = data.get('prompt')
+    if not prompt:
+        return JsonResponse({'error': 'prompt field is required'}, status=400)
+    max_turn_tokens: int = getattr(settings, 'LLM_CONVERSATION_MAX_TURN_TOKENS', 2000)
+    if estimate_tokens(prompt) > max_turn_tokens:
+        return JsonResponse({'error': f'prompt exceeds {max_turn_tokens} tokens'}, status=400)
+
+    result: TurnResult = send_turn(conversation, prompt, temperature=data.get('temperature', 0.0))
+    if 'retry_after' in result:
+        return llm_overloaded_response(result)
+    return JsonResponse(result, status=200 if result['success'] else 502)
+
+
+def parse_top_k(value: Any) -> int:
+    """
+    Validate the number of chunks requested from the retrieval index.
+
+    Raises:
+        ValueError: If it is not an integer between 1 and LLM_RETRIEVAL_MAX_K.
+    """
+    max_k: int = getattr(settings, 'LLM_RETRIEVAL_MAX_K', 20)
+    k: int = int(value) if value not in (None, '') else getattr(settings, 'LLM_RETRIEVAL_TOP_K', 4)
+    if not 1 <= k <= max_k:
+        raise ValueError(f'k must be between 1 and {max_k}')
+    return k
+
+
+def get_readable_item_ids(user, item_id: Optional[int] = None) -> Optional[QuerySet]:
+    """
+    Return the ids of the items whose documents the user may read.
+
+    Staff may read every item (None, no restriction); other users the items
+    they were notified about or commented on. With ``item_id``, only that
+    item is kept, so an item the user may not read yields no ids.
+    """
+    if user.is_staff:
+        return None if item_id is None else BusinessLogicModel.objects.filter(pk=item_id).values('pk')
+    items: QuerySet = BusinessLogicModel.objects.filter(
+        Q(webnotifications__user=user) | Q(businessmodelcomments__author=user)
+    )
+    if item_id is not None:
+        items = items.filter(pk=item_id)
+    return items.values('pk')
+
+
+@require_http_methods(["GET"])
+def llm_document_search_view(request: HttpRequest) -> JsonResponse:
+    """
+    API endpoint returning the top-k document chunks for a query.
+
+    Query parameters: 'q' (required), 'k' and 'item_id' (only documents of
+    that item). Only documents of items the user may read are searched, see
+    get_readable_item_ids.
+
+    Args:
+        request (HttpRequest): The HTTP request object.
+
+    Returns:
+        JsonResponse: 'results', a list of {'document_id', 'chunk_id',
+            'position', 'text', 'score'}, best first.
+
+            Status codes:
+            - 200: Search done (the list may be empty).
+            - 400: Missing 'q' or invalid 'k'/'item_id'.
+            - 401: Not logged in.
+    """
+    if not request.user.is_authenticated:
+        return JsonResponse({'error': 'Authentication required'}, status=401)
+    query: str = request.GET.get('q', '').strip()
+    if not query:
+        return JsonResponse({'error': 'q parameter is required'}, status=400)
+    try:
+        k: int = parse_top_k(request.GET.get('k'))
+        item_id: Optional[int] = int(request.GET['item_id']) if request.GET.get('item_id') else None
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    results: list[RetrievedChunk] = search(query, get_readable_item_ids(request.user, item_id), k)
+    return JsonResponse({'results': results})
+
+
+@require_http_methods(["POST"])
+def llm_document_answer_view(request: HttpRequest) -> JsonResponse:
+    """
+    API endpoint answering a question from the uploaded documents.
+
+    Expects a JSON body with 'question' and optional 'k', 'item_id' and
+    'temperature'. Only the top-k chunks of the retrieval index are sent to
+    the model, see llm_retrieval.answer_question, and only from documents of
+    items the user may read. As the view spends model quota on behalf of a
+    logged-in user, it keeps Django's CSRF protection.
+
+    Args:
+        request (HttpRequest): The HTTP request object containing the JSON body.
+
+    Returns:
+        JsonResponse: 'success', 'response', 'error' and 'sources' (the
+            chunks the answer is based on).
+
+            Status codes:
+            - 200: The model answered.
+            - 400: Invalid JSON, missing 'question' or invalid 'k'/'item_id'.
+            - 401: Not logged in.
+            - 404: No indexed chunk the user may read matches the question.
+            - 502: The upstream call failed.
+            - 503: Upstream capacity exhausted; retry after the number of
+              seconds in the Retry-After header.
+    """
+    if not request.user.is_authenticated:
+        return JsonResponse({'error': 'Authentication required'}, status=401)
+    try:
+        data: dict[str, Any] = json.loads(request.body)
+    except json.JSONDecodeError:
+        return JsonResponse({'error': 'Invalid JSON in request body'}, status=400)
+    question: Optional[str] = data.get('question')
+    if not question:
+        return JsonResponse({'error': 'question field is required'}, status=400)
+    try:
+        k: int = parse_top_k(data.get('k'))
+        item_id: Optional[int] = int(data['item_id']) if data.get('item_id') is not None else None
+    except (TypeError, ValueError) as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    answer: GroundedAnswer = answer_question(question, get_readable_item_ids(request.user, item_id), k,
+                                            temperature=data.get('temperature', 0.0))
+    if 'retry_after' in answer:
+        return llm_overloaded_response(answer)
+    if not answer['sources']:
+        return JsonResponse(answer, status=404)
+    return JsonResponse(answer, status=200 if answer['success'] else 502)
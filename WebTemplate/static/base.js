@@ -26,3 +26,35 @@ document.addEventListener('DOMContentLoaded', () => {
     console.warn('Mobile menu elements not found in DOM.')
   }
 })
+
+// Live notification badge: elements marked with data-unread-badge are
+// incremented when the server pushes a new notification over the WebSocket.
+document.addEventListener('DOMContentLoaded', () => {
+  const badges = document.querySelectorAll('[data-unread-badge]')
+  if (!badges.length || !('WebSocket' in window)) {
+    return
+  }
+
+  const scheme = window.location.protocol === 'https:' ? 'wss' : 'ws'
+  let retryDelay = 1000
+
+  const connect = () => {
+    const socket = new WebSocket(`${scheme}://${window.location.host}/ws/notifications/`)
+    socket.addEventListener('open', () => {
+      retryDelay = 1000
+    })
+    socket.addEventListener('message', () => {
+      badges.forEach((badge) => {
+        badge.textContent = (parseInt(badge.textContent, 10) || 0) + 1
+      })
+    })
+    socket.addEventListener('close', (event) => {
+      if (event.code === 4401) {
+        return // Not logged in
+      }
+      setTimeout(connect, retryDelay)
+      retryDelay = Math.min(retryDelay * 2, 30000)
+    })
+  }
+  connect()
+})
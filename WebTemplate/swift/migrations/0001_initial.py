@@ -0,0 +1,37 @@
+# Generated by Django 5.2 on 2026-10-18 09:32
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DevicesDB',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('email', models.CharField(max_length=30)),
+                ('device_id', models.CharField(max_length=250)),
+                ('user_id', models.PositiveIntegerField()),
+                ('device_type', models.CharField(max_length=30)),
+                ('company', models.CharField(max_length=30)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='SwiftNotificationSettings',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('notification_types', models.JSONField(default=list)),
+                ('device', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='swift.devicesdb')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.2 on 2026-10-18 09:32
+
+from django.db import migrations, models
+from django.db.models import Count, Max
+
+
+def remove_duplicate_devices(apps, schema_editor):
+    # register_device used to create duplicate rows; keep the newest one of every registration
+    DevicesDB = apps.get_model('swift', 'DevicesDB')
+    duplicates = (DevicesDB.objects.values('user_id', 'device_type', 'device_id')
+                  .annotate(newest=Max('id'), rows=Count('id')).filter(rows__gt=1))
+    for duplicate in duplicates:
+        DevicesDB.objects.filter(
+            user_id=duplicate['user_id'], device_type=duplicate['device_type'], device_id=duplicate['device_id'],
+        ).exclude(id=duplicate['newest']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('swift', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='devicesdb',
+            index=models.Index(fields=['email', 'device_type'], name='devices_email_type_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='devicesdb',
+            index=models.Index(fields=['company'], name='devices_company_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='devicesdb',
+            index=models.Index(fields=['device_id'], name='devices_device_id_idx'),
+        ),
+        migrations.RunPython(remove_duplicate_devices, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='devicesdb',
+            constraint=models.UniqueConstraint(fields=('user_id', 'device_type', 'device_id'), name='unique_device_registration'),
+        ),
+    ]
@@ -1,5 +1,7 @@
-from django.db import models
+from django.db import models, transaction
 from django.conf import settings
+from django.dispatch import receiver
+from django.db.models.signals import post_save, post_delete
 
 User = settings.AUTH_USER_MODEL
 
@@ -11,6 +13,26 @@ class DevicesDB(models.Model):
     device_type = models.CharField(max_length=30)
     company = models.CharField(max_length=30)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['email', 'device_type'], name='devices_email_type_idx'),
+            models.Index(fields=['company'], name='devices_company_idx'),
+            models.Index(fields=['device_id'], name='devices_device_id_idx'),
+        ]
+        constraints = [
+            # Also serves lookups by user_id and (user_id, device_type)
+            models.UniqueConstraint(fields=['user_id', 'device_type', 'device_id'], name='unique_device_registration'),
+        ]
+
+
+@receiver(post_save, sender=DevicesDB)
+@receiver(post_delete, sender=DevicesDB)
+def invalidate_device_token_cache(sender, instance, **kwargs):
+    from .token_cache import invalidate_user_tokens
+    invalidate_user_tokens([instance.user_id])
+    # Again once committed: a reader may have cached the old rows in between
+    transaction.on_commit(lambda: invalidate_user_tokens([instance.user_id]))
+
 
 class SwiftNotificationSettings(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
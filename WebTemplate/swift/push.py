@@ -0,0 +1,136 @@
+"""
+Push notification service for registered mobile devices.
+
+Tokens of all target devices are resolved with one query and sent through
+Firebase Cloud Messaging in multicast batches of up to ``FCM_MULTICAST_LIMIT``
+tokens, so a company-wide push costs one API round-trip per 500 devices
+instead of one per device.
+
+Typical usage example:
+
+    tokens = resolve_tokens(user_ids=[1, 2, 3])
+    results = send_multicast(tokens, title="Board", body="Новое оповещение")
+    failed = [result['token'] for result in results if not result['success']]
+"""
+
+import logging
+from typing import Any, Iterable, Optional, TypedDict
+
+from django.conf import settings
+from firebase_admin import messaging
+
+from .models import DevicesDB
+from .token_cache import get_tokens_for_users
+
+
+logger = logging.getLogger(__name__)
+
+# Hard limit of tokens per multicast request imposed by FCM.
+FCM_MULTICAST_LIMIT: int = 500
+
+
+class TokenResult(TypedDict):
+    """
+    Delivery result of one device token.
+
+    Attributes:
+        token: The FCM registration token.
+        success: True if FCM accepted the message for this device.
+        message_id: FCM message id on success, otherwise None.
+        error: Error description on failure, otherwise None.
+        unregistered: True if FCM reported the token as no longer valid.
+    """
+
+    token: str
+    success: bool
+    message_id: Optional[str]
+    error: Optional[str]
+    unregistered: bool
+
+
+def resolve_tokens(user_ids: Optional[Iterable[int]] = None, company: Optional[str] = None) -> list[str]:
+    """
+    Return the unique FCM tokens of a set of users and/or a whole company.
+
+    Lookups by user go through the two-tier token cache and normally do not
+    touch the database; company-wide lookups use one indexed query.
+
+    Args:
+        user_ids: Restrict to devices of these users.
+        company: Restrict to devices of this company domain.
+
+    Returns:
+        list[str]: Distinct registration tokens. Empty if neither filter is given.
+    """
+    if user_ids is not None:
+        tokens: dict[str, None] = {}
+        for devices in get_tokens_for_users(user_ids).values():
+            for token, device_company in devices:
+                if company is None or device_company == company:
+                    tokens[token] = None
+        return list(tokens)
+    if company is not None:
+        return list(DevicesDB.objects.filter(company=company).order_by().values_list('device_id', flat=True).distinct())
+    return []
+
+
+def prune_unregistered_tokens(results: list["TokenResult"]) -> int:
+    """
+    Delete the devices whose tokens FCM reported as unregistered.
+
+    Deleting the rows also drops the owners' cached tokens through the
+    DevicesDB post_delete signal.
+
+    Args:
+        results: Per-token results returned by ``send_multicast``.
+
+    Returns:
+        int: Number of device rows deleted.
+    """
+    dead_tokens: list[str] = [result['token'] for result in results if result['unregistered']]
+    if not dead_tokens:
+        return 0
+    deleted, _ = DevicesDB.objects.filter(device_id__in=dead_tokens).delete()
+    logger.info("Pruned %s unregistered device tokens", len(dead_tokens))
+    return deleted
+
+
+def send_multicast(tokens: list[str], title: str, body: str, data: Optional[dict[str, str]] = None) -> list[TokenResult]:
+    """
+    Send one notification to many devices in multicast batches.
+
+    Args:
+        tokens: FCM registration tokens.
+        title: Notification title.
+        body: Notification body.
+        data: Optional data payload; FCM requires string values.
+
+    Returns:
+        list[TokenResult]: One result per token, in the order of ``tokens``.
+    """
+    results: list[TokenResult] = []
+    app: Any = getattr(settings, 'FIREBASE_APP', None)
+    for start in range(0, len(tokens), FCM_MULTICAST_LIMIT):
+        batch: list[str] = tokens[start:start + FCM_MULTICAST_LIMIT]
+        message = messaging.MulticastMessage(
+            tokens=batch,
+            notification=messaging.Notification(title=title, body=body),
+            data=data,
+        )
+        try:
+            response = messaging.send_each_for_multicast(message, app=app)
+        except Exception as e:
+            # The whole batch failed (auth, network); report it per token
+            logger.error("FCM multicast batch of %s tokens failed: %s", len(batch), e)
+            results.extend({'token': token, 'success': False, 'message_id': None, 'error': str(e), 'unregistered': False}
+                           for token in batch)
+            continue
+        for token, send_response in zip(batch, response.responses):
+            results.append({
+                'token': token,
+                'success': send_response.success,
+                'message_id': send_response.message_id,
+                'error': str(send_response.exception) if send_response.exception else None,
+                'unregistered': isinstance(send_response.exception, messaging.UnregisteredError),
+            })
+    return results
@@ -0,0 +1,44 @@
+"""
+Celery tasks for mobile push notifications.
+
+Sending to FCM happens here rather than inside the HTTP request, so views only
+enqueue the push and return immediately.
+"""
+
+import logging
+from typing import Optional
+
+from celery import shared_task
+
+from .push import TokenResult, prune_unregistered_tokens, resolve_tokens, send_multicast
+
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task
+def send_push_notification(title: str, body: str, user_ids: Optional[list[int]] = None,
+                           company: Optional[str] = None, data: Optional[dict[str, str]] = None) -> list[TokenResult]:
+    """
+    Send a push notification to every device of a set of users or of a company.
+
+    Args:
+        title: Notification title.
+        body: Notification body.
+        user_ids: Target users. Combined with ``company`` when both are given.
+        company: Target company domain.
+        data: Optional string-valued data payload.
+
+    Returns:
+        list[TokenResult]: Per-token delivery results. Devices whose tokens FCM
+        reported as unregistered are deleted afterwards.
+    """
+    tokens: list[str] = resolve_tokens(user_ids=user_ids, company=company)
+    if not tokens:
+        logger.info("No devices found for push (users=%s, company=%s)", user_ids, company)
+        return []
+    results: list[TokenResult] = send_multicast(tokens, title, body, data)
+    failed: int = sum(1 for result in results if not result['success'])
+    logger.info("Push sent to %s devices, %s failed", len(results), failed)
+    prune_unregistered_tokens(results)
+    return results
@@ -1,3 +1,127 @@
-from django.test import TestCase
+from django.contrib.auth.models import User
+from django.test import RequestFactory, TestCase
+from unittest.mock import MagicMock, patch
+from firebase_admin import messaging
+import fakeredis
+import json
 
-# Create your tests here.
+from WebTemplate.redis_client import set_redis
+from .models import DevicesDB
+from .push import resolve_tokens, send_multicast
+from .tasks import send_push_notification
+from . import token_cache
+from .token_cache import get_tokens_for_users, local_cache
+from .views import register_device
+
+
+def _multicast_response(message, app=None):
+    responses = []
+    for token in message.tokens:
+        response = MagicMock(success=not token.startswith('dead'), message_id=f"id-{token}", exception=None)
+        if token.startswith('dead'):
+            response.message_id = None
+            response.exception = messaging.UnregisteredError('Requested entity was not found.')
+        responses.append(response)
+    return MagicMock(responses=responses)
+
+
+class PushServiceTests(TestCase):
+    def setUp(self):
+        set_redis(fakeredis.FakeRedis())
+        self.addCleanup(set_redis, None)
+        local_cache.clear()
+        self.addCleanup(local_cache.clear)
+        for i in range(3):
+            DevicesDB.objects.create(email=f"user{i}@acme.ru", device_id=f"token-{i}", user_id=i + 1, device_type="ios", company="acme.ru")
+        DevicesDB.objects.create(email="other@other.ru", device_id="token-other", user_id=10, device_type="android", company="other.ru")
+
+    def test_resolve_tokens(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(sorted(resolve_tokens(company="acme.ru")), ["token-0", "token-1", "token-2"])
+        self.assertEqual(sorted(resolve_tokens(user_ids=[1, 10])), ["token-0", "token-other"])
+        self.assertEqual(resolve_tokens(user_ids=[1, 10], company="other.ru"), ["token-other"])
+        self.assertEqual(resolve_tokens(), [])
+
+    @patch('swift.push.messaging.send_each_for_multicast', side_effect=_multicast_response)
+    def test_send_multicast_batches_of_500(self, mock_send):
+        tokens = [f"token-{i}" for i in range(1100)] + ["dead-token"]
+        results = send_multicast(tokens, "title", "body")
+        self.assertEqual(mock_send.call_count, 3)
+        self.assertEqual([len(call.args[0].tokens) for call in mock_send.call_args_list], [500, 500, 101])
+        self.assertEqual(len(results), 1101)
+        self.assertEqual(results[0], {'token': 'token-0', 'success': True, 'message_id': 'id-token-0', 'error': None, 'unregistered': False})
+        self.assertFalse(results[-1]['success'])
+        self.assertTrue(results[-1]['unregistered'])
+
+    @patch('swift.push.messaging.send_each_for_multicast', side_effect=RuntimeError("network down"))
+    def test_send_multicast_batch_failure_reported_per_token(self, mock_send):
+        results = send_multicast(["token-0", "token-1"], "title", "body")
+        self.assertEqual([result['error'] for result in results], ["network down", "network down"])
+
+    @patch('swift.push.messaging.send_each_for_multicast', side_effect=_multicast_response)
+    def test_send_push_notification_task(self, mock_send):
+        results = send_push_notification("title", "body", company="acme.ru")
+        self.assertEqual(mock_send.call_count, 1)
+        self.assertEqual(len(results), 3)
+        self.assertTrue(all(result['success'] for result in results))
+
+    @patch('swift.push.messaging.send_each_for_multicast', side_effect=_multicast_response)
+    def test_unregistered_tokens_are_pruned(self, mock_send):
+        DevicesDB.objects.create(email="user0@acme.ru", device_id="dead-token", user_id=1, device_type="android", company="acme.ru")
+        self.assertEqual(sorted(resolve_tokens(user_ids=[1])), ["dead-token", "token-0"])
+        send_push_notification("title", "body", user_ids=[1])
+        self.assertFalse(DevicesDB.objects.filter(device_id="dead-token").exists())
+        self.assertEqual(resolve_tokens(user_ids=[1]), ["token-0"])
+
+
+class DeviceTokenCacheTests(TestCase):
+    def setUp(self):
+        self.redis = fakeredis.FakeRedis()
+        set_redis(self.redis)
+        self.addCleanup(set_redis, None)
+        local_cache.clear()
+        self.addCleanup(local_cache.clear)
+        DevicesDB.objects.create(email="a@acme.ru", device_id="token-a", user_id=1, device_type="ios", company="acme.ru")
+
+    def test_hot_path_skips_database(self):
+        self.assertEqual(get_tokens_for_users([1, 2]), {1: [("token-a", "acme.ru")], 2: []})
+        with self.assertNumQueries(0):
+            self.assertEqual(resolve_tokens(user_ids=[1, 2]), ["token-a"])
+        local_cache.clear()
+        with self.assertNumQueries(0):
+            self.assertEqual(resolve_tokens(user_ids=[1]), ["token-a"])
+
+    def test_registration_invalidates_cache(self):
+        resolve_tokens(user_ids=[1])
+        DevicesDB.objects.create(email="a@acme.ru", device_id="token-b", user_id=1, device_type="android", company="acme.ru")
+        self.assertEqual(sorted(resolve_tokens(user_ids=[1])), ["token-a", "token-b"])
+
+    def test_stale_read_is_not_cached(self):
+        load_from_db = token_cache._load_from_db
+
+        def load_then_register(user_ids):
+            loaded = load_from_db(user_ids)
+            DevicesDB.objects.create(email="a@acme.ru", device_id="token-b", user_id=1, device_type="android", company="acme.ru")
+            return loaded
+
+        with patch('swift.token_cache._load_from_db', side_effect=load_then_register):
+            self.assertEqual(get_tokens_for_users([1]), {1: [("token-a", "acme.ru")]})
+        self.assertIsNone(self.redis.get(f"{token_cache.KEY_PREFIX}1"))
+        self.assertEqual(sorted(resolve_tokens(user_ids=[1])), ["token-a", "token-b"])
+
+    def _register(self, token):
+        user = User.objects.get_or_create(username="b", email="b@acme.ru")[0]
+        body = {"registration_id": token, "device_type": "ios", "user_id": user.id, "email": "b@acme.ru"}
+        return register_device(RequestFactory().post('/', json.dumps(body), content_type='application/json'))
+
+    @patch('swift.views.FCMDevice')
+    def test_register_device(self, mock_fcm_device):
+        self.assertEqual(self._register("token-x").status_code, 200)
+        self.assertEqual(self._register("token-x").status_code, 400)
+        self.assertEqual(self._register("token-y").status_code, 200)
+        self.assertEqual(list(DevicesDB.objects.filter(email="b@acme.ru").values_list('device_id', flat=True)), ["token-y"])
+
+    def test_uniqueness_constraint(self):
+        from django.db import IntegrityError, transaction
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            DevicesDB.objects.create(email="a@acme.ru", device_id="token-a", user_id=1, device_type="ios", company="acme.ru")
@@ -0,0 +1,161 @@
+"""
+Two-tier cache of device tokens per user.
+
+Push sending resolves FCM tokens by user id on every notification. This module
+keeps the mapping ``user_id -> [(token, company), ...]`` in:
+
+    1. A process-local LRU (``DEVICE_TOKEN_LOCAL_CACHE_SIZE`` entries, expiring
+       after ``DEVICE_TOKEN_LOCAL_TTL`` seconds), answered without any I/O.
+    2. Redis (``device_tokens:<user_id>``, ``DEVICE_TOKEN_CACHE_TTL`` seconds),
+       shared by all workers and fetched with one MGET for many users.
+    3. The database, queried once for all remaining users.
+
+Entries are invalidated whenever a DevicesDB row is saved or deleted, which
+covers ``register_device`` and token pruning. Other processes drop their local
+copy after the short local TTL. Redis errors fall back to the database.
+
+Every invalidation also bumps the user's generation
+(``device_tokens:generation:<user_id>``). A reader caches what it loaded from
+the database only if the generation is still the one it saw before the
+query, so a slow reader never writes tokens back over a newer invalidation.
+"""
+
+import json
+import logging
+from typing import Iterable, Optional
+
+from django.conf import settings
+from redis.exceptions import RedisError
+
+from WebTemplate.local_cache import LocalLRUCache
+from WebTemplate.redis_client import get_redis
+
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX: str = "device_tokens:"
+GENERATION_PREFIX: str = "device_tokens:generation:"
+
+# Cache the tokens only if the generation did not change since they were read
+_SET_IF_GENERATION: str = """
+if (redis.call('GET', KEYS[2]) or '0') == ARGV[1] then
+    redis.call('SET', KEYS[1], ARGV[2], 'EX', ARGV[3])
+    return 1
+end
+return 0
+"""
+
+# (token, company) pairs of one user
+DeviceTokens = list[tuple[str, str]]
+
+
+local_cache: LocalLRUCache[int, DeviceTokens] = LocalLRUCache(
+    max_size=getattr(settings, 'DEVICE_TOKEN_LOCAL_CACHE_SIZE', 10000),
+    ttl=getattr(settings, 'DEVICE_TOKEN_LOCAL_TTL', 60),
+)
+
+
+def _key(user_id: int) -> str:
+    return f"{KEY_PREFIX}{user_id}"
+
+
+def _generation_key(user_id: int) -> str:
+    return f"{GENERATION_PREFIX}{user_id}"
+
+
+def _load_from_db(user_ids: list[int]) -> dict[int, DeviceTokens]:
+    from .models import DevicesDB
+    tokens: dict[int, DeviceTokens] = {user_id: [] for user_id in user_ids}
+    rows = DevicesDB.objects.filter(user_id__in=user_ids).order_by('id').values_list('user_id', 'device_id', 'company')
+    for user_id, device_id, company in rows:
+        if (device_id, company) not in tokens[user_id]:
+            tokens[user_id].append((device_id, company))
+    return tokens
+
+
+def get_tokens_for_users(user_ids: Iterable[int]) -> dict[int, DeviceTokens]:
+    """
+    Return the (token, company) pairs of every user, reading through both cache tiers.
+
+    Args:
+        user_ids: The users to resolve.
+
+    Returns:
+        dict[int, DeviceTokens]: User id mapped to that user's devices;
+        users without devices map to an empty list.
+    """
+    result: dict[int, DeviceTokens] = {}
+    missing: list[int] = []
+    for user_id in dict.fromkeys(int(user_id) for user_id in user_ids):
+        cached: Optional[DeviceTokens] = local_cache.get(user_id)
+        if cached is None:
+            missing.append(user_id)
+        else:
+            result[user_id] = cached
+    if not missing:
+        return result
+
+    redis_client = get_redis()
+    try:
+        raw_values = redis_client.mget([_key(user_id) for user_id in missing]
+                                       + [_generation_key(user_id) for user_id in missing])
+        raw_tokens, generations = raw_values[:len(missing)], dict(zip(missing, raw_values[len(missing):]))
+    except RedisError as e:
+        logger.warning("Device token cache read failed: %s", e)
+        raw_tokens, generations = [None] * len(missing), None
+
+    from_db: list[int] = []
+    for user_id, raw in zip(missing, raw_tokens):
+        if raw is None:
+            from_db.append(user_id)
+            continue
+        tokens: DeviceTokens = [tuple(pair) for pair in json.loads(raw)]
+        local_cache.set(user_id, tokens)
+        result[user_id] = tokens
+
+    if from_db:
+        loaded: dict[int, DeviceTokens] = _load_from_db(from_db)
+        for user_id, tokens in loaded.items():
+            local_cache.set(user_id, tokens)
+        if generations is not None:
+            _write_back(redis_client, loaded, generations)
+        result.update(loaded)
+    return result
+
+
+def _write_back(redis_client, loaded: dict[int, DeviceTokens], generations: dict[int, Optional[bytes]]) -> None:
+    """Cache tokens read from the database in Redis unless they were invalidated since."""
+    ttl: int = getattr(settings, 'DEVICE_TOKEN_CACHE_TTL', 3600)
+    try:
+        pipe = redis_client.pipeline(transaction=False)
+        for user_id, tokens in loaded.items():
+            generation: str = (generations[user_id] or b'0').decode()
+            pipe.eval(_SET_IF_GENERATION, 2, _key(user_id), _generation_key(user_id), generation,
+                      json.dumps(tokens), ttl)
+        written: list[int] = pipe.execute()
+    except RedisError as e:
+        logger.warning("Device token cache write failed: %s", e)
+        return
+    for user_id, was_written in zip(loaded, written):
+        if not was_written:
+            # Invalidated while the rows were read; the local copy may be stale too
+            local_cache.delete(user_id)
+
+
+def invalidate_user_tokens(user_ids: Iterable[int]) -> None:
+    """Drop the cached devices of ``user_ids`` from both tiers and bump their generations."""
+    user_ids = [int(user_id) for user_id in user_ids]
+    if not user_ids:
+        return
+    for user_id in user_ids:
+        local_cache.delete(user_id)
+    try:
+        pipe = get_redis().pipeline(transaction=True)
+        for user_id in user_ids:
+            pipe.incr(_generation_key(user_id))
+            # Only has to outlive a database read in get_tokens_for_users
+            pipe.expire(_generation_key(user_id), getattr(settings, 'DEVICE_TOKEN_CACHE_TTL', 3600))
+        pipe.delete(*[_key(user_id) for user_id in user_ids])
+        pipe.execute()
+    except RedisError as e:
+        logger.warning("Device token cache invalidation failed: %s", e)
@@ -11,16 +11,17 @@ from typing import Any, Dict
 
 from django.contrib.auth import authenticate
 from django.contrib.auth import logout
+from django.db import transaction
 from django.forms.models import model_to_dict
 from django.http import JsonResponse, HttpResponse, HttpRequest
 from django.views.decorators.csrf import csrf_exempt
 from fcm_django.models import FCMDevice
-from firebase_admin.messaging import Message, Notification
 from rest_framework import status
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
 
 from .models import DevicesDB, SwiftNotificationSettings
+from .tasks import send_push_notification
 
 
 @csrf_exempt
@@ -127,6 +128,7 @@ def register_device(request: HttpRequest) -> HttpResponse:
         - Creates or updates a DevicesDB record for the device.
         - Creates a SwiftNotificationSettings record for new devices.
         - Creates an FCMDevice record for Firebase Cloud Messaging.
+        - Invalidates the user's cached device tokens (via DevicesDB signals).
 
     Note:
         CSRF protection is disabled for this endpoint to allow mobile app access.
@@ -138,29 +140,25 @@ def register_device(request: HttpRequest) -> HttpResponse:
         device_type: Any = data.get("device_type")
         user_id: Any = data.get("user_id")
         email: Any = data.get("email")
-        # Debug logging for device registration data
-        print(registration_id)
-        print(device_type)
-        print(user_id)
-        print(email)
 
         # Extract company domain from email address
         company: str = email.split("@")[1]
-        # Check if device already exists for this user/email/device_type combination
-        existing_device: DevicesDB | None = DevicesDB.objects.filter(email=email, user_id=user_id, device_type=device_type, company=email.split("@")[1]).first()
-        if existing_device and existing_device.device_id == registration_id:
-            # Device already registered with same token - no action needed
-            return JsonResponse({"message": "Device already registered."}, status=400)
-        elif existing_device and existing_device.device_id != registration_id:
-            # Device exists but token changed - delete old record and create new one
-            existing_device.delete()
-            device: DevicesDB = DevicesDB.objects.create(email=email, device_id=registration_id, user_id=user_id, device_type=device_type, company=company)
-        else:
-            # New device registration
-            device = DevicesDB.objects.create(email=email, device_id=registration_id, user_id=user_id, device_type=device_type, company=company)
-
-        # Create default notification settings for the newly registered device
-        SwiftNotificationSettings.objects.create(device_id=device.id)
+        with transaction.atomic():
+            # get_or_create reuses the row if a concurrent registration of the same
+            # device wins the race and this insert hits unique_device_registration
+            device, created = DevicesDB.objects.get_or_create(
+                user_id=user_id, device_type=device_type, device_id=registration_id,
+                defaults={'email': email, 'company': company},
+            )
+            if not created:
+                # Device already registered with same token - no action needed
+                return JsonResponse({"message": "Device already registered."}, status=400)
+            # A new token replaces the previous registration of this user/email/device_type combination
+            DevicesDB.objects.filter(email=email, user_id=user_id, device_type=device_type, company=company).exclude(
+                pk=device.pk).delete()
+
+            # Create default notification settings for the newly registered device
+            SwiftNotificationSettings.objects.create(user_id=user_id, device_id=device.id)
 
         # Register device with FCM for push notification delivery
         device = FCMDevice()
@@ -174,39 +172,44 @@ def register_device(request: HttpRequest) -> HttpResponse:
 
 def send_notification(request: HttpRequest, company: str, user_id: int) -> HttpResponse:
     """
-    Send a push notification to a specific user's device.
+    Send a push notification to all devices of a specific user.
 
-    This function sends a Firebase Cloud Messaging notification to a user's
-    registered device, identified by company domain and user ID.
+    The devices are resolved by company domain and user ID and the push is
+    sent in FCM multicast batches by the ``send_push_notification`` Celery
+    task, so the request returns without waiting for Firebase.
 
     Args:
         request: The HTTP request object (currently unused but required for view signature).
         company: The company domain (extracted from user's email) to filter devices.
-        user_id: The ID of the user whose device should receive the notification.
+        user_id: The ID of the user whose devices should receive the notification.
 
     Returns:
-        HttpResponse: Success message if notification was sent successfully.
-        HttpResponse: Error message if no device was found for the user.
-
-    Raises:
-        DevicesDB.DoesNotExist: If no device is found for the given company and user_id.
-        FCMDevice.DoesNotExist: If no FCM device is found for the registration_id.
+        HttpResponse: Confirmation that the notification was queued.
 
     Note:
         The notification title and body are currently hardcoded.
-        There is a typo in the success message ("notificaiton" instead of "notification").
     """
     title: str = "XXXXXXXX"
     body: str = "Новое оповещение"  # Russian: "New notification"
-    # Look up the device in our database by company and user
-    device_db: DevicesDB = DevicesDB.objects.filter(company=company).get(user_id=user_id)
-    # Get the corresponding FCM device for sending the notification
-    device: FCMDevice = FCMDevice.objects.get(registration_id=device_db.device_id)
-    if device:
-        device.send_message(Message(notification=Notification(title=title, body=body)))
-        return HttpResponse("Test notificaiton send successfully.")
-    else:
-        return HttpResponse("No device found for sending the notification.")
+    send_push_notification.delay(title, body, user_ids=[user_id], company=company)
+    return HttpResponse("Test notification queued successfully.")
+
+
+def send_company_notification(request: HttpRequest, company: str) -> HttpResponse:
+    """
+    Send a push notification to every registered device of a company.
+
+    Args:
+        request: The HTTP request object (currently unused but required for view signature).
+        company: The company domain whose devices should receive the notification.
+
+    Returns:
+        HttpResponse: Confirmation that the notification was queued.
+    """
+    title: str = "XXXXXXXX"
+    body: str = "Новое оповещение"  # Russian: "New notification"
+    send_push_notification.delay(title, body, company=company)
+    return HttpResponse("Company notification queued successfully.")
 
 
 def share_preferences(request: HttpRequest, user_id: int, email: str, device_type: str) -> JsonResponse:
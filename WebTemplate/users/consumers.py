@@ -0,0 +1,38 @@
+"""
+WebSocket consumers for the users app.
+
+``NotificationConsumer`` pushes new WebNotifications to the browser as soon as
+they are written, so pages no longer need to poll. Every authenticated
+connection joins the per-user group returned by ``notification_group`` and
+receives the events published by ``users.realtime.publish_notifications``.
+"""
+
+from typing import Any
+
+from channels.generic.websocket import AsyncJsonWebsocketConsumer
+
+
+def notification_group(user_id: int) -> str:
+    """Return the channel layer group name of a user's notification stream."""
+    return f"notifications.{user_id}"
+
+
+class NotificationConsumer(AsyncJsonWebsocketConsumer):
+    """Delivers ``notification.new`` events of the connected user."""
+
+    async def connect(self) -> None:
+        user = self.scope.get("user")
+        if user is None or not user.is_authenticated:
+            # 4401 mirrors HTTP 401 in the application close-code range
+            await self.close(code=4401)
+            return
+        self.group_name: str = notification_group(user.id)
+        await self.channel_layer.group_add(self.group_name, self.channel_name)
+        await self.accept()
+
+    async def disconnect(self, code: int) -> None:
+        if hasattr(self, "group_name"):
+            await self.channel_layer.group_discard(self.group_name, self.channel_name)
+
+    async def notification_new(self, event: dict[str, Any]) -> None:
+        await self.send_json(event["notification"])
@@ -0,0 +1,12 @@
+from typing import Any
+
+from django.http import HttpRequest
+
+from .unread_counter import get_unread_count
+
+
+def unread_notifications(request: HttpRequest) -> dict[str, Any]:
+    """Expose the bell badge count to every template as ``unread_notifications_count``."""
+    if not request.user.is_authenticated:
+        return {}
+    return {"unread_notifications_count": get_unread_count(request.user.id)}
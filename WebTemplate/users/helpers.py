@@ -7,7 +7,8 @@ and managing web notifications.
 from typing import Optional, Union, Tuple, Any
 from yookassa import Payment, Configuration
 import uuid
-from .models import PaymentHistory, Organization, WebNotification
+from .models import PaymentHistory, Organization, WebNotifications
+from .unread_counter import invalidate_unread, reset_unread
 from yookassa import Payment, Configuration
 from yookassa.domain.response import PaymentResponse
 
@@ -144,4 +145,12 @@ def close_item_notifications(arg1: Union[int, Any], arg2: Optional[int] = None)
             filters = {'user_id': arg1}
     else:
         filters = {'user_id': arg1, 'item_id': arg2}
-    WebNotification.objects.filter(**filters).update(is_new=False)
\ No newline at end of file
+    notifications = WebNotifications.objects.filter(is_new=True, **filters)
+    if 'item_id' in filters:
+        # Only some of the users' notifications are closed; rebuild their counters lazily
+        affected_user_ids: list[int] = list(notifications.values_list('user_id', flat=True).distinct())
+        notifications.update(is_new=False)
+        invalidate_unread(affected_user_ids)
+    else:
+        notifications.update(is_new=False)
+        reset_unread([getattr(arg1, 'id', arg1)])
\ No newline at end of file
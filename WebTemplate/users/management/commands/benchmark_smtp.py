@@ -0,0 +1,68 @@
+"""
+Benchmark the pooled SMTP transport against one connection per message.
+
+Usage:
+    python manage.py benchmark_smtp --messages 200
+
+By default a local aiosmtpd server is started on 127.0.0.1 and both
+strategies deliver to it, so no real mail leaves the machine. Pass --host and
+--port to measure against another server without TLS or AUTH.
+"""
+
+import smtplib
+import time
+from typing import Any, Optional
+
+from aiosmtpd.controller import Controller
+from aiosmtpd.handlers import Sink
+from django.core.management.base import BaseCommand, CommandParser
+
+from users.smtp_pool import OutgoingMessage, SMTPConnectionPool
+from users.utlis import build_notification_message
+
+
+class Command(BaseCommand):
+    help = "Report messages/sec for per-message SMTP connections and for the pooled transport."
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument('--messages', type=int, default=200, help="Number of messages per strategy.")
+        parser.add_argument('--host', default=None, help="SMTP host. A local aiosmtpd sink is used if omitted.")
+        parser.add_argument('--port', type=int, default=8025)
+        parser.add_argument('--max-per-connection', type=int, default=100)
+
+    def handle(self, *args: Any, **options: Any) -> None:
+        controller: Optional[Controller] = None
+        host: str = options['host'] or "127.0.0.1"
+        port: int = options['port']
+        if options['host'] is None:
+            controller = Controller(Sink(), hostname=host, port=port)
+            controller.start()
+        try:
+            self._run(host, port, options['messages'], options['max_per_connection'])
+        finally:
+            if controller is not None:
+                controller.stop()
+
+    def _run(self, host: str, port: int, count: int, max_per_connection: int) -> None:
+        body: bytes = build_notification_message(1, "benchmark")
+        recipients: list[str] = [f"user{i}@example.com" for i in range(count)]
+
+        started: float = time.perf_counter()
+        for email_to in recipients:
+            server: smtplib.SMTP = smtplib.SMTP(host, port)
+            server.ehlo()
+            server.sendmail("bench@example.com", email_to, body)
+            server.quit()
+        self._report("connection per message", count, time.perf_counter() - started)
+
+        pool: SMTPConnectionPool = SMTPConnectionPool(host, port, use_tls=False, from_addr="bench@example.com",
+                                                      max_messages_per_connection=max_per_connection)
+        started = time.perf_counter()
+        failures: dict[str, str] = pool.send_batch([OutgoingMessage(to=email_to, body=body) for email_to in recipients])
+        self._report("pooled transport", count - len(failures), time.perf_counter() - started)
+        self.stdout.write(f"  connections opened: {pool.connections_opened}")
+        pool.close_all()
+
+    def _report(self, label: str, messages: int, seconds: float) -> None:
+        rate: float = messages / seconds if seconds > 0 else float(messages)
+        self.stdout.write(f"{label}: {messages} messages in {seconds:.3f}s ({rate:.0f} messages/sec)")
@@ -0,0 +1,23 @@
+"""
+Fix unread notification counters in Redis that drifted from the database.
+
+Usage:
+    python manage.py reconcile_unread_counters
+"""
+
+from typing import Any
+
+from django.core.management.base import BaseCommand, CommandParser
+
+from users.unread_counter import reconcile_unread_counters
+
+
+class Command(BaseCommand):
+    help = "Compare the Redis unread counters with WebNotifications and correct the ones that drifted."
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args: Any, **options: Any) -> None:
+        checked, fixed = reconcile_unread_counters(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Checked {checked} counters, fixed {fixed}."))
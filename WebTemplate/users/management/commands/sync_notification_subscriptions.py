@@ -0,0 +1,27 @@
+"""
+Convert EmailNotificationSettings JSON lists into EmailNotificationSubscription rows,
+deleting rows for types that are no longer selected.
+
+Usage:
+    python manage.py sync_notification_subscriptions
+
+The command is idempotent and runs after ``migrate`` on every container start,
+so existing settings are converted on the first deploy of the subscription table.
+"""
+
+from typing import Any
+
+from django.core.management.base import BaseCommand, CommandParser
+
+from users.utlis import rebuild_email_subscriptions
+
+
+class Command(BaseCommand):
+    help = "Rebuild the indexed email subscription table from notification settings."
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument('--batch-size', type=int, default=2000)
+
+    def handle(self, *args: Any, **options: Any) -> None:
+        pairs: int = rebuild_email_subscriptions(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Synced {pairs} email notification subscriptions."))
@@ -1,7 +1,7 @@
 from django.db import models
 from django.conf import settings
 from django.dispatch import receiver
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete
 from .tasks import send_demo_request_email_task, send_payment_notification_email_task
 from django.utils import timezone
 from main_app.models import BusinessLogicModel
@@ -96,6 +96,8 @@ class WebNotifications(models.Model):
     is_new = models.BooleanField(default=True)
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     notification_type = models.CharField(choices=NotificationTypes.choices, max_length=50, blank=False, null=False, default=NotificationTypes.type_1)
+    created_at = models.DateTimeField(default=timezone.now, db_index=True)
+    event_count = models.PositiveIntegerField(default=1)
 
 
 class EmailNotificationSettings(models.Model):
@@ -104,3 +106,32 @@ class EmailNotificationSettings(models.Model):
 
     def __str__(self):
         return f"{self.user.email}"
+
+
+class EmailNotificationSubscription(models.Model):
+    """One row per (notification type, user) pair; the indexed form of EmailNotificationSettings.notification_types."""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='email_subscriptions')
+    notification_type = models.CharField(choices=NotificationTypes.choices, max_length=50)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['notification_type', 'user'], name='unique_email_subscription'),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id}: {self.notification_type}"
+
+
+@receiver(post_save, sender=EmailNotificationSettings)
+def sync_email_subscriptions(sender, instance, **kwargs):
+    notification_types = {value for value in instance.notification_types or [] if value in NotificationTypes.values}
+    EmailNotificationSubscription.objects.filter(user_id=instance.user_id).exclude(notification_type__in=notification_types).delete()
+    EmailNotificationSubscription.objects.bulk_create(
+        [EmailNotificationSubscription(user_id=instance.user_id, notification_type=value) for value in notification_types],
+        ignore_conflicts=True,
+    )
+
+
+@receiver(post_delete, sender=EmailNotificationSettings)
+def delete_email_subscriptions(sender, instance, **kwargs):
+    EmailNotificationSubscription.objects.filter(user_id=instance.user_id).delete()
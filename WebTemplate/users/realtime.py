@@ -0,0 +1,50 @@
+"""
+Publishing of real-time notification events over the Channels layer.
+
+The Celery fan-out calls ``publish_notifications`` after writing a chunk of
+WebNotifications; every connected ``NotificationConsumer`` of the recipients
+receives the event within milliseconds. Delivery is best effort: the rows are
+already in the database, so a failure is logged and the page shows the
+notification on its next load.
+"""
+
+import logging
+from typing import Any, Iterable
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+
+from .consumers import notification_group
+
+
+logger = logging.getLogger(__name__)
+
+
+async def _group_send_all(channel_layer: Any, user_ids: list[int], event: dict[str, Any]) -> None:
+    for user_id in user_ids:
+        await channel_layer.group_send(notification_group(user_id), event)
+
+
+def publish_notifications(user_ids: Iterable[int], item_id: int, notification_type: str) -> None:
+    """
+    Push a ``notification.new`` event to the WebSocket groups of ``user_ids``.
+
+    All sends share one event loop round-trip through ``async_to_sync``.
+
+    Args:
+        user_ids (Iterable[int]): Recipients of the notification.
+        item_id (int): The ID of the item that triggered the notification.
+        notification_type (str): One of the NotificationTypes values.
+    """
+    channel_layer = get_channel_layer()
+    recipients: list[int] = list(user_ids)
+    if channel_layer is None or not recipients:
+        return
+    event: dict[str, Any] = {
+        "type": "notification.new",
+        "notification": {"item_id": item_id, "notification_type": notification_type},
+    }
+    try:
+        async_to_sync(_group_send_all)(channel_layer, recipients, event)
+    except Exception as e:
+        logger.warning("Real-time notification publish failed for item %s: %s", item_id, e)
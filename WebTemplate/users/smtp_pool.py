@@ -0,0 +1,274 @@
+"""
+Pooled SMTP transport for notification emails.
+
+Opening an SMTP session to the mail host costs a TCP handshake, STARTTLS and
+AUTH before the first byte of the message is sent. This module keeps a small
+pool of authenticated connections per worker process and reuses them across
+recipients and Celery tasks.
+
+Features:
+    - Connections are created lazily and reused until they have sent
+      ``max_messages_per_connection`` messages, then rotated.
+    - A dropped connection is reopened and the message retried once.
+    - ``send_batch`` delivers a whole recipient list over one session.
+    - The pool is bound to the process id, so forked Celery workers never
+      share a socket with their parent.
+
+Typical usage example:
+
+    pool = get_smtp_pool()
+    failures = pool.send_batch([OutgoingMessage(to="user@example.com", body=b"Subject: Hi\\n\\nHello")])
+"""
+
+import logging
+import os
+import queue
+import smtplib
+import ssl
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Iterator, Optional
+
+from celery.signals import worker_process_shutdown
+from django.conf import settings
+
+
+logger = logging.getLogger(__name__)
+
+
+def is_connection_error(error: BaseException) -> bool:
+    """
+    Tell whether ``error`` means the SMTP session is dead and must be reopened.
+
+    ``smtplib.SMTPException`` subclasses ``OSError``, so protocol-level rejections
+    (refused recipient, bad data) are excluded explicitly: the session is still
+    usable after them.
+    """
+    if isinstance(error, smtplib.SMTPServerDisconnected):
+        return True
+    return isinstance(error, OSError) and not isinstance(error, smtplib.SMTPException)
+
+
+@dataclass
+class OutgoingMessage:
+    """
+    A single message queued for delivery through the pool.
+
+    Attributes:
+        to: Recipient email address.
+        body: The full RFC 5322 message (headers and body) as bytes.
+        from_addr: Envelope sender. Defaults to the pool's from address.
+    """
+
+    to: str
+    body: bytes
+    from_addr: Optional[str] = None
+
+
+class PooledConnection:
+    """An authenticated ``smtplib.SMTP`` session and the number of messages it has sent."""
+
+    def __init__(self, smtp: smtplib.SMTP) -> None:
+        self.smtp: smtplib.SMTP = smtp
+        self.sent: int = 0
+
+    def close(self) -> None:
+        """Send QUIT, falling back to closing the socket if the server is gone."""
+        try:
+            self.smtp.quit()
+        except Exception:
+            self.smtp.close()
+
+    def reset(self) -> bool:
+        """Abort a mail transaction left open by RSET; False if the session is unusable."""
+        try:
+            self.smtp.rset()
+        except OSError:
+            return False
+        return True
+
+
+class SMTPConnectionPool:
+    """
+    Thread-safe pool of authenticated SMTP connections.
+
+    Args:
+        host: SMTP server host name.
+        port: SMTP server port.
+        username: Login for AUTH. No AUTH is performed when empty.
+        password: Password for AUTH.
+        use_tls: Whether to upgrade the session with STARTTLS.
+        from_addr: Default envelope sender.
+        max_connections: Maximum number of simultaneously open connections.
+        max_messages_per_connection: Messages sent before a connection is rotated.
+        timeout: Socket timeout in seconds.
+    """
+
+    def __init__(self, host: str, port: int, username: Optional[str] = None, password: Optional[str] = None,
+                 use_tls: bool = True, from_addr: Optional[str] = None, max_connections: int = 2,
+                 max_messages_per_connection: int = 100, timeout: float = 30.0) -> None:
+        self.host: str = host
+        self.port: int = port
+        self.username: Optional[str] = username
+        self.password: Optional[str] = password
+        self.use_tls: bool = use_tls
+        self.from_addr: Optional[str] = from_addr
+        self.max_messages_per_connection: int = max(1, max_messages_per_connection)
+        self.timeout: float = timeout
+        self._idle: queue.LifoQueue[PooledConnection] = queue.LifoQueue()
+        self._slots: threading.BoundedSemaphore = threading.BoundedSemaphore(max(1, max_connections))
+        self.connections_opened: int = 0
+
+    def _connect(self) -> smtplib.SMTP:
+        """Open, secure and authenticate a new SMTP session."""
+        smtp: smtplib.SMTP = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        smtp.ehlo()
+        if self.use_tls:
+            smtp.starttls(context=ssl.create_default_context())
+            smtp.ehlo()
+        if self.username:
+            smtp.login(self.username, self.password or "")
+        self.connections_opened += 1
+        logger.debug("Opened SMTP connection #%s to %s:%s", self.connections_opened, self.host, self.port)
+        return smtp
+
+    def _reopen(self, conn: PooledConnection) -> None:
+        """Replace the session of ``conn`` with a fresh one and reset its counter."""
+        conn.close()
+        conn.smtp = self._connect()
+        conn.sent = 0
+
+    @contextmanager
+    def connection(self) -> Iterator[PooledConnection]:
+        """
+        Check out a connection for the duration of the ``with`` block.
+
+        The connection is returned to the pool afterwards unless it reached the
+        per-connection message cap or was dropped, in which case it is closed.
+        If the block raises, a possibly half-finished transaction is aborted
+        with RSET first, and the connection is closed if that fails.
+        """
+        self._slots.acquire()
+        conn: Optional[PooledConnection] = None
+        try:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                conn = PooledConnection(self._connect())
+            yield conn
+        except BaseException as e:
+            if conn is not None and (is_connection_error(e) or not conn.reset()):
+                conn.smtp.close()
+                conn = None
+            raise
+        finally:
+            if conn is not None:
+                if conn.sent >= self.max_messages_per_connection:
+                    conn.close()
+                else:
+                    self._idle.put(conn)
+            self._slots.release()
+
+    def _send_one(self, conn: PooledConnection, message: OutgoingMessage) -> None:
+        """Send one message on ``conn``, reopening the session once if the server dropped it."""
+        from_addr: Optional[str] = message.from_addr or self.from_addr
+        if conn.sent >= self.max_messages_per_connection:
+            self._reopen(conn)
+        try:
+            conn.smtp.sendmail(from_addr, message.to, message.body)
+        except OSError as e:
+            if not is_connection_error(e):
+                raise
+            logger.info("SMTP connection to %s dropped, reconnecting", self.host)
+            self._reopen(conn)
+            conn.smtp.sendmail(from_addr, message.to, message.body)
+        conn.sent += 1
+
+    def send_batch(self, messages: list[OutgoingMessage]) -> dict[str, str]:
+        """
+        Deliver several messages over a single checked-out session.
+
+        Args:
+            messages: Messages to send, in order.
+
+        Returns:
+            dict[str, str]: Recipient address mapped to the error text for every
+            message that could not be delivered. Empty when all succeeded.
+
+        Raises:
+            smtplib.SMTPException: If the connection cannot be re-established.
+        """
+        failures: dict[str, str] = {}
+        if not messages:
+            return failures
+        with self.connection() as conn:
+            for message in messages:
+                try:
+                    self._send_one(conn, message)
+                except (smtplib.SMTPRecipientsRefused, smtplib.SMTPDataError, smtplib.SMTPSenderRefused) as e:
+                    failures[message.to] = str(e)
+        return failures
+
+    def send(self, to: str, body: bytes, from_addr: Optional[str] = None) -> None:
+        """
+        Deliver a single message.
+
+        Raises:
+            smtplib.SMTPException: If the message was rejected.
+        """
+        failures: dict[str, str] = self.send_batch([OutgoingMessage(to=to, body=body, from_addr=from_addr)])
+        if failures:
+            raise smtplib.SMTPException(failures[to])
+
+    def close_all(self) -> None:
+        """Close every idle connection in the pool."""
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+_pool: Optional[SMTPConnectionPool] = None
+_pool_pid: Optional[int] = None
+_pool_lock: threading.Lock = threading.Lock()
+
+
+def get_smtp_pool() -> SMTPConnectionPool:
+    """
+    Return the SMTP pool of the current process, creating it on first use.
+
+    The pool is configured from the EMAIL_* Django settings and is recreated
+    after a fork so child processes never reuse the parent's sockets.
+    """
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = SMTPConnectionPool(
+                host=settings.EMAIL_HOST,
+                port=settings.EMAIL_PORT,
+                username=settings.EMAIL_HOST_USER,
+                password=settings.EMAIL_HOST_PASSWORD,
+                use_tls=settings.EMAIL_USE_TLS,
+                from_addr=settings.DEFAULT_FROM_EMAIL,
+                max_connections=getattr(settings, 'EMAIL_POOL_MAX_CONNECTIONS', 2),
+                max_messages_per_connection=getattr(settings, 'EMAIL_POOL_MAX_MESSAGES_PER_CONNECTION', 100),
+                timeout=getattr(settings, 'EMAIL_TIMEOUT', None) or 30.0,
+            )
+            _pool_pid = os.getpid()
+        return _pool
+
+
+def reset_smtp_pool() -> None:
+    """Close and forget the current process' pool (used on shutdown and in tests)."""
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close_all()
+        _pool, _pool_pid = None, None
+
+
+@worker_process_shutdown.connect
+def _close_pool_on_shutdown(**kwargs) -> None:
+    reset_smtp_pool()
@@ -1,6 +1,8 @@
 import os
 from django.test import TestCase, Client, override_settings
-from .models import Organization, Demo, PaymentHistory, TariffModel
+from .models import Organization, Demo, PaymentHistory, TariffModel, EmailNotificationSettings, EmailNotificationSubscription, NotificationTypes, WebNotifications
+from .helpers import close_item_notifications
+from .unread_counter import counter_key, get_unread_count, increment_unread, reconcile_unread_counters
 from .forms import AddUserForm
 from django.urls import reverse
 from django.contrib.auth.models import User, Group
@@ -11,6 +13,16 @@ from django.utils.http import urlsafe_base64_encode
 from django.utils.encoding import force_bytes
 from django.core.mail import send_mail
 from unittest.mock import patch
+from aiosmtpd.controller import Controller
+import fakeredis
+from asgiref.sync import sync_to_async
+from channels.testing import WebsocketCommunicator
+from .consumers import NotificationConsumer
+from .realtime import publish_notifications
+from WebTemplate.redis_client import set_redis
+from main_app.models import BusinessLogicModel
+from .smtp_pool import OutgoingMessage, SMTPConnectionPool, reset_smtp_pool
+from .utlis import notify_email_batch, match_status_n_preferences, rebuild_email_subscriptions, resolve_email_audience
 
 
 class DemoBookingTests(TestCase):
@@ -666,3 +678,212 @@ class TariffPageTests(TestCase):
             self.assertEqual(response.status_code, 200)
             self.assertContains(response, "An unexpected error occurred.")
 
+
+class _CollectingHandler:
+    def __init__(self):
+        self.messages = []
+
+    async def handle_DATA(self, server, session, envelope):
+        self.messages.append(envelope)
+        return '250 OK'
+
+
+class SMTPPoolTests(TestCase):
+    def setUp(self):
+        self.handler = _CollectingHandler()
+        self.controller = Controller(self.handler, hostname='127.0.0.1', port=8026)
+        self.controller.start()
+        self.addCleanup(self.controller.stop)
+        self.addCleanup(reset_smtp_pool)
+
+    def _pool(self, **kwargs):
+        pool = SMTPConnectionPool('127.0.0.1', 8026, use_tls=False, from_addr='noreply@test.ru', **kwargs)
+        self.addCleanup(pool.close_all)
+        return pool
+
+    def _messages(self, count):
+        return [OutgoingMessage(to=f"user{i}@test.ru", body=b"Subject: test\n\nbody") for i in range(count)]
+
+    def test_batch_reuses_one_connection(self):
+        pool = self._pool()
+        self.assertEqual(pool.send_batch(self._messages(5)), {})
+        pool.send_batch(self._messages(3))
+        self.assertEqual(len(self.handler.messages), 8)
+        self.assertEqual(pool.connections_opened, 1)
+
+    def test_messages_per_connection_cap(self):
+        pool = self._pool(max_messages_per_connection=2)
+        pool.send_batch(self._messages(5))
+        self.assertEqual(len(self.handler.messages), 5)
+        self.assertEqual(pool.connections_opened, 3)
+
+    def test_reconnects_after_dropped_connection(self):
+        pool = self._pool()
+        pool.send_batch(self._messages(1))
+        with pool.connection() as conn:
+            conn.smtp.close()
+        pool.send_batch(self._messages(2))
+        self.assertEqual(len(self.handler.messages), 3)
+        self.assertEqual(pool.connections_opened, 2)
+
+    def test_failed_block_leaves_no_open_transaction(self):
+        pool = self._pool()
+        with self.assertRaises(ValueError):
+            with pool.connection() as conn:
+                conn.smtp.mail('noreply@test.ru')
+                raise ValueError("rendering failed")
+        pool.send_batch(self._messages(1))
+        self.assertEqual(len(self.handler.messages), 1)
+        self.assertEqual(pool.connections_opened, 1)
+
+    @override_settings(EMAIL_HOST='127.0.0.1', EMAIL_PORT=8026, EMAIL_USE_TLS=False, EMAIL_HOST_USER='', DEFAULT_FROM_EMAIL='noreply@test.ru')
+    def test_notify_email_batch(self):
+        reset_smtp_pool()
+        self.assertEqual(notify_email_batch(1, 'Тип 1', ['first@test.ru', 'second@test.ru']), {})
+        self.assertEqual([m.rcpt_tos for m in self.handler.messages], [['first@test.ru'], ['second@test.ru']])
+
+
+class NotificationSubscriptionTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='subscriber', password='test', email='subscriber@test.ru')
+        self.user_2 = User.objects.create_user(username='subscriber_2', password='test', email='subscriber_2@test.ru')
+
+    def test_settings_save_syncs_subscriptions(self):
+        settings = EmailNotificationSettings.objects.create(user=self.user, notification_types=[NotificationTypes.type_1, NotificationTypes.type_2])
+        EmailNotificationSettings.objects.create(user=self.user_2, notification_types=[NotificationTypes.type_2])
+        self.assertEqual(set(match_status_n_preferences(NotificationTypes.type_1)), {self.user.id})
+        self.assertEqual(set(match_status_n_preferences(NotificationTypes.type_2)), {self.user.id, self.user_2.id})
+
+        settings.notification_types = [NotificationTypes.type_3]
+        settings.save()
+        self.assertEqual(set(match_status_n_preferences(NotificationTypes.type_1)), set())
+        self.assertEqual(set(match_status_n_preferences(NotificationTypes.type_3)), {self.user.id})
+
+    def test_match_status_n_preferences_single_query(self):
+        EmailNotificationSettings.objects.create(user=self.user, notification_types=[NotificationTypes.type_1])
+        with self.assertNumQueries(1):
+            self.assertEqual(list(match_status_n_preferences(NotificationTypes.type_1)), [self.user.id])
+
+    def test_match_status_n_preferences_unknown_status(self):
+        self.assertIsNone(match_status_n_preferences('unknown'))
+
+    def test_rebuild_email_subscriptions(self):
+        EmailNotificationSettings.objects.bulk_create([
+            EmailNotificationSettings(user=self.user, notification_types=[NotificationTypes.type_1, NotificationTypes.type_3, 'unknown']),
+            EmailNotificationSettings(user=self.user_2, notification_types=[NotificationTypes.type_3]),
+        ])
+        self.assertFalse(EmailNotificationSubscription.objects.exists())
+        self.assertEqual(rebuild_email_subscriptions(batch_size=1), 3)
+        self.assertEqual(rebuild_email_subscriptions(), 3)
+        self.assertEqual(EmailNotificationSubscription.objects.count(), 3)
+        self.assertEqual(set(match_status_n_preferences(NotificationTypes.type_3)), {self.user.id, self.user_2.id})
+
+    def test_rebuild_email_subscriptions_removes_drift(self):
+        EmailNotificationSettings.objects.create(user=self.user, notification_types=[NotificationTypes.type_1])
+        EmailNotificationSettings.objects.bulk_create([EmailNotificationSettings(user=self.user_2, notification_types=[])])
+        EmailNotificationSubscription.objects.bulk_create([
+            EmailNotificationSubscription(user=self.user, notification_type=NotificationTypes.type_2),
+            EmailNotificationSubscription(user=self.user_2, notification_type=NotificationTypes.type_3),
+        ])
+        outsider = User.objects.create_user(username='outsider', password='test')
+        EmailNotificationSubscription.objects.create(user=outsider, notification_type=NotificationTypes.type_1)
+
+        self.assertEqual(rebuild_email_subscriptions(batch_size=1), 1)
+        self.assertEqual(list(EmailNotificationSubscription.objects.values_list('user_id', 'notification_type')),
+                         [(self.user.id, NotificationTypes.type_1)])
+
+    def test_resolve_email_audience_single_query(self):
+        sender = User.objects.create_user(username='sender', password='test', email='sender@test.ru')
+        no_email = User.objects.create_user(username='no_email', password='test')
+        outsider = User.objects.create_user(username='outsider', password='test', email='outsider@test.ru')
+        for user in (self.user, sender, no_email, outsider):
+            EmailNotificationSettings.objects.create(user=user, notification_types=[NotificationTypes.type_1])
+        EmailNotificationSettings.objects.create(user=self.user_2, notification_types=[NotificationTypes.type_2])
+
+        related = [self.user.id, self.user_2.id, sender.id, no_email.id, self.user.id]
+        with self.assertNumQueries(1):
+            emails = resolve_email_audience(NotificationTypes.type_1, related, sender.id)
+        self.assertEqual(emails, ['subscriber@test.ru'])
+        self.assertIsNone(resolve_email_audience('unknown', related, sender.id))
+
+
+class UnreadCounterTests(TestCase):
+    def setUp(self):
+        self.redis = fakeredis.FakeRedis()
+        set_redis(self.redis)
+        self.addCleanup(set_redis, None)
+        self.user = User.objects.create_user(username='reader', password='test')
+        self.item = BusinessLogicModel.objects.create()
+        self.other_item = BusinessLogicModel.objects.create()
+        WebNotifications.objects.create(item=self.item, user=self.user)
+        WebNotifications.objects.create(item=self.other_item, user=self.user)
+
+    def test_rebuilds_on_miss_then_reads_from_redis(self):
+        self.assertEqual(get_unread_count(self.user.id), 2)
+        with self.assertNumQueries(0):
+            self.assertEqual(get_unread_count(self.user.id), 2)
+
+    def test_increment_only_existing_counters(self):
+        increment_unread([self.user.id])
+        self.assertIsNone(self.redis.get(counter_key(self.user.id)))
+        get_unread_count(self.user.id)
+        WebNotifications.objects.create(item=self.item, user=self.user)
+        increment_unread([self.user.id])
+        self.assertEqual(get_unread_count(self.user.id), 3)
+
+    def test_increment_during_rebuild_is_not_lost(self):
+        def count_then_notify(user_id):
+            # A notification committed after the count was read
+            count = WebNotifications.objects.filter(is_new=True, user_id=user_id).count()
+            WebNotifications.objects.create(item=self.item, user=self.user)
+            increment_unread([user_id])
+            return count
+
+        with patch('users.unread_counter.count_unread_in_db', side_effect=count_then_notify):
+            self.assertEqual(get_unread_count(self.user.id), 2)
+        self.assertIsNone(self.redis.get(counter_key(self.user.id)))
+        self.assertEqual(get_unread_count(self.user.id), 3)
+
+    def test_close_item_notifications_updates_counter(self):
+        get_unread_count(self.user.id)
+        close_item_notifications(self.item.id)
+        self.assertEqual(get_unread_count(self.user.id), 1)
+        close_item_notifications(self.user.id, self.other_item.id)
+        self.assertEqual(get_unread_count(self.user.id), 0)
+
+    def test_reconcile_fixes_drift(self):
+        get_unread_count(self.user.id)
+        self.redis.set(counter_key(self.user.id), 40)
+        self.assertEqual(reconcile_unread_counters(), (1, 1))
+        self.assertEqual(get_unread_count(self.user.id), 2)
+
+
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+class NotificationConsumerTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='listener', password='test')
+        self.other = User.objects.create_user(username='other', password='test')
+
+    async def _connect(self, user):
+        communicator = WebsocketCommunicator(NotificationConsumer.as_asgi(), "/ws/notifications/")
+        communicator.scope['user'] = user
+        connected, code = await communicator.connect()
+        return communicator, connected, code
+
+    async def test_anonymous_connection_rejected(self):
+        from django.contrib.auth.models import AnonymousUser
+        communicator, connected, code = await self._connect(AnonymousUser())
+        self.assertFalse(connected)
+        self.assertEqual(code, 4401)
+
+    async def test_published_notification_reaches_only_recipient(self):
+        communicator, connected, _ = await self._connect(self.user)
+        other_communicator, _, _ = await self._connect(self.other)
+        self.assertTrue(connected)
+
+        await sync_to_async(publish_notifications)([self.user.id], 7, NotificationTypes.type_1)
+        self.assertEqual(await communicator.receive_json_from(), {'item_id': 7, 'notification_type': NotificationTypes.type_1})
+        self.assertTrue(await other_communicator.receive_nothing())
+
+        await communicator.disconnect()
+        await other_communicator.disconnect()
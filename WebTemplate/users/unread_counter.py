@@ -0,0 +1,197 @@
+"""
+Per-user unread notification counters stored in Redis.
+
+The bell badge needs the number of new WebNotifications of the current user on
+every page. Instead of a ``COUNT(*)`` per request, the count is kept in a Redis
+key ``unread:<user_id>``:
+
+    - ``get_unread_count`` reads the key and, on a miss, counts once in the
+      database and stores the result with a TTL.
+    - ``increment_unread`` is called after notifications are written. It only
+      bumps keys that already exist, so a missing key is always rebuilt from
+      the database rather than started from a wrong baseline.
+    - ``reset_unread`` and ``invalidate_unread`` are called when notifications
+      are marked as read.
+    - An increment or invalidation that finds no counter bumps the user's
+      generation key ``unread_generation:<user_id>`` instead. A rebuild only
+      stores its count if the generation is unchanged since it started, so a
+      count read before notifications were committed is never cached.
+    - ``reconcile_unread_counters`` fixes drift and is run by the
+      ``reconcile_unread_counters`` management command.
+
+Redis errors never break a page: reads fall back to the database count and
+writes are logged and skipped.
+"""
+
+import logging
+from typing import Iterable
+
+from django.conf import settings
+from django.db.models import Count
+from redis.exceptions import RedisError
+
+from WebTemplate.redis_client import get_redis
+from .models import WebNotifications
+
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX: str = "unread:"
+GENERATION_PREFIX: str = "unread_generation:"
+
+# Increment only the counters that exist; missing ones are rebuilt lazily, and
+# bumping their generation keeps a rebuild in progress from storing its count.
+# KEYS holds (counter, generation) pairs.
+_INCREMENT_IF_EXISTS: str = """
+for index = 1, #KEYS, 2 do
+    if redis.call('EXISTS', KEYS[index]) == 1 then
+        redis.call('INCRBY', KEYS[index], ARGV[1])
+    else
+        redis.call('INCR', KEYS[index + 1])
+        redis.call('EXPIRE', KEYS[index + 1], ARGV[2])
+    end
+end
+return 0
+"""
+
+# Store a rebuilt count only if the generation did not change since it was read
+_SET_IF_GENERATION: str = """
+if (redis.call('GET', KEYS[2]) or '0') == ARGV[1] then
+    redis.call('SET', KEYS[1], ARGV[2], 'EX', ARGV[3], 'NX')
+    return 1
+end
+return 0
+"""
+
+
+def counter_key(user_id: int) -> str:
+    """Return the Redis key of a user's unread counter."""
+    return f"{KEY_PREFIX}{user_id}"
+
+
+def generation_key(user_id: int) -> str:
+    """Return the Redis key counting the changes to a user's missing counter."""
+    return f"{GENERATION_PREFIX}{user_id}"
+
+
+def _ttl() -> int:
+    return getattr(settings, 'UNREAD_COUNTER_TTL', 24 * 60 * 60)
+
+
+def count_unread_in_db(user_id: int) -> int:
+    """Count the user's new notifications in the database."""
+    return WebNotifications.objects.filter(is_new=True, user_id=user_id).count()
+
+
+def get_unread_count(user_id: int) -> int:
+    """
+    Return the number of new notifications of a user.
+
+    Args:
+        user_id (int): The ID of the user.
+
+    Returns:
+        int: The cached count, or the database count on a cache miss.
+    """
+    try:
+        value, generation = get_redis().mget(counter_key(user_id), generation_key(user_id))
+    except RedisError as e:
+        logger.warning("Unread counter read failed for user %s: %s", user_id, e)
+        return count_unread_in_db(user_id)
+    if value is not None:
+        return int(value)
+
+    count: int = count_unread_in_db(user_id)
+    try:
+        get_redis().eval(_SET_IF_GENERATION, 2, counter_key(user_id), generation_key(user_id),
+                         (generation or b'0').decode(), count, _ttl())
+    except RedisError as e:
+        logger.warning("Unread counter rebuild failed for user %s: %s", user_id, e)
+    return count
+
+
+def increment_unread(user_ids: Iterable[int], amount: int = 1) -> None:
+    """
+    Add ``amount`` new notifications to the counters of ``user_ids``.
+
+    Args:
+        user_ids (Iterable[int]): Recipients of the new notifications.
+        amount (int): Number of notifications each user received.
+    """
+    keys: list[str] = [key for user_id in user_ids for key in (counter_key(user_id), generation_key(user_id))]
+    if not keys:
+        return
+    try:
+        get_redis().eval(_INCREMENT_IF_EXISTS, len(keys), *keys, amount, _ttl())
+    except RedisError as e:
+        logger.warning("Unread counter increment failed for %s users: %s", len(keys) // 2, e)
+
+
+def reset_unread(user_ids: Iterable[int]) -> None:
+    """Set the counters of ``user_ids`` to zero after all their notifications were read."""
+    try:
+        pipe = get_redis().pipeline(transaction=False)
+        for user_id in user_ids:
+            pipe.set(counter_key(user_id), 0, ex=_ttl())
+        pipe.execute()
+    except RedisError as e:
+        logger.warning("Unread counter reset failed: %s", e)
+
+
+def invalidate_unread(user_ids: Iterable[int]) -> None:
+    """Drop the counters of ``user_ids`` so the next read rebuilds them from the database."""
+    user_ids = list(user_ids)
+    if not user_ids:
+        return
+    try:
+        pipe = get_redis().pipeline(transaction=True)
+        for user_id in user_ids:
+            pipe.delete(counter_key(user_id))
+            pipe.incr(generation_key(user_id))
+            pipe.expire(generation_key(user_id), _ttl())
+        pipe.execute()
+    except RedisError as e:
+        logger.warning("Unread counter invalidation failed for %s users: %s", len(user_ids), e)
+
+
+def reconcile_unread_counters(batch_size: int = 500) -> tuple[int, int]:
+    """
+    Compare every cached counter with the database and fix the ones that drifted.
+
+    Args:
+        batch_size (int): Number of counters checked per database query.
+
+    Returns:
+        tuple[int, int]: Number of counters checked and number corrected.
+    """
+    redis_client = get_redis()
+    checked: int = 0
+    fixed: int = 0
+    batch: list[bytes] = []
+
+    def flush(keys: list[bytes]) -> int:
+        user_ids: list[int] = [int(key.decode()[len(KEY_PREFIX):]) for key in keys]
+        cached: list = redis_client.mget(keys)
+        actual: dict[int, int] = dict(
+            WebNotifications.objects.filter(is_new=True, user_id__in=user_ids)
+            .values('user_id').annotate(unread=Count('id')).values_list('user_id', 'unread')
+        )
+        pipe = redis_client.pipeline(transaction=False)
+        corrected: int = 0
+        for user_id, value in zip(user_ids, cached):
+            if value is not None and int(value) != actual.get(user_id, 0):
+                pipe.set(counter_key(user_id), actual.get(user_id, 0), ex=_ttl())
+                corrected += 1
+        pipe.execute()
+        return corrected
+
+    for key in redis_client.scan_iter(match=f"{KEY_PREFIX}*", count=batch_size):
+        batch.append(key)
+        if len(batch) >= batch_size:
+            fixed += flush(batch)
+            checked += len(batch)
+            batch = []
+    if batch:
+        fixed += flush(batch)
+        checked += len(batch)
+    return checked, fixed
@@ -1,41 +1,176 @@
-import os
-import smtplib
-import ssl
-from typing import Optional, Union
+from typing import Iterable, Optional, Union
 
 from django.contrib.auth.models import User
+from django.db import transaction
 from django.db.models import QuerySet
 
-from .models import EmailNotificationSettings, NotificationTypes
+from .models import EmailNotificationSettings, EmailNotificationSubscription, NotificationTypes
+from .smtp_pool import OutgoingMessage, get_smtp_pool
 
 
-def match_status_n_preferences(status: str) -> Optional[QuerySet[EmailNotificationSettings]]:
+def match_status_n_preferences(status: str) -> Optional[QuerySet[int]]:
     """
-    Matches a notification status to the corresponding EmailNotificationSettings.
+    Returns the ids of users subscribed to email notifications of the given type.
+
+    The lookup goes through EmailNotificationSubscription, whose unique
+    (notification_type, user) index answers it with a single index-only scan.
+    Users who selected several types are matched as well.
 
     Args:
         status (str): The status string identifying the notification type (e.g., from NotificationTypes).
 
     Returns:
-        Optional[QuerySet[EmailNotificationSettings]]: A QuerySet of matching settings if found,
-        otherwise None.
-    """
-    if status == NotificationTypes.type_1:
-        notification_preferences: QuerySet[EmailNotificationSettings] = EmailNotificationSettings.objects.filter(notification_types=NotificationTypes.type_1)
-    elif status == NotificationTypes.type_2:
-        notification_preferences = EmailNotificationSettings.objects.filter(notification_types=NotificationTypes.type_2)
-    elif status == NotificationTypes.type_3:
-        notification_preferences = EmailNotificationSettings.objects.filter(notification_types=NotificationTypes.type_3)
-    else:
+        Optional[QuerySet[int]]: A lazy QuerySet of subscribed user ids if the
+        status is a known notification type, otherwise None. It can be
+        iterated or used as a subquery.
+    """
+    if status not in NotificationTypes.values:
         return None
-    return notification_preferences
+    return EmailNotificationSubscription.objects.filter(notification_type=status).values_list('user_id', flat=True)
+
+
+def _sync_subscription_batch(desired: dict[int, set[str]]) -> int:
+    """Makes the subscriptions of the users in ``desired`` match it; returns the number of pairs."""
+    stale: list[int] = [
+        pk for pk, user_id, notification_type
+        in EmailNotificationSubscription.objects.filter(user_id__in=desired).values_list('id', 'user_id', 'notification_type')
+        if notification_type not in desired[user_id]
+    ]
+    if stale:
+        EmailNotificationSubscription.objects.filter(id__in=stale).delete()
+    pairs: list[EmailNotificationSubscription] = [
+        EmailNotificationSubscription(user_id=user_id, notification_type=value)
+        for user_id, values in desired.items() for value in values
+    ]
+    EmailNotificationSubscription.objects.bulk_create(pairs, ignore_conflicts=True)
+    return len(pairs)
+
+
+def rebuild_email_subscriptions(batch_size: int = 2000) -> int:
+    """
+    Rebuilds EmailNotificationSubscription rows from EmailNotificationSettings.
 
+    Converts the JSON lists stored before subscriptions were normalized and
+    repairs any drift: missing pairs are inserted, and pairs whose type is no
+    longer selected (or whose user has no settings left) are deleted, all in
+    one transaction. Safe to run repeatedly.
+
+    Args:
+        batch_size (int): Number of users whose subscriptions are synced per batch.
 
-def notify_email(pk: Union[int, str], message_type: str, receiver_id: int, sender_id: int) -> None:
+    Returns:
+        int: Number of (user, notification type) pairs found in the settings.
+    """
+    total: int = 0
+    desired: dict[int, set[str]] = {}
+    with transaction.atomic():
+        EmailNotificationSubscription.objects.exclude(
+            user_id__in=EmailNotificationSettings.objects.values('user_id'),
+        ).delete()
+        settings_rows = (EmailNotificationSettings.objects.order_by('user_id')
+                         .values_list('user_id', 'notification_types').iterator(chunk_size=batch_size))
+        for user_id, notification_types in settings_rows:
+            # Rows are ordered by user, so all settings of a user land in the same batch
+            if len(desired) >= batch_size and user_id not in desired:
+                total += _sync_subscription_batch(desired)
+                desired = {}
+            desired.setdefault(user_id, set()).update(
+                value for value in notification_types or [] if value in NotificationTypes.values
+            )
+        total += _sync_subscription_batch(desired)
+    return total
+
+
+def build_notification_message(pk: Union[int, str], message_type: str) -> bytes:
+    """
+    Builds the raw notification email (headers and body) for an item.
+
+    Args:
+        pk (Union[int, str]): The primary key of the object related to the notification.
+        message_type (str): Description of the notification type to include in the email body.
+
+    Returns:
+        bytes: The UTF-8 encoded message ready to be passed to ``sendmail``.
+    """
+    subject: str = "Оповещение ХХХХХ"
+    status_message: str = f"""
+        Новое оповещение - {message_type}.
+        Some text here XXXXX
+        Ссылка на объект: https://XXXXXX/XXXXXXX/{pk} .
+        """
+    return f"Subject:{subject}\n\n{status_message}".encode('utf-8')
+
+
+def build_digest_message(pk: Union[int, str], message_types: list[str]) -> bytes:
+    """
+    Builds one digest email for several notifications about the same item.
+
+    Args:
+        pk (Union[int, str]): The primary key of the object related to the notifications.
+        message_types (list[str]): Descriptions of the merged notifications, oldest first.
+
+    Returns:
+        bytes: The UTF-8 encoded message ready to be passed to ``sendmail``.
+    """
+    if len(message_types) == 1:
+        return build_notification_message(pk, message_types[0])
+    subject: str = f"Оповещение ХХХХХ ({len(message_types)})"
+    events: str = "\n".join(f"        - {message_type}" for message_type in message_types)
+    status_message: str = f"""
+        Новые оповещения: {len(message_types)}.
+{events}
+        Ссылка на объект: https://XXXXXX/XXXXXXX/{pk} .
+        """
+    return f"Subject:{subject}\n\n{status_message}".encode('utf-8')
+
+
+def resolve_email_recipients(status: str, item_related_user_ids: Iterable[int], sender_id: Optional[int]) -> Optional[list[tuple[int, str]]]:
+    """
+    Returns the (user id, email address) pairs that should receive a notification, in one query.
+
+    The database intersects the subscribers of ``status`` with the users
+    related to the item, drops the sender and users without an email address,
+    and returns the addresses in the same round-trip.
+
+    Args:
+        status (str): The notification type (one of NotificationTypes).
+        item_related_user_ids (Iterable[int]): IDs of the users related to the item.
+        sender_id (Optional[int]): The ID of the User triggering the notification.
+
+    Returns:
+        Optional[list[tuple[int, str]]]: User ids with their email addresses,
+        or None if ``status`` is not a known notification type.
+    """
+    subscribers: Optional[QuerySet[int]] = match_status_n_preferences(status)
+    if subscribers is None:
+        return None
+    audience: QuerySet[User] = User.objects.filter(id__in=set(item_related_user_ids)).filter(id__in=subscribers)
+    if sender_id is not None:
+        audience = audience.exclude(id=sender_id)
+    return list(audience.exclude(email="").values_list('id', 'email'))
+
+
+def resolve_email_audience(status: str, item_related_user_ids: Iterable[int], sender_id: Optional[int]) -> Optional[list[str]]:
+    """
+    Returns the email addresses that should receive a notification, in one query.
+
+    See resolve_email_recipients for the filtering rules.
+
+    Returns:
+        Optional[list[str]]: Email addresses of the audience, or None if
+        ``status`` is not a known notification type.
+    """
+    recipients: Optional[list[tuple[int, str]]] = resolve_email_recipients(status, item_related_user_ids, sender_id)
+    if recipients is None:
+        return None
+    return [email_to for _, email_to in recipients]
+
+
+def notify_email(pk: Union[int, str], message_type: str, receiver_id: int, sender_id: int, email_to: Optional[str] = None) -> None:
     """
     Sends an email notification to a user.
 
-    Retrieves the receiver's email address and sends a notification email using SMTP.
+    Sends a notification email over the process-wide pooled SMTP connection.
     The email is only sent if the receiver is not the sender.
 
     Args:
@@ -43,6 +178,8 @@ def notify_email(pk: Union[int, str], message_type: str, receiver_id: int, sende
         message_type (str): Description of the notification type to include in the email body.
         receiver_id (int): The ID of the User receiving the email.
         sender_id (int): The ID of the User triggering the notification.
+        email_to (Optional[str]): The receiver's address if already known. The
+            User is only looked up when it is not given.
 
     Returns:
         None
@@ -51,31 +188,46 @@ def notify_email(pk: Union[int, str], message_type: str, receiver_id: int, sende
         User.DoesNotExist: If the receiver_id does not correspond to an existing User.
         smtplib.SMTPException: If an error occurs during SMTP communication.
     """
-    receiver: User = User.objects.get(id=receiver_id)
-    email_to: str = receiver.email
+    if receiver_id == sender_id:
+        return
+    if email_to is None:
+        email_to = User.objects.values_list('email', flat=True).get(id=receiver_id)
+    get_smtp_pool().send(email_to, build_notification_message(pk, message_type))
 
-    # TODO: Move SMTP configuration to settings or environment variables.
-    server: smtplib.SMTP = smtplib.SMTP('mail.hosting.reg.ru:587')
-    context: ssl.SSLContext = ssl.SSLContext(ssl.PROTOCOL_TLS)
-    server.ehlo()
-    server.starttls(context=context)
-    server.ehlo()
 
-    login: Optional[str] = os.environ.get('EMAIL_HOST_USER')
-    password: Optional[str] = os.environ.get('EMAIL_HOST_PASSWORD')
-    email_from: Optional[str] = os.environ.get('DEFAULT_FROM_EMAIL')
-    subject: str = "Оповещение ХХХХХ"
+def notify_email_batch(pk: Union[int, str], message_type: str, emails: Iterable[str]) -> dict[str, str]:
+    """
+    Sends the same notification email to several addresses over one SMTP session.
 
-    if receiver_id == sender_id:
-        pass
-    else:
-        status_message: str = f"""
-        Новое оповещение - {message_type}.
-        Some text here XXXXX
-        Ссылка на объект: https://XXXXXX/XXXXXXX/{pk} .
-        """
-        status_text: bytes = f"Subject:{subject}\n\n{status_message}".encode('utf-8')
+    Args:
+        pk (Union[int, str]): The primary key of the object related to the notification.
+        message_type (str): Description of the notification type to include in the email body.
+        emails (Iterable[str]): Recipient addresses, e.g. from resolve_email_audience.
+
+    Returns:
+        dict[str, str]: Email address mapped to the error text for every
+        recipient the server refused. Empty when all emails were accepted.
+
+    Raises:
+        smtplib.SMTPException: If the SMTP connection cannot be established.
+    """
+    body: bytes = build_notification_message(pk, message_type)
+    return get_smtp_pool().send_batch([OutgoingMessage(to=email_to, body=body) for email_to in emails])
+
+
+def notify_email_digest_batch(pk: Union[int, str], digests: dict[str, list[str]]) -> dict[str, str]:
+    """
+    Sends every recipient one digest email over a single SMTP session.
 
-        server.login(login, password)
-        server.sendmail(email_from, email_to, status_text)
-        server.quit()
\ No newline at end of file
+    Args:
+        pk (Union[int, str]): The primary key of the object related to the notifications.
+        digests (dict[str, list[str]]): Email address mapped to the message types to list.
+
+    Returns:
+        dict[str, str]: Email address mapped to the error text for every
+        recipient the server refused. Empty when all emails were accepted.
+    """
+    return get_smtp_pool().send_batch([
+        OutgoingMessage(to=email_to, body=build_digest_message(pk, message_types))
+        for email_to, message_types in digests.items()
+    ])
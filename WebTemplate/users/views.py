@@ -28,6 +28,7 @@ from .models import Organization, TariffModel, PaymentHistory, EmailNotification
 import logging
 from django.views.decorators.http import require_POST
 from .webhook_utils import get_client_ip, is_valid_yookassa_ip
+from .unread_counter import get_unread_count, reset_unread
 
 
 logger = logging.getLogger(__name__)
@@ -777,9 +778,10 @@ def show_notifications(request: HttpRequest) -> HttpResponse:
 
     Returns:
         HttpResponse: The rendered notifications page with a count of new notifications.
+        The count comes from the Redis unread counter.
     """
     notifications = WebNotifications.objects.filter(is_new=True, user_id=request.user.id)
-    notifications_count = notifications.count()
+    notifications_count = get_unread_count(request.user.id)
 
     context = {"notifications": notifications, "notifications_count": notifications_count}
     return render(request, 'user/show_notifications.html', context)
@@ -796,5 +798,6 @@ def clear_notifications(request: HttpRequest) -> HttpResponse:
     Returns:
         HttpResponse: A redirect to the show notifications page.
     """
-    WebNotifications.objects.filter(user=request.user.id).update(is_new=False)
+    WebNotifications.objects.filter(user=request.user.id, is_new=True).update(is_new=False)
+    reset_unread([request.user.id])
     return HttpResponseRedirect("accounts/show-notifications/")